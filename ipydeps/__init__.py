@@ -1 +1,46 @@
-from .ipydeps import pip
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from importlib import import_module
+
+import sys
+
+# public names and the submodule each one lives in, imported on first use
+# so that import ipydeps stays cheap in kernels that never call pip()
+lazy_attributes = {
+    'apip': 'aio',
+    'batch': 'ipydeps',
+    'flush': 'ipydeps',
+    'pip': 'ipydeps',
+    'plan': 'ipydeps',
+    'warmup': 'ipydeps',
+    'add_report_callback': 'report',
+    'remove_report_callback': 'report',
+    'install_notebook': 'scan',
+    'plan_notebook': 'scan',
+    'scan_notebook': 'scan',
+}
+
+__all__ = sorted(lazy_attributes) + ['load_ipython_extension']
+
+def __getattr__(name):
+    if name not in lazy_attributes:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+    value = getattr(import_module(f'.{lazy_attributes[name]}', __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(lazy_attributes))
+
+# module level __getattr__ arrived in 3.7
+if sys.version_info < (3, 7):
+    for _name in lazy_attributes:
+        globals()[_name] = __getattr__(_name)
+
+def load_ipython_extension(ipython):  # pylint: disable=unused-argument
+    '''
+    Lets kernels warm ipydeps up at start with %load_ext ipydeps
+    or c.InteractiveShellApp.extensions = ['ipydeps'].
+    '''
+    __getattr__('warmup')()
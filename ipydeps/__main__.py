@@ -1,8 +1,82 @@
 # vim: expandtab tabstop=4 shiftwidth=4
 
+from argparse import ArgumentParser
+
+import json
 import sys
 
-from . import pip
+from .ipydeps import pip
+
+def prefetch_main(argv):
+    from .ipydeps import prefetch  # pylint: disable=import-outside-toplevel
+
+    parser = ArgumentParser(prog='python -m ipydeps prefetch', description='Download packages into the ipydeps wheelhouse.')
+    parser.add_argument('packages', nargs='*')
+    parser.add_argument('-r', '--requirement', action='append', default=[], help='requirements file to prefetch')
+    parser.add_argument('--config', default=None, help='pip config name in the ipydeps config dir')
+    parser.add_argument('--use-pki', action='store_true')
+    args = parser.parse_args(argv)
+    return prefetch(args.packages, use_pki=args.use_pki, config=args.config, requirements=args.requirement)
+
+def scan_main(argv):
+    from .plans import plan_to_dict  # pylint: disable=import-outside-toplevel
+    from .scan import install_notebook, plan_notebook, plan_path  # pylint: disable=import-outside-toplevel
+
+    parser = ArgumentParser(prog='python -m ipydeps scan', description='Plan the installs ipydeps.pip() calls in a notebook need.')
+    parser.add_argument('notebook')
+    parser.add_argument('--install', action='store_true', help='run the plan after writing it')
+    parser.add_argument('--no-write', action='store_true', help="don't cache the plan next to the notebook")
+    args = parser.parse_args(argv)
+
+    if args.install:
+        install_notebook(args.notebook, write=not args.no_write)
+        return 0
+
+    plans = plan_notebook(args.notebook, write=not args.no_write)
+    print(json.dumps([{'options': options._asdict(), 'plan': plan_to_dict(plan)} for options, plan in plans], indent=2, sort_keys=True))
+
+    if not args.no_write:
+        print(f'Plan written to {plan_path(args.notebook)}', file=sys.stderr)
+
+    return 0
+
+def plan_main(argv):
+    from .ipydeps import plan  # pylint: disable=import-outside-toplevel
+    from .plans import plan_to_dict  # pylint: disable=import-outside-toplevel
+    from .scan import plan_notebook  # pylint: disable=import-outside-toplevel
+
+    parser = ArgumentParser(prog='python -m ipydeps --plan', description='Show what ipydeps would do, without installing anything.')
+    parser.add_argument('packages', nargs='*')
+    parser.add_argument('--notebook', action='append', default=[], help='plan the ipydeps.pip() calls in a notebook, printed as one JSON line')
+    parser.add_argument('--no-overrides', action='store_true')
+    parser.add_argument('--fetch-overrides', action='store_true', help='fetch the dependencies JSON instead of using the cached copy')
+    args = parser.parse_args(argv)
+    returncode = 0
+
+    if args.packages:
+        install_plan = plan(args.packages, use_overrides=not args.no_overrides, fetch_overrides=args.fetch_overrides)
+        print(json.dumps(plan_to_dict(install_plan), indent=2, sort_keys=True))
+
+    for notebook in args.notebook:
+        try:
+            plans = plan_notebook(notebook, write=False, fetch_overrides=args.fetch_overrides)
+            result = {'notebook': notebook, 'plans': [{'options': options._asdict(), 'plan': plan_to_dict(p)} for options, p in plans]}
+        except (OSError, ValueError) as e:
+            result = {'notebook': notebook, 'error': str(e)}
+            returncode = 1
+
+        print(json.dumps(result, sort_keys=True), flush=True)
+
+    return returncode
 
 if len(sys.argv) >= 2:
+    if sys.argv[1] == '--plan':
+        sys.exit(plan_main(sys.argv[2:]))
+
+    if sys.argv[1] == 'prefetch':
+        sys.exit(prefetch_main(sys.argv[2:]))
+
+    if sys.argv[1] == 'scan':
+        sys.exit(scan_main(sys.argv[2:]))
+
     pip(sys.argv[1:])
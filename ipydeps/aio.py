@@ -0,0 +1,373 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from collections import deque
+from functools import partial
+from os import environ
+from pathlib import Path
+from time import time
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+import asyncio
+import subprocess
+
+from .backends import PipBackend
+from .config import DEFAULT_OVERRIDE_WORKERS
+from .ipydeps import (
+    COMMAND_NOT_RUN,
+    STDERR_TAIL_LINES,
+    CommandResult,
+    OverrideCommand,
+    OverrideResult,
+    acquire_install_lock,
+    currently_installed,
+    decode_line,
+    exclusive_command_lock,
+    finish_install,
+    get_pkg_names,
+    invalidate_cache,
+    kill_process_group,
+    left_for_pip,
+    load_dependencies,
+    log_override_result,
+    override_satisfied,
+    overrides_capturable,
+    overrides_to_run,
+    pending_overrides,
+    pip_install_args,
+    pip_succeeded,
+    prepare_pip_command,
+    process_group_args,
+    record_install_result,
+    record_override_run,
+    release_install_lock,
+    restore_install_snapshot,
+    run_get_stderr,
+    run_pip,
+    save_install_snapshot,
+    setup_install,
+    start_install,
+    warm_installed_index,
+)
+from .logger import logger
+from .plans import InstallPlan
+from .probes import OverrideRuns, override_runs
+from .report import InstallReport, emit_report, reporting
+from .wheelhouse import wheelhouse_path
+
+# longest output line read from a command, pip progress output can be long
+STREAM_LIMIT = 2**20
+
+async def in_thread(func: Callable, *args):
+    '''
+    Runs blocking work (file system scans, HTTP, PKI) on the
+    default executor so the event loop stays responsive.
+    '''
+    return await asyncio.get_event_loop().run_in_executor(None, partial(func, *args))
+
+async def acquire_in_thread(acquire: Callable, release: Callable):
+    '''
+    Runs a blocking acquire, like taking a lock, on the default executor.
+    Cancelling the waiting task can't stop the thread, so if it's
+    cancelled, whatever the thread acquires is passed to release.
+    '''
+    future = asyncio.get_event_loop().run_in_executor(None, acquire)
+
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        def release_acquired(done):
+            if not done.cancelled() and done.exception() is None:
+                release(done.result())
+
+        future.add_done_callback(release_acquired)
+        raise
+
+async def read_stream(stream, on_text: Callable[[str], None]) -> None:
+    while True:
+        line = await stream.readline()
+
+        if not line:
+            return
+
+        on_text(decode_line(line))
+
+async def arun_get_stderr(
+    cmd,
+    env=None,
+    timeout: Optional[float]=None,
+    on_line: Optional[Callable[[str], None]]=None,
+    report: Optional[InstallReport]=None,
+) -> Tuple[int, Optional[str]]:
+    '''
+    The asyncio counterpart of run_get_stderr, with the same
+    streaming, stderr tail, timeout and exit code handling.  If the
+    task is cancelled, the command is killed before it's re-raised.
+    '''
+    if env is None:
+        env = environ
+
+    start = time()
+    err_tail: Deque[str] = deque(maxlen=STDERR_TAIL_LINES)
+
+    def record(returncode):
+        if report is not None:
+            report.record_subprocess(cmd, returncode, time() - start)
+
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *[str(c) for c in cmd],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+            limit=STREAM_LIMIT,
+            **process_group_args(),
+        )
+    except NotImplementedError:
+        # event loops without subprocess support (the selector loop on Windows)
+        returncode, err = await in_thread(partial(run_get_stderr, cmd, env=env, timeout=timeout, on_line=on_line))
+        record(returncode)
+        return returncode, err
+    except OSError as e:
+        record(COMMAND_NOT_RUN)
+        return COMMAND_NOT_RUN, str(e)
+
+    def on_stdout(text):
+        if on_line is not None:
+            on_line(text)
+
+    def on_stderr(text):
+        err_tail.append(text)
+        on_stdout(text)
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(read_stream(proc.stdout, on_stdout), read_stream(proc.stderr, on_stderr), proc.wait()),
+            timeout,
+        )
+        returncode = proc.returncode
+    except asyncio.TimeoutError:
+        kill_process_group(proc)
+        returncode = (await proc.wait()) or 1
+        err_tail.append(f'Timed out after {timeout}s: {" ".join(str(c) for c in cmd)}')
+    except asyncio.CancelledError:
+        # the command must not outlive the cancelled task
+        kill_process_group(proc)
+        await proc.wait()
+        raise
+
+    record(returncode)
+
+    if returncode == 0:
+        return returncode, None
+
+    return returncode, '\n'.join(err_tail)
+
+async def arun_override_command(command: OverrideCommand, timeout: Optional[float], report: InstallReport) -> CommandResult:
+    start = time()
+
+    if command.exclusive:
+        # shared with pip() in other threads, so take the same lock without blocking the loop
+        await acquire_in_thread(exclusive_command_lock.acquire, lambda acquired: exclusive_command_lock.release())
+
+        try:
+            returncode, err = await arun_get_stderr(command.args, timeout=timeout, report=report)
+        finally:
+            exclusive_command_lock.release()
+    else:
+        returncode, err = await arun_get_stderr(command.args, timeout=timeout, report=report)
+
+    return CommandResult(args=command.args, returncode=returncode, err=err, seconds=time() - start)
+
+async def arun_overrides(
+    overrides: Dict[str, Sequence],
+    max_workers: int=DEFAULT_OVERRIDE_WORKERS,
+    timeout: Optional[float]=None,
+    report: Optional[InstallReport]=None,
+    runs: Optional[OverrideRuns]=None,
+) -> Dict[str, OverrideResult]:
+    '''
+    Runs the overrides of up to max_workers packages at once, with the
+    same ordering and exclusivity rules as run_overrides.
+    '''
+    if len(overrides) == 0:
+        return {}
+
+    logger.info('Executing overrides for %s', ', '.join(sorted(overrides)))
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+
+    async def run_package(name, cmds):
+        async with semaphore:
+            start = time()
+            package_overrides, commands, skipped = overrides_to_run(name, cmds, runs)
+            results = []
+
+            for command in commands:
+                result = await arun_override_command(command, timeout, report)
+                await in_thread(record_override_run, runs, result)
+                results.append(result)
+
+            return OverrideResult(
+                name=name,
+                results=results,
+                seconds=time() - start,
+                skipped=[c.args for c in skipped],
+                satisfied=override_satisfied(package_overrides, len(commands) > 0),
+            )
+
+    results = await asyncio.gather(*[run_package(name, cmds) for name, cmds in overrides.items()])
+
+    for result in results:
+        log_override_result(result)
+
+    return {result.name: result for result in results}
+
+async def arun_pip(
+    packages: Sequence,
+    use_pki: bool,
+    verbose: bool,
+    pip_config_path: Optional[Path],
+    wheelhouse: Optional[Path]=None,
+    backend: Optional[PipBackend]=None,
+    timeout: Optional[float]=None,
+    report: Optional[InstallReport]=None,
+) -> Tuple[int, Optional[str]]:
+    '''
+    The asyncio counterpart of run_pip.
+    '''
+    if backend is None:
+        backend = PipBackend()
+
+    if backend.resident:
+        # the worker runs one command at a time for every thread, so wait for it off the loop
+        def run_pip_reporting():
+            with reporting(report):
+                return run_pip(packages, use_pki, verbose, pip_config_path, wheelhouse, backend, timeout)
+
+        return await in_thread(run_pip_reporting)
+
+    offline_args, args = pip_install_args(packages, verbose, wheelhouse, backend)
+    on_line = logger.info if verbose else None
+
+    if offline_args is not None:
+        cmd, env = prepare_pip_command(offline_args, False, pip_config_path, backend)
+        returncode, err = await arun_get_stderr(cmd, env=env, timeout=timeout, on_line=on_line, report=report)
+
+        if returncode == 0:
+            return returncode, err
+
+        logger.debug('Could not install %s from wheelhouse %s, using the package index', ', '.join(packages), wheelhouse)
+
+    # decrypting the PKI key can take a while, so do it off the loop
+    cmd, env = await in_thread(prepare_pip_command, args, use_pki, pip_config_path, backend)
+    return await arun_get_stderr(cmd, env=env, timeout=timeout, on_line=on_line, report=report)
+
+async def ainstall_packages(
+    requested_packages: Union[str, Sequence],
+    verbose: bool=False,
+    use_pki: bool=False,
+    use_overrides: bool=True,
+    config: Optional[str]=None,
+    installer: Optional[str]=None,
+    install_plan: Optional[InstallPlan]=None,
+) -> InstallReport:
+    '''
+    The asyncio counterpart of install_packages, with the same steps.
+    '''
+    report = InstallReport(get_pkg_names(requested_packages))
+    setup = setup_install(config, installer, report)
+
+    if setup is None:
+        report.finish()
+        return report
+
+    ipydeps_config = setup.ipydeps_config
+
+    # the overrides fetch and the installed package scan don't depend on each other
+    with report.phase('prefetch'):
+        jobs: List = [in_thread(warm_installed_index)]
+
+        if use_overrides and install_plan is None:
+            jobs.append(in_thread(load_dependencies, ipydeps_config))
+
+        await asyncio.gather(*jobs)
+
+    with report.phase('currently_installed'):
+        packages_before_install = currently_installed()
+
+    install_plan, requested_packages, dists_before = start_install(requested_packages, ipydeps_config, use_overrides, report, install_plan)
+
+    # waiting on another kernel's install must not block the loop
+    with report.phase('install_lock'):
+        lock, requested_packages = await acquire_in_thread(
+            partial(acquire_install_lock, setup.configs_path, requested_packages, dists_before),
+            lambda acquired: release_install_lock(acquired[0]),
+        )
+
+    try:
+        with report.phase('restore_snapshot'):
+            snapshot, requested_packages = await in_thread(restore_install_snapshot, requested_packages, ipydeps_config, use_overrides, dists_before, report)
+
+        succeeded = True
+        overrides = pending_overrides(install_plan, requested_packages)
+        override_results = {}
+
+        if overrides:
+            report.overrides = sorted(overrides)
+
+            with report.phase('run_overrides'):
+                runs = override_runs(setup.configs_path)
+                override_results = await arun_overrides(overrides, ipydeps_config.override_workers, ipydeps_config.command_timeout, report, runs)
+
+            succeeded = overrides_capturable(override_results)
+
+        packages_to_install = left_for_pip(override_results, requested_packages, report)
+
+        if len(packages_to_install) > 0:
+            with report.phase('run_pip'):
+                wheelhouse = wheelhouse_path(ipydeps_config, setup.configs_path)
+                returncode, err = await arun_pip(packages_to_install, use_pki, verbose, setup.pip_config_path, wheelhouse, setup.backend, ipydeps_config.command_timeout, report)
+
+            succeeded = pip_succeeded(returncode, err) and succeeded
+
+            with report.phase('invalidate_cache'):
+                await in_thread(invalidate_cache, dists_before)
+
+        if snapshot is not None and report.snapshot is None and succeeded:
+            with report.phase('save_snapshot'):
+                await in_thread(save_install_snapshot, snapshot, dists_before, report)
+
+        record_install_result(lock, report, succeeded)
+    finally:
+        release_install_lock(lock)
+
+    finish_install(packages_before_install, report)
+    report.finish()
+    emit_report(report, ipydeps_config.report_log)
+    logger.debug('Done')
+    return report
+
+async def apip(
+    requested_packages: Union[str, Sequence],
+    verbose: bool=False,
+    use_pki: bool=False,
+    use_overrides: bool=True,
+    config: Optional[str]=None,
+    report: bool=False,
+    installer: Optional[str]=None,
+) -> Optional[InstallReport]:
+    '''
+    Like ipydeps.pip(), but a coroutine: every subprocess, fetch and
+    scan runs without blocking the event loop, so the kernel keeps
+    handling comms and output during the install.
+
+        await ipydeps.apip(['numpy', 'pandas'])
+    '''
+    install_report = await ainstall_packages(
+        requested_packages,
+        verbose=verbose,
+        use_pki=use_pki,
+        use_overrides=use_overrides,
+        config=config,
+        installer=installer,
+    )
+    return install_report if report else None
@@ -0,0 +1,178 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from configparser import ConfigParser, Error as ConfigParserError
+from pathlib import Path
+from shutil import which
+from typing import Dict, List, Optional, Tuple
+
+import os
+import sys
+
+from .logger import logger
+
+class PipBackend:
+    '''
+    Runs installer commands through python -m pip
+    for the running interpreter.
+    '''
+    name = 'pip'
+    run_args = [sys.executable, '-m', 'pip']
+
+    # run commands in the resident worker (ipydeps.worker) instead of a new interpreter
+    resident = False
+
+    def available(self) -> bool:
+        return True
+
+    def verbose_args(self) -> List[str]:
+        return ['-vvv']
+
+    def prepare(
+        self,
+        args: List[str],
+        env: Dict[str, str],
+        pip_config_path: Optional[Path]=None,
+        client_cert: Optional[str]=None,
+        ca_path: Optional[str]=None,
+    ) -> Tuple[List[str], Dict[str, str]]:
+        '''
+        Turns pip-style arguments (subcommand first) into the full
+        command and environment for this backend.
+        '''
+        env = dict(env)
+
+        if pip_config_path:
+            env['PIP_CONFIG_FILE'] = str(pip_config_path)
+
+        extra = []
+
+        if client_cert:
+            extra.append(f'--client-cert={client_cert}')
+
+        if ca_path:
+            extra.append(f'--cert={ca_path}')
+
+        return self.run_args + args[:1] + extra + args[1:], env
+
+def find_uv() -> Optional[str]:
+    uv = which('uv')
+
+    if uv is not None:
+        return uv
+
+    try:
+        from uv import find_uv_bin  # pylint: disable=import-outside-toplevel
+        return find_uv_bin()
+    except (ImportError, FileNotFoundError):
+        return None
+
+def pip_config_uv_args(pip_config_path: Optional[Path]) -> List[str]:
+    '''
+    uv doesn't read pip config files, so the index settings
+    from one are translated into uv command line options.
+    '''
+    if not pip_config_path:
+        return []
+
+    config_parser = ConfigParser()
+
+    try:
+        config_parser.read(pip_config_path)
+    except ConfigParserError as e:
+        logger.warning('Could not read pip config %s: %s', pip_config_path, e)
+        return []
+
+    def get(key):
+        for section in ('install', 'global'):
+            value = config_parser.get(section, key, fallback=None)
+
+            if value is not None:
+                return value
+
+        return None
+
+    args = []
+
+    if get('index-url'):
+        args.append(f'--index-url={get("index-url").strip()}')
+
+    for option, uv_option in (('extra-index-url', '--extra-index-url'), ('find-links', '--find-links'), ('trusted-host', '--allow-insecure-host')):
+        for value in (get(option) or '').split():
+            args.append(f'{uv_option}={value}')
+
+    if (get('no-index') or '').lower() in ('1', 'true', 'yes', 'on'):
+        args.append('--no-index')
+
+    return args
+
+class UvBackend(PipBackend):
+    '''
+    Runs installer commands through uv pip, targeting the running
+    interpreter.  PKI and pip config settings are translated into
+    the environment variables and options uv understands.
+    '''
+    name = 'uv'
+
+    def __init__(self, uv_path: Optional[str]=None):
+        self.uv_path = uv_path or find_uv()
+
+    def available(self) -> bool:
+        return self.uv_path is not None
+
+    def verbose_args(self) -> List[str]:
+        return ['-v']
+
+    def prepare(
+        self,
+        args: List[str],
+        env: Dict[str, str],
+        pip_config_path: Optional[Path]=None,
+        client_cert: Optional[str]=None,
+        ca_path: Optional[str]=None,
+    ) -> Tuple[List[str], Dict[str, str]]:
+        env = dict(env)
+
+        if client_cert:
+            env['SSL_CLIENT_CERT'] = str(client_cert)
+
+        if ca_path:
+            env['SSL_CERT_FILE'] = str(ca_path)
+
+        cmd = [self.uv_path, 'pip', args[0], '--python', sys.executable]
+
+        if args[0] == 'install':
+            cmd += pip_config_uv_args(pip_config_path)
+
+        return cmd + args[1:], env
+
+backends = {
+    PipBackend.name: PipBackend,
+    UvBackend.name: UvBackend,
+}
+
+def get_backend(name: Optional[str]=None, resident: bool=False) -> PipBackend:
+    '''
+    Returns the installer backend with the given name, falling back
+    to pip when it is unknown or not available on this machine.
+    With resident, pip commands go to the resident worker where it's
+    supported (it forks a child per command).
+    '''
+    name = name or PipBackend.name
+
+    if name not in backends:
+        logger.warning('Unknown installer %s, using pip', name)
+        backend = PipBackend()
+    else:
+        backend = backends[name]()
+
+    if not backend.available():
+        logger.warning('Installer %s is not available, using pip', name)
+        backend = PipBackend()
+
+    if resident and backend.name == PipBackend.name:
+        if hasattr(os, 'fork'):
+            backend.resident = True
+        else:
+            logger.debug('The resident worker needs os.fork, running pip in new interpreters')
+
+    return backend
@@ -0,0 +1,75 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from collections import namedtuple
+from hashlib import sha256
+from pathlib import Path
+from typing import Optional, Tuple
+
+import json
+import os
+
+from .logger import logger
+
+CachedResponse = namedtuple(
+    'CachedResponse',
+    [
+        'body',
+        'etag',
+        'last_modified',
+        'fetched',
+    ],
+)
+
+def cache_key(link: str) -> str:
+    return sha256(link.encode('utf8')).hexdigest()
+
+def cache_paths(cache_dir: Path, link: str) -> Tuple[Path, Path]:
+    key = cache_key(link)
+    return cache_dir / f'{key}.body', cache_dir / f'{key}.meta'
+
+def atomic_write_text(path: Path, text: str) -> None:
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    tmp_path.write_text(text, encoding='utf8')
+    os.replace(str(tmp_path), str(path))
+
+def read_cached_response(cache_dir: Path, link: str) -> Optional[CachedResponse]:
+    body_path, meta_path = cache_paths(cache_dir, link)
+
+    try:
+        meta = json.loads(meta_path.read_text(encoding='utf8'))
+        body = body_path.read_text(encoding='utf8')
+    except (OSError, ValueError):
+        return None
+
+    if meta.get('link') != link:
+        return None
+
+    return CachedResponse(
+        body=body,
+        etag=meta.get('etag'),
+        last_modified=meta.get('last_modified'),
+        fetched=meta.get('fetched', 0),
+    )
+
+def write_cached_response(cache_dir: Path, link: str, response: CachedResponse, write_body: bool=True) -> None:
+    '''
+    Stores a response body and its validators.  Pass write_body=False
+    to only refresh the metadata after a 304 Not Modified.
+    '''
+    body_path, meta_path = cache_paths(cache_dir, link)
+    meta = {
+        'link': link,
+        'etag': response.etag,
+        'last_modified': response.last_modified,
+        'fetched': response.fetched,
+    }
+
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+        if write_body:
+            atomic_write_text(body_path, response.body)
+
+        atomic_write_text(meta_path, json.dumps(meta))
+    except OSError as e:
+        logger.debug('Could not write dependencies cache %s: %s', cache_dir, e)
@@ -4,6 +4,9 @@ from collections import namedtuple
 from configparser import ConfigParser
 from pathlib import Path
 
+import os
+import stat
+
 from .logger import logger
 
 Config = namedtuple(
@@ -11,14 +14,38 @@ Config = namedtuple(
     [
         'dependencies_link',
         'dependencies_link_requires_pki',
+        'dependencies_link_max_age',
+        'override_workers',
+        'report_log',
+        'wheelhouse',
+        'installer',
+        'command_timeout',
+        'snapshot_dir',
+        'resident_worker',
     ],
 )
 
+CONFIG_FILE = 'ipydeps.conf'
+DEFAULT_DEPENDENCIES_LINK_MAX_AGE = 300  # seconds
+DEFAULT_OVERRIDE_WORKERS = 4
+
+# namedtuple only grew a defaults argument in 3.7
+Config.__new__.__defaults__ = (
+    DEFAULT_DEPENDENCIES_LINK_MAX_AGE,
+    DEFAULT_OVERRIDE_WORKERS,
+    None,
+    None,
+    None,
+    None,
+    None,
+    False,
+)
+
 def config_dir(environ) -> Path:
     user_config_dir = Path.home() / '.config/ipydeps'
 
     if 'IPYDEPS_CONFIG_DIR' in environ:
-        config_dirs = [Path('IPYDEPS_CONFIG_DIR')]
+        config_dirs = [Path(environ['IPYDEPS_CONFIG_DIR'])]
     else:
         config_dirs = []
 
@@ -35,11 +62,67 @@ def config_dir(environ) -> Path:
     logger.debug('Using ipydeps config dir %s', user_config_dir)
     return user_config_dir
 
+def private_dir(path: Path) -> bool:
+    '''
+    Checks that no other user owns the directory or can write to it,
+    so they can't plant state that makes ipydeps skip work.
+    '''
+    if not hasattr(os, 'getuid'):
+        return True  # no POSIX ownership to check, as on Windows
+
+    st = path.stat()
+    return st.st_uid == os.getuid() and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def state_dir(configs_path: Path, name: str) -> Path:
+    '''
+    A private directory for ipydeps state next to the config files,
+    or in ~/.cache/ipydeps when that isn't ours to write (/etc/ipydeps).
+    '''
+    user_cache_dir = Path.home() / '.cache/ipydeps'
+
+    for path in (configs_path / name, user_cache_dir / name):
+        try:
+            path.mkdir(mode=0o700, parents=True, exist_ok=True)
+        except OSError:
+            continue
+
+        if os.access(str(path), os.W_OK) and private_dir(path):
+            return path
+
+        logger.debug('Not using %s for ipydeps %s, it is not private to this user', path, name)
+
+    raise OSError(f'No private directory for ipydeps {name} under {configs_path} or {user_cache_dir}')
+
+def unquote(value):
+    if value is not None and len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+        return value[1:-1]
+
+    return value
+
 def load_config(path: Path) -> Config:
+    '''
+    Reads the [ipydeps] section of a config file, or of the
+    ipydeps.conf file when given the ipydeps config dir.
+    '''
+    if path.is_dir():
+        path = path / CONFIG_FILE
+
     config_parser = ConfigParser()
     config_parser.read(path)
+
+    def get(key):
+        return unquote(config_parser.get('ipydeps', key, fallback=None))
+
     config = Config(
-        dependencies_link=config_parser.get('ipydeps', 'dependencies_link', fallback=None),
+        dependencies_link=get('dependencies_link'),
         dependencies_link_requires_pki=config_parser.getboolean('ipydeps', 'dependencies_link_requires_pki', fallback=False),
+        dependencies_link_max_age=config_parser.getint('ipydeps', 'dependencies_link_max_age', fallback=DEFAULT_DEPENDENCIES_LINK_MAX_AGE),
+        override_workers=config_parser.getint('ipydeps', 'override_workers', fallback=DEFAULT_OVERRIDE_WORKERS),
+        report_log=get('report_log'),
+        wheelhouse=get('wheelhouse'),
+        installer=get('installer'),
+        command_timeout=config_parser.getfloat('ipydeps', 'command_timeout', fallback=None),
+        snapshot_dir=get('snapshot_dir'),
+        resident_worker=config_parser.getboolean('ipydeps', 'resident_worker', fallback=False),
     )
     return config
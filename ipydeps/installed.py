@@ -0,0 +1,297 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from collections import namedtuple
+from importlib.machinery import EXTENSION_SUFFIXES
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import csv
+import os
+import sys
+
+from .utils import normalize_package_names
+
+Distribution = namedtuple(
+    'Distribution',
+    [
+        'name',
+        'version',
+        'path',
+    ],
+)
+
+def read_metadata_headers(path: Path) -> Tuple[Optional[str], Optional[str]]:
+    '''
+    Reads the Name and Version headers from a METADATA
+    or PKG-INFO file, stopping at the end of the headers
+    so large long-descriptions are never read.
+    '''
+    name = None
+    version = None
+
+    try:
+        with path.open('r', encoding='utf8', errors='replace') as f:
+            for line in f:
+                if line in ('\n', '\r\n'):
+                    break
+
+                if line.startswith('Name:'):
+                    name = line[5:].strip()
+                elif line.startswith('Version:'):
+                    version = line[8:].strip()
+
+                if name is not None and version is not None:
+                    break
+    except OSError:
+        pass
+
+    return name, version
+
+def metadata_path(dist_path: Path) -> Path:
+    if dist_path.name.endswith('.dist-info'):
+        return dist_path / 'METADATA'
+
+    if dist_path.is_dir():
+        return dist_path / 'PKG-INFO'
+
+    return dist_path  # single-file .egg-info
+
+def read_distribution(dist_path: Path) -> Optional[Distribution]:
+    name, version = read_metadata_headers(metadata_path(dist_path))
+
+    if not name:
+        return None
+
+    return Distribution(name=name, version=version, path=dist_path)
+
+def modules_from_record(lines: Sequence[str]) -> Set[str]:
+    '''
+    Derives top-level module names from the file paths
+    listed in a distribution's RECORD.
+    '''
+    modules = set()
+
+    for row in csv.reader(lines):
+        if len(row) == 0:
+            continue
+
+        parts = row[0].split('/')
+        first = parts[0]
+
+        if first.endswith(('.dist-info', '.data')) or first == '__pycache__':
+            continue
+
+        if len(parts) > 1:
+            modules.add(first)
+        elif first.endswith('.py'):
+            modules.add(first[:-3])
+        elif first.endswith(tuple(EXTENSION_SUFFIXES)):
+            modules.add(first.split('.')[0])
+
+    return {m for m in modules if m.isidentifier()}
+
+def top_level_modules(dist: Distribution) -> Set[str]:
+    '''
+    Returns the top-level modules a distribution provides, using
+    top_level.txt when present and falling back to RECORD.
+    '''
+    if not dist.path.is_dir():
+        return set()
+
+    try:
+        lines = (dist.path / 'top_level.txt').read_text(encoding='utf8').splitlines()
+        return {line.strip() for line in lines if line.strip().isidentifier()}
+    except OSError:
+        pass
+
+    try:
+        return modules_from_record((dist.path / 'RECORD').read_text(encoding='utf8').splitlines())
+    except OSError:
+        return set()
+
+def egg_link_distributions(egg_link: Path) -> List[Distribution]:
+    '''
+    Legacy editable installs leave a .egg-link file whose first
+    line points at the project directory holding the .egg-info.
+    '''
+    try:
+        target = Path(egg_link.read_text(encoding='utf8').splitlines()[0].strip())
+    except (OSError, IndexError):
+        return []
+
+    dists = (read_distribution(p) for p in target.glob('*.egg-info'))
+    return [d for d in dists if d is not None]
+
+def scan_entry(entry: str) -> List[Distribution]:
+    dists = []
+
+    try:
+        children = list(os.scandir(entry))
+    except OSError:
+        return dists
+
+    for child in children:
+        if child.name.endswith(('.dist-info', '.egg-info')):
+            dist = read_distribution(Path(child.path))
+
+            if dist is not None:
+                dists.append(dist)
+        elif child.name.endswith('.egg-link'):
+            dists.extend(egg_link_distributions(Path(child.path)))
+
+    return dists
+
+def entry_mtime(entry: str) -> Optional[int]:
+    try:
+        st = os.stat(entry)
+    except OSError:
+        return None
+
+    return st.st_mtime_ns
+
+RACY_MTIME_WINDOW = 2 * 10**9  # nanoseconds
+
+# common import names whose distribution is named differently, for
+# mapping requests of packages that aren't installed yet
+KNOWN_IMPORT_NAMES = {
+    'bs4': 'beautifulsoup4',
+    'cv2': 'opencv-python',
+    'dateutil': 'python-dateutil',
+    'dotenv': 'python-dotenv',
+    'mysqldb': 'mysqlclient',
+    'osgeo': 'gdal',
+    'pil': 'pillow',
+    'skimage': 'scikit-image',
+    'sklearn': 'scikit-learn',
+    'win32api': 'pywin32',
+    'yaml': 'pyyaml',
+    'zmq': 'pyzmq',
+}
+
+class InstalledIndex:
+    '''
+    In-process index of installed distributions, built by scanning
+    the .dist-info and .egg-info entries of every sys.path directory.
+    Directories are only rescanned when their mtime changes, so repeat
+    lookups are cheap and an install is picked up on the next refresh.
+    '''
+
+    def __init__(self, paths: Optional[Sequence[str]]=None):
+        self._paths = paths
+        self._entries: Dict[str, Tuple[int, bool, List[Distribution]]] = {}
+        self._modules: Dict[Path, Set[str]] = {}
+        self._lock = Lock()
+
+    def search_paths(self) -> List[str]:
+        paths = sys.path if self._paths is None else self._paths
+        return [os.path.abspath(p or os.curdir) for p in paths]
+
+    def refresh(self) -> Set[str]:
+        '''
+        Rescans any search path entry whose mtime changed since
+        the last refresh and returns the set of changed entries.
+        '''
+        with self._lock:
+            changed = set()
+            entries = {}
+            now = int(time() * 1e9)
+
+            for entry in self.search_paths():
+                if entry in entries:
+                    continue
+
+                mtime = entry_mtime(entry)
+
+                if mtime is None:
+                    continue
+
+                cached = self._entries.get(entry)
+
+                if cached is not None and cached[0] == mtime and not cached[1]:
+                    entries[entry] = cached
+                    continue
+
+                # a directory modified within the mtime granularity of the
+                # scan could change again without its mtime moving, so
+                # racy entries get rescanned on the next refresh
+                dists = scan_entry(entry)
+                racy = now - mtime < RACY_MTIME_WINDOW
+                entries[entry] = (mtime, racy, dists)
+
+                if cached is None or cached[0] != mtime or cached[2] != dists:
+                    changed.add(entry)
+
+            changed |= set(self._entries) - set(entries)
+            self._entries = entries
+            return changed
+
+    def distributions(self) -> List[Distribution]:
+        self.refresh()
+
+        with self._lock:
+            return [d for _, _, dists in self._entries.values() for d in dists]
+
+    def names(self) -> Set[str]:
+        '''
+        Returns installed distribution names normalized the
+        same way as the names parsed from pip freeze output.
+        '''
+        return normalize_package_names({d.name for d in self.distributions()})
+
+    def versions(self) -> Dict[str, str]:
+        '''
+        Maps normalized distribution names to their installed version.
+        When a distribution is installed in several sys.path entries,
+        the first one wins, the same as for imports.
+        '''
+        versions: Dict[str, str] = {}
+
+        for dist in self.distributions():
+            name = normalize_package_names({dist.name}).pop()
+
+            if name not in versions and dist.version:
+                versions[name] = dist.version
+
+        return versions
+
+    def modules_by_distribution(self) -> Dict[str, Set[str]]:
+        '''
+        Maps normalized distribution names to the top-level modules they
+        provide.  Modules are only read for distributions that are new
+        since the last call.
+        '''
+        dists = self.distributions()
+
+        with self._lock:
+            modules = {d.path: self._modules.get(d.path) for d in dists}
+
+            for dist in dists:
+                if modules[dist.path] is None:
+                    modules[dist.path] = top_level_modules(dist)
+
+            self._modules = modules
+
+        by_dist: Dict[str, Set[str]] = {}
+
+        for dist in dists:
+            name = normalize_package_names({dist.name}).pop()
+            by_dist.setdefault(name, set()).update(modules[dist.path])
+
+        return by_dist
+
+    def distributions_by_module(self) -> Dict[str, Set[str]]:
+        '''
+        Maps normalized top-level import names to the normalized
+        names of the distributions that provide them.
+        '''
+        by_module: Dict[str, Set[str]] = {}
+
+        for dist_name, modules in self.modules_by_distribution().items():
+            for module in normalize_package_names(modules):
+                by_module.setdefault(module, set()).add(dist_name)
+
+        return by_module
+
+installed_index = InstalledIndex()
@@ -1,72 +1,357 @@
 # vim: expandtab tabstop=4 shiftwidth=4
 
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
 from importlib import invalidate_caches as importlib_invalidate_caches
-from importlib.machinery import FileFinder
+from importlib.util import find_spec
 from os import environ
 from pathlib import Path
-from time import sleep
-from typing import Callable, Dict, Optional, Sequence, Set, Tuple, Union
-from urllib.error import HTTPError
-from urllib.request import urlopen
+from pkgutil import get_importer
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import sleep, time
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Set, Tuple, Union
 
 import json
+import os
 import re
+import signal
 import subprocess
 import sys
 
-from temppath import TemporaryPathContext
 
-from .config import Config, config_dir, load_config
+from .backends import PipBackend, get_backend
+from .cache import CachedResponse, read_cached_response, write_cached_response
+from .config import DEFAULT_OVERRIDE_WORKERS, Config, config_dir, load_config
+from .installed import KNOWN_IMPORT_NAMES, Distribution, installed_index, top_level_modules
+from .locks import InstallLock, install_key, install_lock, read_install_result, write_install_result
 from .logger import logger
+from .pki import pki_session
+from .plans import InstallPlan
+from .probes import OverrideRuns, override_runs, probe_satisfied
+from .report import InstallReport, emit_report, record_subprocess, reporting
+from .requirements import parse_requirements
+from .snapshot import restore_snapshot, save_snapshot, snapshot_key, snapshot_path
 from .utils import (
-    combine_key_and_cert,
-    normalize_package_names,
+    normalize_name,
     get_stdlib_packages,
 )
+from .wheelhouse import saved_archives, update_pins, wheelhouse_args, wheelhouse_available, wheelhouse_covers, wheelhouse_path
+from .worker import ResidentWorker
+
+# plain package names, which need no requirement parsing
+bare_name_pattern = re.compile(r'^[A-Za-z0-9]([A-Za-z0-9._-]*[A-Za-z0-9])?$')
+
+
+# upper bound and poll interval (seconds) for new modules to become importable
+IMPORT_REFRESH_TIMEOUT = 2.0
+IMPORT_REFRESH_INTERVAL = 0.05
+
+# stderr lines kept for error reporting, and the exit
+# code used when a command could not be started at all
+STDERR_TAIL_LINES = 200
+COMMAND_NOT_RUN = 127
+
+EXCLUSIVE_COMMANDS = {
+    'apk',
+    'apt',
+    'apt-get',
+    'conda',
+    'dnf',
+    'dpkg',
+    'mamba',
+    'microdnf',
+    'pip',
+    'pip3',
+    'rpm',
+    'yum',
+    'zypper',
+}
+exclusive_command_lock = Lock()
+
+OverrideCommand = namedtuple(
+    'OverrideCommand',
+    [
+        'args',
+        'exclusive',
+    ],
+)
+
+CommandResult = namedtuple(
+    'CommandResult',
+    [
+        'args',
+        'returncode',
+        'err',
+        'seconds',
+    ],
+)
+
+OverrideResult = namedtuple(
+    'OverrideResult',
+    [
+        'name',
+        'results',
+        'seconds',
+        'skipped',
+        'satisfied',
+    ],
+)
+OverrideResult.__new__.__defaults__ = ((), False)
+
+PackageOverrides = namedtuple(
+    'PackageOverrides',
+    [
+        'commands',
+        'probe',
+    ],
+)
+
+InstallOptions = namedtuple(
+    'InstallOptions',
+    [
+        'verbose',
+        'use_pki',
+        'use_overrides',
+        'config',
+        'installer',
+    ],
+)
+
+# (options, normalized package names) queued by pip(..., defer=True)
+deferred_installs: List[Tuple[InstallOptions, Set[str]]] = []
+deferred_lock = Lock()
+
+# how many ipydeps.batch() blocks the current thread (or task) is inside
+batch_depth: ContextVar[int] = ContextVar('ipydeps_batch_depth', default=0)
+
+# dependencies_link -> (last checked time, parsed dependencies JSON, compiled overrides)
+dependencies_memo: Dict[str, Tuple[float, Dict, Dict]] = {}
+dependencies_lock = Lock()
+
+# the pip process used instead of new interpreters when resident_worker is set
+resident_worker = ResidentWorker(STDERR_TAIL_LINES)
+
+def prepare_pip_command(
+    args: List[str],
+    use_pki: bool,
+    pip_config_path: Optional[Path],
+    backend: Optional[PipBackend]=None,
+) -> Tuple[List[str], Dict[str, str]]:
+    '''
+    Turns pip-style arguments into the command and environment for the
+    installer backend, passing along the pip config and, when use_pki
+    is set, the PKI client cert and CA in whatever form it understands.
+    '''
+    if backend is None:
+        backend = PipBackend()
+
+    client_cert, ca_path = pki_session.cert_paths() if use_pki else (None, None)
+    return backend.prepare(args, environ, pip_config_path, client_cert, ca_path)
+
+def run_pip_command(
+    args: List[str],
+    use_pki: bool,
+    pip_config_path: Optional[Path],
+    backend: Optional[PipBackend]=None,
+    **run_kwargs,
+) -> Tuple[int, Optional[str]]:
+    '''
+    Runs pip-style arguments through the installer backend.  Extra
+    keyword arguments go to run_get_stderr.
+    '''
+    cmd, env = prepare_pip_command(args, use_pki, pip_config_path, backend)
+
+    if backend is not None and backend.resident:
+        return run_in_worker(cmd, env, backend, **run_kwargs)
 
-package_name_pattern = re.compile(r'([A-Za-z][A-Za-z0-9_\-]+(((<|>|<=|>=|==|~=)[0-9]+\.[0-9]+(\.[0-9]+)*)((\.?(a|b|rc|post|dev)[0-9]+)|\+[A-Za-z0-9_\-\.]+)*)?)')
-pip_run_args = [sys.executable, '-m', 'pip']
+    return run_get_stderr(cmd, env=env, **run_kwargs)
+
+def run_in_worker(
+    cmd: List[str],
+    env: Dict[str, str],
+    backend: PipBackend,
+    timeout: Optional[float]=None,
+    on_line: Optional[Callable[[str], None]]=None,
+) -> Tuple[int, Optional[str]]:
+    '''
+    Runs a prepared pip command in the resident worker instead of
+    a new interpreter.  It's reported as the command it stands for.
+    '''
+    start = time()
+    returncode, err = resident_worker.run(cmd[len(backend.run_args):], env, timeout, on_line)
+    record_subprocess(cmd, returncode, time() - start)
+    return returncode, err
+
+def pip_install_args(
+    packages: Sequence,
+    verbose: bool,
+    wheelhouse: Optional[Path],
+    backend: PipBackend,
+) -> Tuple[Optional[List[str]], List[str]]:
+    '''
+    Returns the install arguments for an offline attempt from the
+    wheelhouse (None unless it has an archive for every requested
+    package) and for the package index.
+    '''
+    args = ['install']
+
+    if verbose:
+        args += backend.verbose_args()
+
+    packages = list(packages)
+
+    if not wheelhouse_available(wheelhouse):
+        return None, args+packages
+
+    index_args = args+wheelhouse_args(wheelhouse, offline=False)+packages
+
+    if not wheelhouse_covers(wheelhouse, (requirement_name(p) for p in packages)):
+        return None, index_args
+
+    return args+wheelhouse_args(wheelhouse, offline=True)+packages, index_args
 
 def run_pip(
     packages: Sequence,
     use_pki: bool,
     verbose: bool,
     pip_config_path: Optional[Path],
+    wheelhouse: Optional[Path]=None,
+    backend: Optional[PipBackend]=None,
+    timeout: Optional[float]=None,
 ):
-    args = ['install']
+    '''
+    Installs packages with the installer backend (pip by default).
+    When the wheelhouse has archives for all of them, an offline
+    install from it is tried first, and the package index is only used if that fails.
+    With verbose, the installer output is logged as it arrives.
+    '''
+    if backend is None:
+        backend = PipBackend()
 
-    if verbose:
-        args.append('-vvv')
+    offline_args, args = pip_install_args(packages, verbose, wheelhouse, backend)
+    on_line = logger.info if verbose else None
+
+    if offline_args is not None:
+        # no network is involved, so skip the PKI setup
+        returncode, err = run_pip_command(offline_args, False, pip_config_path, backend=backend, timeout=timeout, on_line=on_line)
+
+        if returncode == 0:
+            return returncode, err
+
+        logger.debug('Could not install %s from wheelhouse %s, using the package index', ', '.join(packages), wheelhouse)
 
-    env = dict(environ)
+    return run_pip_command(args, use_pki, pip_config_path, backend=backend, timeout=timeout, on_line=on_line)
 
-    if pip_config_path:
-        env['PIP_CONFIG_FILE'] = str(pip_config_path)
+def prefetch(
+    requested_packages: Union[str, Sequence],
+    use_pki: bool=False,
+    config: Optional[str]=None,
+    requirements: Sequence[str]=(),
+) -> int:
+    '''
+    Downloads the requested packages and their dependencies into
+    the wheelhouse and records the downloaded versions in its pins
+    file, so later installs can run without the network.
+    '''
+    configs_path = config_dir(environ)
+    ipydeps_config = load_config(configs_path)
+    pip_config_path = find_pip_config_path(config, configs_path)
+
+    if not pip_config_found(config, pip_config_path):
+        return 1
+
+    wheelhouse = wheelhouse_path(ipydeps_config, configs_path)
+    wheelhouse.mkdir(parents=True, exist_ok=True)
+
+    packages = sorted(get_pkg_names(requested_packages))
+    args = ['download', f'--dest={wheelhouse}']
+    args += [f'--requirement={r}' for r in requirements]
+    args += packages
 
-    if use_pki:
-        from pypki3 import loader as pki_loader  # pylint: disable=import-outside-toplevel
-        from pypki3 import NamedTemporaryKeyCertPaths  # pylint: disable=import-outside-toplevel
+    # uv has no download command, so prefetching always uses pip
+    archives = []
+    returncode, err = run_pip_command(args, use_pki, pip_config_path, on_line=lambda line: archives.extend(saved_archives(line)))
 
-        with NamedTemporaryKeyCertPaths() as key_cert_paths:
-            key_path = key_cert_paths[0]
-            cert_path = key_cert_paths[1]
-            ca_path = pki_loader.ca_path()
+    if returncode != 0:
+        if err is not None:
+            logger.error(err)
+
+        return returncode
+
+    pins = update_pins(wheelhouse, archives)
+    logger.info('Wheelhouse %s now pins %d packages', wheelhouse, len(pins))
+    return 0
+
+def invalidate_finders(entries: Set[str]) -> None:
+    '''
+    Invalidates the cached directory listings of the path entry
+    finders for the given (absolute) sys.path entries only.
+    '''
+    for entry in sys.path:
+        if os.path.abspath(entry or os.curdir) not in entries:
+            continue
+
+        finder = sys.path_importer_cache.get(entry)
+
+        if finder is not None and hasattr(finder, 'invalidate_caches'):
+            finder.invalidate_caches()
 
-            with TemporaryPathContext() as combined_key_cert_path:
-                combine_key_and_cert(combined_key_cert_path, key_path, cert_path)
-                args.append(f'--client-cert={combined_key_cert_path}')
-                args.append(f'--cert={ca_path}')
-                return run_get_stderr(pip_run_args+args+packages, env=env)
+def find_missing_modules(modules: Set[str]) -> Set[str]:
+    missing = set()
 
-    return run_get_stderr(pip_run_args+args+packages, env=env)
+    for module in modules:
+        try:
+            if find_spec(module) is None:
+                missing.add(module)
+        except (ImportError, ValueError):
+            missing.add(module)
 
-def invalidate_cache():
+    return missing
+
+def invalidate_cache(dists_before: Optional[Set[Distribution]]=None, timeout: float=IMPORT_REFRESH_TIMEOUT) -> None:
     '''
     Invalidates the import cache so the next attempt to import a package
     will look for new import locations.
+
+    Given the distributions installed before pip ran, only the finders for
+    the sys.path entries pip wrote into are invalidated, and this waits (up
+    to timeout seconds) until the new top-level modules can be found.
+    Without it, every finder is invalidated.
     '''
-    importlib_invalidate_caches()
-    sleep(2)
+    if dists_before is None:
+        importlib_invalidate_caches()
+        refresh_available_packages()
+        return
+
+    changed_entries = installed_index.refresh()
+
+    if len(changed_entries) == 0:
+        importlib_invalidate_caches()
+
+    new_dists = set(installed_index.distributions()) - dists_before
+    modules = set()
+
+    for dist in new_dists:
+        modules |= top_level_modules(dist)
+
+    deadline = time() + timeout
+    refresh_available_packages()
+
+    while True:
+        invalidate_finders(changed_entries)
+        modules = find_missing_modules(modules)
+
+        if len(modules) == 0:
+            return
+
+        if time() >= deadline:
+            logger.debug('Modules not importable yet: %s', ', '.join(sorted(modules)))
+            return
+
+        sleep(IMPORT_REFRESH_INTERVAL)
 
 def refresh_available_packages():
     '''
@@ -75,23 +360,16 @@ def refresh_available_packages():
     '''
     for entry in sys.path:
         if entry not in sys.path_importer_cache:
-            sys.path_importer_cache[entry] = FileFinder(entry)
+            # get_importer runs sys.path_hooks, so the cached finder
+            # gets the same loaders the import system would give it
+            get_importer(entry)
 
-def valid_pkg_names(s: str):
+def get_pkg_names(x: Union[str, Sequence]) -> Set:
     '''
-    Finds potential package names using a regex
-    so weird strings that might contain code
-    don't get through.  This also allows version
-    specifiers.
+    Returns the normalized requirements in a string or list of strings
+    in requirements file format.  See requirements.parse_requirements.
     '''
-    return [x[0] for x in package_name_pattern.findall(s)]
-
-def get_pkg_names(x: Union[str, Sequence]) -> Set:
-    if isinstance(x, (list, tuple)):
-        x = ' '.join(x)
-
-    packages = (p.strip() for p in valid_pkg_names(x))
-    return set(p for p in packages if len(p) > 0)
+    return parse_requirements(x)
 
 def py_name_micro():
     return f'python-{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}'
@@ -102,121 +380,367 @@ def py_name_minor():
 def py_name_major():
     return f'python-{sys.version_info.major}'
 
-def case_insensitive_dependencies_json(dep_json):
-    lowercased = {}
+def compile_overrides(dep_json: Dict) -> Dict[str, Sequence]:
+    '''
+    Flattens the dependencies JSON into the overrides for the running
+    interpreter, keyed by normalized package name.  python-X.Y.Z entries
+    take precedence over python-X.Y entries, and those over python-X.
+    '''
+    overrides = {}
+
+    for version in (py_name_major(), py_name_minor(), py_name_micro()):
+        packages = dep_json.get(version)
+
+        if packages is None:
+            continue
+
+        if not isinstance(packages, dict):
+            logger.warning('Ignoring %s in dependencies JSON, it should map package names to commands', version)
+            continue
 
-    for version in dep_json:
-        lowercased[version] = {}
-        packages = dep_json[version]
+        seen = set()
 
-        for pkg in packages:
-            pkg = pkg.lower()
-            cmds = packages[pkg]
+        for pkg, cmds in packages.items():
+            name = normalize_name(pkg)
 
-            if pkg in lowercased[version]:
-                logger.warning('Duplicate package name %s in dependencies JSON.  Package names are case-insensitive.  Overwriting!', pkg)
+            if name in seen:
+                logger.warning('Duplicate package name %s in dependencies JSON.  Package names are case-insensitive.  Overwriting!', name)
 
-            lowercased[version][pkg] = cmds
+            seen.add(name)
+            overrides[name] = cmds
 
-    return lowercased
+    return overrides
 
 def get_dependencies_link_urlopener(config: Config) -> Callable:
+    from urllib.request import urlopen  # pylint: disable=import-outside-toplevel
+
     if config.dependencies_link_requires_pki:
-        from pypki3 import ssl_context  # pylint: disable=import-outside-toplevel
-        ctx = ssl_context()
+        ctx = pki_session.ssl_context()
         return lambda url: urlopen(url, context=ctx)  # pylint: disable=consider-using-with
 
     return urlopen
 
-def read_dependencies_json(config: Config):
-    if not config.dependencies_link:
-        return {}
+def dependencies_cache_dir() -> Path:
+    return config_dir(environ) / 'cache'
+
+def fetch_dependencies_link(config: Config, cached: Optional[CachedResponse]) -> Optional[CachedResponse]:
+    '''
+    Fetches the dependencies_link, sending the validators of the
+    cached copy so an unchanged document costs a 304.  Falls back
+    to the cached copy (or None) when the fetch fails.
+    '''
+    # urllib.request pulls in http.client, email and ssl, so it
+    # is only imported once there is a link to fetch
+    from urllib.error import HTTPError, URLError  # pylint: disable=import-outside-toplevel
+    from urllib.request import Request  # pylint: disable=import-outside-toplevel
+
+    request = Request(config.dependencies_link)
+
+    if cached is not None:
+        if cached.etag:
+            request.add_header('If-None-Match', cached.etag)
+
+        if cached.last_modified:
+            request.add_header('If-Modified-Since', cached.last_modified)
 
     urlopener = get_dependencies_link_urlopener(config)
 
     try:
-        resp = urlopener(config.dependencies_link)
+        resp = urlopener(request)
     except HTTPError as e:
-        logger.error(str(e.read(), encoding='utf8'))
-        return {}
-
-    d = str(resp.read(), encoding='utf8')
+        if e.code == 304 and cached is not None:
+            return cached._replace(fetched=time())
 
+        logger.error(str(e.read(), encoding='utf8'))
+        return cached
+    except URLError as e:
+        logger.error('Could not fetch %s: %s', config.dependencies_link, e.reason)
+        return cached
+
+    return CachedResponse(
+        body=str(resp.read(), encoding='utf8'),
+        etag=resp.headers.get('ETag'),
+        last_modified=resp.headers.get('Last-Modified'),
+        fetched=time(),
+    )
+
+def parse_dependencies_json(body: str) -> Optional[Dict]:
     try:
-        j = json.loads(d)
+        j = json.loads(body)
     except json.decoder.JSONDecodeError as e:
         logger.error(str(e))
-        return {}
+        return None
+
+    if not isinstance(j, dict):
+        logger.error('Dependencies JSON should be an object keyed by Python version')
+        return None
+
+    return j
+
+def load_dependencies(config: Config, cache_dir: Optional[Path]=None, fetch: bool=True) -> Tuple[Dict, Dict]:
+    '''
+    Returns the parsed dependencies JSON and its overrides compiled
+    for this interpreter.  Both are memoized in-process, and remote
+    documents are cached on disk for dependencies_link_max_age seconds,
+    after which they are revalidated with a conditional GET.  The last
+    good copy is used if the link cannot be fetched or parsed.
+
+    With fetch=False, remote links are never fetched: whatever copy is
+    memoized or on disk is used however old it is, or nothing at all.
+    '''
+    link = config.dependencies_link
+
+    if not link:
+        return {}, {}
+
+    with dependencies_lock:
+        memo = dependencies_memo.get(link)
+
+        # local files are cheap to read, so only remote links hit the disk cache
+        use_disk_cache = not link.startswith('file:')
+        fetch = fetch or not use_disk_cache
+
+        if memo is not None and (not fetch or time() - memo[0] < config.dependencies_link_max_age):
+            return memo[1], memo[2]
+
+        if cache_dir is None:
+            cache_dir = dependencies_cache_dir()
+
+        cached = read_cached_response(cache_dir, link) if use_disk_cache else None
+        response = cached
+        checked = cached.fetched if cached is not None else 0
 
-    return case_insensitive_dependencies_json(j)
+        if fetch and time() - checked >= config.dependencies_link_max_age:
+            response = fetch_dependencies_link(config, cached)
+            checked = time()
 
-def find_overrides(packages: Set, config: Config) -> Dict[str, Sequence[str]]:
+        if response is None:
+            if not fetch:
+                logger.warning('No cached copy of %s, so overrides are not known', link)
+
+            return {}, {}
+
+        dep_json = parse_dependencies_json(response.body)
+
+        if dep_json is None and cached is not None and response.body != cached.body:
+            logger.warning('Using last good copy of %s', link)
+            response = cached
+            dep_json = parse_dependencies_json(response.body)
+
+        if dep_json is None:
+            return {}, {}
+
+        if use_disk_cache and response is not cached:
+            write_cached_response(cache_dir, link, response, write_body=cached is None or response.body != cached.body)
+
+        overrides = compile_overrides(dep_json)
+        dependencies_memo[link] = (checked, dep_json, overrides)
+        return dep_json, overrides
+
+def read_dependencies_json(config: Config, cache_dir: Optional[Path]=None) -> Dict:
+    return load_dependencies(config, cache_dir)[0]
+
+def read_overrides(config: Config, fetch: bool=True) -> Dict[str, Sequence]:
+    return load_dependencies(config, fetch=fetch)[1]
+
+def find_overrides(packages: Set, config: Config, fetch: bool=True) -> Dict[str, Sequence[str]]:
     if len(packages) == 0:
         return {}
 
-    dep_json = read_dependencies_json(config)
-    major = py_name_major()
-    minor = py_name_minor()
-    micro = py_name_micro()
+    overrides = read_overrides(config, fetch)
+    return {pkg: overrides[pkg] for pkg in packages & overrides.keys()}
 
-    overrides = {}
+def decode_line(line: bytes) -> str:
+    return str(line, encoding='utf8', errors='replace').rstrip('\r\n')
 
-    # Check major, then minor, then micro so the most
-    # specific override is used for a particular package.
-    if major in dep_json:
-        for pkg in packages:
-            if pkg in dep_json[major]:
-                overrides[pkg] = dep_json[major][pkg]
+def read_lines(pipe, name: str, lines: Queue) -> None:
+    for line in iter(pipe.readline, b''):
+        lines.put((name, line))
 
-    if minor in dep_json:
-        for pkg in packages:
-            if pkg in dep_json[minor]:
-                overrides[pkg] = dep_json[minor][pkg]
+    pipe.close()
+    lines.put((name, None))
 
-    if micro in dep_json:
-        for pkg in packages:
-            if pkg in dep_json[micro]:
-                overrides[pkg] = dep_json[micro][pkg]
+def process_group_args() -> Dict:
+    '''
+    Popen arguments that start a command in a process group of its
+    own, so kill_process_group() also stops whatever it started.
+    '''
+    if os.name == 'nt':
+        return {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
 
-    return overrides
+    return {'start_new_session': True}
 
-def run_get_stderr(cmd, env=None) -> Tuple[int, Optional[str]]:
-    returncode = 0
-    err = None
+def kill_process_group(proc) -> None:
+    '''
+    Kills a command started with process_group_args() along with its
+    children.  Works for both subprocess.Popen and asyncio processes.
+    '''
+    try:
+        if os.name == 'nt':
+            # /T takes the whole process tree with it
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(proc.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except OSError as e:
+        logger.debug('Could not kill the process group of %s: %s', proc.pid, e)
 
+    try:
+        proc.kill()
+    except ProcessLookupError:
+        pass
+
+def run_get_stderr(
+    cmd,
+    env=None,
+    timeout: Optional[float]=None,
+    on_line: Optional[Callable[[str], None]]=None,
+) -> Tuple[int, Optional[str]]:
+    '''
+    Runs a command, streaming its stdout and stderr as it runs.
+    Each output line is passed to on_line (on the calling thread),
+    and only the last STDERR_TAIL_LINES lines of stderr are kept to
+    report errors.  The command, and anything it started, is killed
+    after timeout seconds.
+    Returns the exit code and, if it failed, the stderr tail.
+    '''
     if env is None:
         env = environ
 
+    start = time()
+    err_tail: Deque[str] = deque(maxlen=STDERR_TAIL_LINES)
+
     try:
-        subprocess.check_output(cmd, stderr=subprocess.PIPE, env=env)
-    except subprocess.CalledProcessError as e:
-        returncode = e.returncode
-        err = str(e.stderr, encoding='utf8')
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, **process_group_args())  # pylint: disable=consider-using-with
+    except OSError as e:
+        record_subprocess(cmd, COMMAND_NOT_RUN, time() - start)
+        return COMMAND_NOT_RUN, str(e)
 
-    return returncode, err
+    lines: Queue = Queue()
+
+    for pipe, name in ((proc.stdout, 'stdout'), (proc.stderr, 'stderr')):
+        Thread(target=read_lines, args=(pipe, name, lines), daemon=True).start()
+
+    open_pipes = 2
+    timed_out = False
+
+    while open_pipes > 0:
+        remaining = None if timeout is None else start + timeout - time()
 
-def get_freeze_package_name(info):
-    name, _ = info.split('==')
-    return name.strip()
+        if remaining is not None and remaining <= 0:
+            timed_out = True
+            kill_process_group(proc)
+            break
 
-def process_pip_freeze_output(pkgs) -> list:
-    pkgs = str(pkgs, encoding='utf8').split('\n')
-    pkgs = [p for p in pkgs if len(p) > 0 and '==' in p]
-    pkgs = [get_freeze_package_name(p) for p in pkgs]
-    pkgs = normalize_package_names(pkgs)
-    return pkgs
+        try:
+            name, line = lines.get(timeout=remaining)
+        except Empty:
+            continue
 
-def pip_freeze_packages():
-    pkgs = subprocess.check_output(pip_run_args + ['list', '--format=freeze'])
-    return process_pip_freeze_output(pkgs)
+        if line is None:
+            open_pipes -= 1
+            continue
+
+        text = decode_line(line)
+
+        if name == 'stderr':
+            err_tail.append(text)
+
+        if on_line is not None:
+            on_line(text)
+
+    returncode = proc.wait()
+
+    if timed_out:
+        err_tail.append(f'Timed out after {timeout}s: {" ".join(str(c) for c in cmd)}')
+        returncode = returncode or 1
+
+    record_subprocess(cmd, returncode, time() - start)
+
+    if returncode == 0:
+        return returncode, None
+
+    return returncode, '\n'.join(err_tail)
 
 def currently_installed() -> Set:
-    return {p.lower() for p in set(pip_freeze_packages())}
+    '''
+    Returns the normalized names of all installed distributions
+    from the in-process index, avoiding a pip list subprocess.
+    '''
+    return installed_index.names()
 
 def subtract_installed(already_installed: Set, requested: Set) -> Set:
     requested_packages = set((p.lower() for p in requested))  # removes duplicates
     return requested_packages - already_installed
 
+def parse_requirement(requirement: str):
+    '''
+    Returns the packaging Requirement for a requirement string, or None
+    if it can't be parsed.  packaging is only imported here, since plain
+    package names, by far the most common request, never need it.
+    '''
+    from packaging.requirements import InvalidRequirement, Requirement  # pylint: disable=import-outside-toplevel
+
+    try:
+        return Requirement(requirement)
+    except InvalidRequirement:
+        return None
+
+def requirement_name(requirement: str) -> str:
+    '''
+    Returns the normalized package name of a requirement
+    string, or the string itself if it can't be parsed.
+    '''
+    if bare_name_pattern.match(requirement):
+        return normalize_name(requirement)
+
+    req = parse_requirement(requirement)
+
+    if req is None:
+        return requirement
+
+    return normalize_name(req.name)
+
+def requirement_satisfied(installed_versions: Dict[str, str], requirement: str) -> bool:
+    '''
+    Checks a requirement string like numpy>=1.20 against the installed
+    versions.  Requirements whose environment marker doesn't apply to
+    this interpreter count as satisfied.  Ones with extras, like
+    requests[socks], never do, since the index doesn't know whether
+    the extra's dependencies are installed.
+    '''
+    if bare_name_pattern.match(requirement):
+        return normalize_name(requirement) in installed_versions
+
+    req = parse_requirement(requirement)
+
+    if req is None:
+        return requirement.lower() in installed_versions
+
+    if req.marker is not None and not req.marker.evaluate():
+        return True
+
+    if req.extras:
+        return False
+
+    version = installed_versions.get(normalize_name(req.name))
+
+    if version is None:
+        return False
+
+    from packaging.version import InvalidVersion  # pylint: disable=import-outside-toplevel
+
+    try:
+        return req.specifier.contains(version, prereleases=True)
+    except InvalidVersion:
+        return len(req.specifier) == 0
+
+def subtract_satisfied(installed_versions: Dict[str, str], requested: Set) -> Set:
+    '''
+    Removes the requirements that the installed versions already satisfy,
+    so re-running an install cell with version specifiers costs nothing.
+    '''
+    return {p for p in requested if not requirement_satisfied(installed_versions, p)}
+
 def subtract_stdlib(stdlib_packages: Set, packages: Set) -> Set:
     '''
     Understandably, some users request to install packages
@@ -228,20 +752,251 @@ def subtract_stdlib(stdlib_packages: Set, packages: Set) -> Set:
 
     return packages - stdlib_packages
 
-def run_and_log_error(cmd):
-    returncode, err = run_get_stderr(cmd)
+def renamed_requirement(requirement: str, name: str) -> str:
+    '''
+    Swaps the package name of a requirement string,
+    keeping its extras, specifiers and marker.
+    '''
+    old_name = requirement_name(requirement)
 
-    if returncode != 0 and err is not None:
-        logger.error(err)
+    if not requirement.startswith(old_name):
+        return requirement
+
+    return name + requirement[len(old_name):]
+
+def import_name_providers(distributions_by_module: Dict[str, Set[str]], name: str) -> Set[str]:
+    '''
+    The installed distributions that provide the module name as one
+    of their own import names.  A distribution that also ships a module
+    named after itself, like pytest (with py.py) or jupyter_core (with
+    jupyter), is left out, since those side modules often share their
+    name with a different distribution.
+    '''
+    return {
+        dist for dist in distributions_by_module.get(name, set())
+        if dist != name and dist not in distributions_by_module.get(dist, set())
+    }
+
+def subtract_importable(distributions_by_module: Dict[str, Set[str]], installed_versions: Dict[str, str], packages: Set) -> Set:
+    '''
+    Users sometimes request a package by its import name, like
+    sklearn instead of scikit-learn, so skip the import names whose
+    installed distribution satisfies the requirement.
+    '''
+    importable = set()
+
+    for package in packages:
+        name = requirement_name(package)
+
+        for dist in sorted(import_name_providers(distributions_by_module, name)):
+            if requirement_satisfied(installed_versions, renamed_requirement(package, dist)):
+                logger.warning('%s is provided by the installed package %s and will be skipped.  Request %s instead to remove this warning.', name, dist, dist)
+                importable.add(package)
+                break
+
+    return packages - importable
+
+def map_import_names(distributions_by_module: Dict[str, Set[str]], packages: Set) -> Set:
+    '''
+    Swaps import names for the name of the package that provides them,
+    like sklearn for scikit-learn.  The installed distribution providing
+    the module wins (so a cv2 request upgrades opencv-python-headless if
+    that's what's installed), and KNOWN_IMPORT_NAMES is only used when
+    nothing installed provides the module.
+    '''
+    mapped = set()
+
+    for package in packages:
+        name = requirement_name(package)
+
+        if name in distributions_by_module:
+            providers = import_name_providers(distributions_by_module, name)
+            dist = min(providers) if providers else None
+        else:
+            dist = KNOWN_IMPORT_NAMES.get(name)
+
+        if dist is None:
+            mapped.add(package)
+        else:
+            logger.warning('%s is an import name, so %s will be installed instead.  Request %s to remove this warning.', name, dist, dist)
+            mapped.add(renamed_requirement(package, dist))
+
+    return mapped
+
+def is_exclusive_command(args: Sequence[str]) -> bool:
+    '''
+    System package managers (and pip itself) hold global locks
+    or write to shared locations, so by default they never run
+    alongside another exclusive command.
+    '''
+    args = [os.path.basename(a) for a in args if a != 'sudo']
+
+    if len(args) == 0:
+        return False
+
+    if args[0] in EXCLUSIVE_COMMANDS:
+        return True
+
+    return 'pip' in args[1:3] and '-m' in args[1:3]
+
+def is_pip_command(args: Sequence[str]) -> bool:
+    args = [os.path.basename(a) for a in args if a != 'sudo']
+
+    if len(args) == 0:
+        return False
+
+    return args[0] in ('pip', 'pip3') or ('pip' in args[1:3] and '-m' in args[1:3])
+
+def parse_override_command(command) -> OverrideCommand:
+    '''
+    Override commands are either a list of arguments or an object
+    like {"command": [...], "exclusive": true} to control whether
+    the command may run alongside other overrides.
+    '''
+    if isinstance(command, dict):
+        args = list(command.get('command', []))
+        return OverrideCommand(args=args, exclusive=bool(command.get('exclusive', is_exclusive_command(args))))
+
+    args = list(command)
+    return OverrideCommand(args=args, exclusive=is_exclusive_command(args))
+
+def run_override_command(command: OverrideCommand, timeout: Optional[float]=None) -> CommandResult:
+    start = time()
+
+    if command.exclusive:
+        with exclusive_command_lock:
+            returncode, err = run_get_stderr(command.args, timeout=timeout)
+    else:
+        returncode, err = run_get_stderr(command.args, timeout=timeout)
+
+    return CommandResult(args=command.args, returncode=returncode, err=err, seconds=time() - start)
+
+def parse_package_overrides(value) -> PackageOverrides:
+    '''
+    A package's overrides are either a list of commands or an object like
+    {"probe": {"import": "numpy"}, "commands": [...]}, where the probe
+    tells whether the package is already there without running anything.
+    '''
+    if isinstance(value, dict):
+        probe = value.get('probe')
+
+        if probe is not None and not isinstance(probe, dict):
+            logger.warning('Ignoring override probe %r, it should be an object', probe)
+            probe = None
+
+        return PackageOverrides(commands=list(value.get('commands', [])), probe=probe)
+
+    return PackageOverrides(commands=list(value), probe=None)
+
+def overrides_to_run(
+    name: str,
+    value,
+    runs: Optional[OverrideRuns]=None,
+) -> Tuple[PackageOverrides, List[OverrideCommand], List[OverrideCommand]]:
+    '''
+    Splits a package's override commands into those to run and those
+    to skip.  Everything is skipped when the probe is satisfied.  Without
+    a probe, non-pip commands that already succeeded here are skipped.
+    pip commands always run, since pip list is what says they're needed.
+    '''
+    overrides = parse_package_overrides(value)
+    commands = [c for c in map(parse_override_command, overrides.commands) if len(c.args) > 0]
+
+    if overrides.probe is not None:
+        if probe_satisfied(overrides.probe):
+            logger.info('Skipping overrides for %s, its probe is satisfied', name)
+            return overrides, [], commands
+
+        # the probe says the package is missing, so earlier runs don't count
+        return overrides, commands, []
+
+    to_run, skipped = [], []
+
+    for command in commands:
+        if runs is not None and not is_pip_command(command.args) and runs.succeeded(command.args):
+            skipped.append(command)
+        else:
+            to_run.append(command)
+
+    if skipped:
+        logger.info('Skipping %d override command(s) for %s that already succeeded in this environment', len(skipped), name)
+
+    return overrides, to_run, skipped
+
+def record_override_run(runs: Optional[OverrideRuns], result: CommandResult) -> None:
+    if runs is not None and result.returncode == 0 and not is_pip_command(result.args):
+        runs.record(result.args)
+
+def override_satisfied(overrides: PackageOverrides, ran: bool) -> bool:
+    if overrides.probe is None:
+        return False
+
+    if ran:
+        importlib_invalidate_caches()
+
+    return probe_satisfied(overrides.probe)
 
-def run_overrides(overrides):
-    for name, cmds in overrides.items():
-        logger.info('Executing overrides for %s', name)
+def run_package_overrides(name: str, cmds, timeout: Optional[float]=None, runs: Optional[OverrideRuns]=None) -> OverrideResult:
+    '''
+    Runs the override commands for one package in order, skipping
+    what its probe or the record of earlier runs says isn't needed.
+    '''
+    start = time()
+    overrides, commands, skipped = overrides_to_run(name, cmds, runs)
+    results = []
+
+    for command in commands:
+        result = run_override_command(command, timeout)
+        record_override_run(runs, result)
+        results.append(result)
+
+    return OverrideResult(
+        name=name,
+        results=results,
+        seconds=time() - start,
+        skipped=[c.args for c in skipped],
+        satisfied=override_satisfied(overrides, len(commands) > 0),
+    )
+
+def log_override_result(result: OverrideResult) -> None:
+    for command in result.results:
+        logger.debug('%s (exit %d, %.2fs)', ' '.join(command.args), command.returncode, command.seconds)
+
+        if command.returncode != 0 and command.err is not None:
+            logger.error(command.err)
+
+    logger.debug('Overrides for %s took %.2fs', result.name, result.seconds)
+
+def run_overrides(
+    overrides,
+    max_workers: int=DEFAULT_OVERRIDE_WORKERS,
+    timeout: Optional[float]=None,
+    runs: Optional[OverrideRuns]=None,
+) -> Dict[str, OverrideResult]:
+    '''
+    Runs the override commands of different packages concurrently on up
+    to max_workers threads.  Commands for a single package keep their
+    order, and exclusive commands never overlap each other.
+    '''
+    if len(overrides) == 0:
+        return {}
+
+    logger.info('Executing overrides for %s', ', '.join(sorted(overrides)))
+    workers = max(1, min(max_workers, len(overrides)))
 
-        for command in cmds:
-            if len(command) > 0:
-                logger.debug(' '.join(command))
-                run_and_log_error(command)
+    if workers == 1:
+        results = [run_package_overrides(name, cmds, timeout, runs) for name, cmds in overrides.items()]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # each thread gets a copy of this context, so its commands land in the active report
+            futures = [executor.submit(copy_context().run, run_package_overrides, name, cmds, timeout, runs) for name, cmds in overrides.items()]
+            results = [f.result() for f in futures]
+
+    # log from this thread so output lands in the calling notebook cell
+    for result in results:
+        log_override_result(result)
+
+    return {result.name: result for result in results}
 
 def log_currently_installed(before: Set, requested: Set) -> None:
     already_installed = before & requested
@@ -273,48 +1028,452 @@ def pip_config_found(config_name: Optional[str], pip_config_path: Optional[Path]
     logger.error('Could not find pip config named %s at %s', config_name, pip_config_path)
     return False
 
-def pip(
+def make_plan(
     requested_packages: Union[str, Sequence],
-    verbose: bool=False,
-    use_pki: bool=False,
+    ipydeps_config: Config,
     use_overrides: bool=True,
-    config: Optional[str]=None,
-) -> None:
-    configs_path = config_dir(environ)
-    ipydeps_config = load_config(configs_path)
-    pip_config_path = find_pip_config_path(config, configs_path)
-
-    if not pip_config_found(config, pip_config_path):
-        return
+    report: Optional[InstallReport]=None,
+    fetch_overrides: bool=True,
+) -> InstallPlan:
+    '''
+    Works out what installing the requested packages would take,
+    without running anything: which are stdlib, already installed
+    or importable, which have overrides, and what's left for pip.
+    '''
+    if report is None:
+        report = InstallReport([])
 
-    packages_before_install = currently_installed()
-    stdlib_packages = get_stdlib_packages()
+    with report.phase('get_stdlib_packages'):
+        stdlib_packages = get_stdlib_packages()
 
-    requested_packages = get_pkg_names(requested_packages)
-    requested_packages = normalize_package_names(requested_packages)
+    requested = get_pkg_names(requested_packages)
+    requested_packages = set(requested)
+    stdlib = requested_packages & stdlib_packages
     requested_packages = subtract_stdlib(stdlib_packages, requested_packages)
 
     # ignore items that have already been installed
-    log_currently_installed(packages_before_install, requested_packages)
-    requested_packages = subtract_installed(packages_before_install, requested_packages)
+    with report.phase('currently_installed'):
+        installed_versions = installed_index.versions()
+
+    unsatisfied = subtract_satisfied(installed_versions, requested_packages)
+    log_currently_installed(requested_packages - unsatisfied, requested_packages)
+    already_installed = requested_packages - unsatisfied
+    requested_packages = unsatisfied
+    importable: Set[str] = set()
+
+    # catch import names like sklearn, both installed and not
+    if len(requested_packages) > 0:
+        with report.phase('import_names'):
+            distributions_by_module = installed_index.distributions_by_module()
+
+        unimportable = subtract_importable(distributions_by_module, installed_versions, requested_packages)
+        importable = requested_packages - unimportable
+        requested_packages = unimportable
+        requested_packages = map_import_names(distributions_by_module, requested_packages)
+
+    overrides = {}
 
     if use_overrides:
-        run_overrides(find_overrides(requested_packages, ipydeps_config))
+        with report.phase('read_dependencies_json'):
+            overrides = find_overrides({requirement_name(p) for p in requested_packages}, ipydeps_config, fetch_overrides)
+
+    return InstallPlan(
+        requested=sorted(requested),
+        stdlib=sorted(stdlib),
+        already_installed=sorted(already_installed),
+        importable=sorted(importable),
+        overrides=overrides,
+        pip=sorted(requested_packages),
+    )
+
+def find_snapshot(packages: Set[str], ipydeps_config: Config, use_overrides: bool, dists_before: Set[Distribution]) -> Optional[Path]:
+    '''
+    Snapshots are keyed by what's left to install, what's installed
+    already, the exact interpreter version and the overrides document.
+    '''
+    overrides = read_dependencies_json(ipydeps_config) if use_overrides else None
+    key = snapshot_key(packages, py_name_micro(), overrides, dists_before)
+    return snapshot_path(ipydeps_config, key)
+
+def restore_install_snapshot(
+    requested_packages: Set[str],
+    ipydeps_config: Config,
+    use_overrides: bool,
+    dists_before: Set[Distribution],
+    report: InstallReport,
+) -> Tuple[Optional[Path], Set[str]]:
+    '''
+    Restores the snapshot for the requested packages, if snapshots are
+    configured and there is one.  Returns the snapshot path (None when
+    snapshots are off) and the requirements that are still unsatisfied.
+    '''
+    if not ipydeps_config.snapshot_dir or len(requested_packages) == 0:
+        return None, requested_packages
+
+    snapshot = find_snapshot(requested_packages, ipydeps_config, use_overrides, dists_before)
+
+    if snapshot is not None and restore_snapshot(snapshot):
+        invalidate_cache(dists_before)
+        requested_packages = subtract_satisfied(installed_index.versions(), requested_packages)
+        report.snapshot = 'restored' if len(requested_packages) == 0 else 'partial'
+
+    return snapshot, requested_packages
+
+def save_install_snapshot(snapshot: Path, dists_before: Set[Distribution], report: InstallReport) -> None:
+    new_dists = set(installed_index.distributions()) - dists_before
+
+    if len(new_dists) > 0 and save_snapshot(snapshot, new_dists, dists_before):
+        report.snapshot = 'saved'
+
+def pending_overrides(install_plan: InstallPlan, requested_packages: Set[str]) -> Dict[str, Sequence]:
+    '''
+    The overrides in the plan for packages that are still missing.
+    '''
+    missing = {requirement_name(p) for p in requested_packages}
+    return {name: cmds for name, cmds in (install_plan.overrides or {}).items() if name in missing}
+
+def overrides_capturable(override_results: Dict[str, OverrideResult]) -> bool:
+    '''
+    Only successful pip overrides leave something a snapshot can capture.
+    '''
+    return all(
+        r.returncode == 0 and is_pip_command(r.args)
+        for result in override_results.values()
+        for r in result.results
+    ) and all(
+        is_pip_command(args)
+        for result in override_results.values()
+        for args in result.skipped
+    )
+
+def satisfied_by_overrides(override_results: Dict[str, OverrideResult], requirements: Set[str]) -> Set[str]:
+    '''
+    Drops requirements whose override probe is satisfied, since what
+    the overrides installed may never show up in pip list.  A probe
+    can't check versions or extras, so only bare names are dropped.
+    '''
+    satisfied = {name for name, result in override_results.items() if result.satisfied}
+    return {r for r in requirements if not (bare_name_pattern.match(r) and requirement_name(r) in satisfied)}
+
+def acquire_install_lock(
+    configs_path: Path,
+    requested_packages: Set[str],
+    dists_before: Set[Distribution],
+) -> Tuple[Optional[InstallLock], Set[str]]:
+    '''
+    Takes the cross-process lock for installing this package set into
+    this environment.  When another kernel held it, whatever that kernel
+    installed is picked up and only what's still missing is returned.
+    '''
+    if len(requested_packages) == 0:
+        return None, requested_packages
+
+    try:
+        lock = install_lock(configs_path, install_key(requested_packages))
+        lock.acquire(on_wait=lambda: logger.info('Waiting for another kernel installing %s', ', '.join(sorted(requested_packages))))
+    except OSError as e:
+        logger.debug('Installing without a lock: %s', e)
+        return None, requested_packages
+
+    if lock.waited:
+        result = read_install_result(lock)
+
+        if result is not None:
+            logger.debug('Another kernel installed %s (%s)', ', '.join(result.get('pip', [])) or 'nothing', 'succeeded' if result.get('succeeded') else 'failed')
 
-    # now that overrides have run, calculate and subtract what's installed again
+        if set(installed_index.distributions()) != dists_before:
+            invalidate_cache(dists_before)
+
+        requested_packages = subtract_satisfied(installed_index.versions(), requested_packages)
+
+    return lock, requested_packages
+
+def record_install_result(lock: Optional[InstallLock], report: InstallReport, succeeded: bool) -> None:
+    if lock is not None:
+        write_install_result(lock, {'succeeded': succeeded, 'overrides': report.overrides, 'pip': report.pip})
+
+def release_install_lock(lock: Optional[InstallLock]) -> None:
+    if lock is not None:
+        lock.release()
+
+InstallSetup = namedtuple(
+    'InstallSetup',
+    [
+        'configs_path',
+        'ipydeps_config',
+        'pip_config_path',
+        'backend',
+    ],
+)
+
+def setup_install(config: Optional[str], installer: Optional[str], report: InstallReport) -> Optional[InstallSetup]:
+    '''
+    Loads the configuration an install needs, or returns None
+    when the requested pip config file doesn't exist.
+    '''
+    with report.phase('load_config'):
+        configs_path = config_dir(environ)
+        ipydeps_config = load_config(configs_path)
+        pip_config_path = find_pip_config_path(config, configs_path)
+
+    if not pip_config_found(config, pip_config_path):
+        return None
+
+    backend = get_backend(installer or ipydeps_config.installer, ipydeps_config.resident_worker)
+    return InstallSetup(configs_path, ipydeps_config, pip_config_path, backend)
+
+def start_install(
+    requested_packages: Union[str, Sequence],
+    ipydeps_config: Config,
+    use_overrides: bool,
+    report: InstallReport,
+    install_plan: Optional[InstallPlan]=None,
+) -> Tuple[InstallPlan, Set[str], Set[Distribution]]:
+    '''
+    Plans the install, unless given a plan, and returns the plan, the
+    requirements still to install and the distributions installed now.
+    '''
+    if install_plan is None:
+        install_plan = make_plan(requested_packages, ipydeps_config, use_overrides, report)
+        missing = set(install_plan.pip)
+    else:
+        # a plan made earlier may be stale, so only run what's still missing
+        with report.phase('currently_installed'):
+            missing = subtract_satisfied(installed_index.versions(), set(install_plan.pip))
+
+    report.stdlib = list(install_plan.stdlib)
+    report.already_installed = list(install_plan.already_installed)
+    report.importable = list(install_plan.importable)
+    return install_plan, missing, set(installed_index.distributions())
+
+def left_for_pip(override_results: Dict[str, OverrideResult], requested_packages: Set[str], report: InstallReport) -> List[str]:
+    '''
+    What's still missing once the overrides have run.
+    '''
     refresh_available_packages()
-    packages_to_install = list(subtract_installed(currently_installed(), requested_packages))
 
-    if len(packages_to_install) > 0:
-        logger.debug('Running pip to install %s', ', '.join(sorted(packages_to_install)))
-        returncode, err = run_pip(packages_to_install, use_pki, verbose, pip_config_path)
+    with report.phase('currently_installed'):
+        packages = sorted(satisfied_by_overrides(override_results, subtract_satisfied(installed_index.versions(), requested_packages)))
 
-        if returncode != 0 and err is not None:
-            logger.error(err)
+    report.pip = packages
 
-        invalidate_cache()
-        refresh_available_packages()
+    if len(packages) > 0:
+        logger.debug('Running pip to install %s', ', '.join(packages))
+
+    return packages
+
+def pip_succeeded(returncode: int, err: Optional[str]) -> bool:
+    if returncode != 0 and err is not None:
+        logger.error(err)
+
+    return returncode == 0
+
+def finish_install(packages_before_install: Set, report: InstallReport) -> None:
+    with report.phase('currently_installed'):
+        packages_after_install = currently_installed()
 
-    packages_after_install = currently_installed()
+    report.new_packages = sorted(packages_after_install - packages_before_install)
     log_before_after(packages_before_install, packages_after_install)
+
+def install_packages(
+    requested_packages: Union[str, Sequence],
+    verbose: bool=False,
+    use_pki: bool=False,
+    use_overrides: bool=True,
+    config: Optional[str]=None,
+    installer: Optional[str]=None,
+    install_plan: Optional[InstallPlan]=None,
+) -> InstallReport:
+    report = InstallReport(get_pkg_names(requested_packages))
+
+    with reporting(report):
+        setup = setup_install(config, installer, report)
+
+        if setup is None:
+            report.finish()
+            return report
+
+        ipydeps_config = setup.ipydeps_config
+
+        with report.phase('currently_installed'):
+            packages_before_install = currently_installed()
+
+        install_plan, requested_packages, dists_before = start_install(requested_packages, ipydeps_config, use_overrides, report, install_plan)
+
+        with report.phase('install_lock'):
+            lock, requested_packages = acquire_install_lock(setup.configs_path, requested_packages, dists_before)
+
+        try:
+            with report.phase('restore_snapshot'):
+                snapshot, requested_packages = restore_install_snapshot(requested_packages, ipydeps_config, use_overrides, dists_before, report)
+
+            succeeded = True
+            overrides = pending_overrides(install_plan, requested_packages)
+            override_results = {}
+
+            if overrides:
+                report.overrides = sorted(overrides)
+
+                with report.phase('run_overrides'):
+                    runs = override_runs(setup.configs_path)
+                    override_results = run_overrides(overrides, ipydeps_config.override_workers, ipydeps_config.command_timeout, runs)
+
+                succeeded = overrides_capturable(override_results)
+
+            packages_to_install = left_for_pip(override_results, requested_packages, report)
+
+            if len(packages_to_install) > 0:
+                with report.phase('run_pip'):
+                    wheelhouse = wheelhouse_path(ipydeps_config, setup.configs_path)
+                    returncode, err = run_pip(packages_to_install, use_pki, verbose, setup.pip_config_path, wheelhouse, setup.backend, ipydeps_config.command_timeout)
+
+                succeeded = pip_succeeded(returncode, err) and succeeded
+
+                with report.phase('invalidate_cache'):
+                    invalidate_cache(dists_before)
+
+            if snapshot is not None and report.snapshot is None and succeeded:
+                with report.phase('save_snapshot'):
+                    save_install_snapshot(snapshot, dists_before, report)
+
+            record_install_result(lock, report, succeeded)
+        finally:
+            release_install_lock(lock)
+
+        finish_install(packages_before_install, report)
+
+    report.finish()
+    emit_report(report, ipydeps_config.report_log)
     logger.debug('Done')
+    return report
+
+def warm_installed_index() -> None:
+    installed_index.distributions_by_module()
+    get_stdlib_packages()
+
+def warm_dependencies_json() -> None:
+    read_dependencies_json(load_config(config_dir(environ)))
+
+def run_warmup_step(step: Callable[[], None]) -> None:
+    try:
+        step()
+    except Exception as e:  # pylint: disable=broad-except
+        logger.debug('ipydeps warm-up step %s failed: %s', step.__name__, e)
+
+def warmup() -> List[Thread]:
+    '''
+    Starts loading the installed package index and fetching the
+    dependencies_link overrides on background threads, so the first
+    ipydeps.pip() call only waits on whatever hasn't finished yet.
+    Call it from an IPython startup file, or load ipydeps as an
+    IPython extension.
+    '''
+    threads = [
+        Thread(target=run_warmup_step, args=(step,), name=f'ipydeps-{step.__name__}', daemon=True)
+        for step in (warm_installed_index, warm_dependencies_json)
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    return threads
+
+def defer_install(requested_packages: Union[str, Sequence], options: InstallOptions) -> None:
+    packages = get_pkg_names(requested_packages)
+
+    with deferred_lock:
+        deferred_installs.append((options, packages))
+
+    logger.debug('Deferred install of %s', ', '.join(sorted(packages)))
+
+def flush() -> List[InstallReport]:
+    '''
+    Installs everything requested with ipydeps.pip(..., defer=True),
+    merging requests that share the same options so the overrides
+    and pip only run once per set of options.
+    '''
+    with deferred_lock:
+        pending = list(deferred_installs)
+        deferred_installs.clear()
+
+    merged: Dict[InstallOptions, Set[str]] = {}
+
+    for options, packages in pending:
+        merged.setdefault(options, set()).update(packages)
+
+    return [install_packages(sorted(packages), **options._asdict()) for options, packages in merged.items()]
+
+@contextmanager
+def batch():
+    '''
+    Defers every ipydeps.pip() call made inside the block (by this
+    thread) and installs them all together when the block exits.  If
+    the block raises, nothing is installed and the requests stay
+    queued for an explicit ipydeps.flush().
+    '''
+    token = batch_depth.set(batch_depth.get() + 1)
+
+    try:
+        yield
+    except BaseException:
+        batch_depth.reset(token)
+
+        if batch_depth.get() == 0:
+            logger.warning('Not installing the packages requested in ipydeps.batch(), the block raised.  Call ipydeps.flush() to install them.')
+
+        raise
+
+    batch_depth.reset(token)
+
+    if batch_depth.get() == 0:
+        flush()
+
+def pip(
+    requested_packages: Union[str, Sequence],
+    verbose: bool=False,
+    use_pki: bool=False,
+    use_overrides: bool=True,
+    config: Optional[str]=None,
+    defer: bool=False,
+    report: bool=False,
+    installer: Optional[str]=None,
+) -> Optional[InstallReport]:
+    '''
+    Installs the requested packages into the running interpreter's
+    environment.  With defer=True (or inside ipydeps.batch()), the
+    request is queued until ipydeps.flush() so several calls can
+    share a single override pass and pip run.
+
+    installer picks the installer backend ('pip' or 'uv') instead of
+    the installer config setting.  With report=True, the InstallReport
+    with per-phase timings and subprocess results is returned.
+    '''
+    options = InstallOptions(
+        verbose=verbose,
+        use_pki=use_pki,
+        use_overrides=use_overrides,
+        config=config,
+        installer=installer,
+    )
+
+    if defer or batch_depth.get() > 0:
+        defer_install(requested_packages, options)
+        return None
+
+    install_report = install_packages(requested_packages, **options._asdict())
+    return install_report if report else None
+
+def plan(
+    requested_packages: Union[str, Sequence],
+    use_overrides: bool=True,
+    fetch_overrides: bool=False,
+) -> InstallPlan:
+    '''
+    Returns what ipydeps.pip() would do for the requested packages
+    without doing any of it.  Nothing is installed or written, no
+    subprocess is started, and the overrides come from the cached
+    dependencies JSON unless fetch_overrides=True.  Turn the plan
+    into JSON with ipydeps.plans.plan_to_dict().
+    '''
+    ipydeps_config = load_config(config_dir(environ))
+    return make_plan(requested_packages, ipydeps_config, use_overrides, fetch_overrides=fetch_overrides)
@@ -0,0 +1,117 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from hashlib import sha256
+from pathlib import Path
+from time import sleep, time
+from typing import Dict, Iterable, Optional
+
+import json
+import os
+import sys
+
+from .cache import atomic_write_text
+from .config import state_dir
+from .logger import logger
+
+LOCK_POLL_INTERVAL = 0.1  # seconds, only used where locks can't block
+
+def install_key(packages: Iterable[str], prefix: str=sys.prefix) -> str:
+    '''
+    Identifies a set of packages being installed into one environment.
+    '''
+    data = {'packages': sorted(packages), 'prefix': prefix}
+    return sha256(json.dumps(data, sort_keys=True).encode('utf8')).hexdigest()
+
+def locks_dir(configs_path: Path) -> Path:
+    return state_dir(configs_path, 'locks')
+
+class InstallLock:
+    '''
+    A lock file held while one kernel installs a set of packages, so
+    other kernels in the same environment wait for it instead of running
+    their own resolver against the same site-packages.  The lock is an
+    OS file lock, so it is released even if the holder dies.
+    '''
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.waited = False
+        self._fd: Optional[int] = None
+
+    def acquire(self, on_wait=None) -> 'InstallLock':
+        self._fd = os.open(str(self.path), os.O_RDWR | os.O_CREAT, 0o666)
+
+        if not lock_file(self._fd, blocking=False):
+            self.waited = True
+
+            if on_wait is not None:
+                on_wait()
+
+            lock_file(self._fd, blocking=True)
+
+        return self
+
+    def release(self) -> None:
+        if self._fd is not None:
+            unlock_file(self._fd)
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+if os.name == 'nt':
+    import msvcrt  # pylint: disable=import-error
+
+    def lock_file(fd: int, blocking: bool) -> bool:
+        os.lseek(fd, 0, os.SEEK_SET)
+
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)  # pylint: disable=no-member
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+
+                sleep(LOCK_POLL_INTERVAL)
+
+    def unlock_file(fd: int) -> None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)  # pylint: disable=no-member
+else:
+    import fcntl
+
+    def lock_file(fd: int, blocking: bool) -> bool:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def unlock_file(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+def install_lock(configs_path: Path, key: str) -> InstallLock:
+    return InstallLock(locks_dir(configs_path) / f'{key}.lock')
+
+def write_install_result(lock: InstallLock, result: Dict) -> None:
+    '''
+    Records how the install under a lock went, for
+    the kernels that were waiting on it.
+    '''
+    result = dict(result, pid=os.getpid(), finished=time())
+
+    try:
+        atomic_write_text(lock.path.with_suffix('.json'), json.dumps(result, sort_keys=True))
+    except OSError as e:
+        logger.debug('Could not write install result %s: %s', lock.path, e)
+
+def read_install_result(lock: InstallLock) -> Optional[Dict]:
+    try:
+        return json.loads(lock.path.with_suffix('.json').read_text(encoding='utf8'))
+    except (OSError, ValueError):
+        return None
@@ -1,3 +1,27 @@
-from ipylogging import get_logger
+# vim: expandtab tabstop=4 shiftwidth=4
 
-logger = get_logger(show_time=False, show_level=False)
+from threading import Lock
+
+class LazyLogger:
+    '''
+    Stands in for the ipylogging logger until the first message.
+    ipylogging imports IPython, which is most of the cost of
+    import ipydeps outside a kernel.
+    '''
+
+    def __init__(self):
+        self._logger = None
+        self._lock = Lock()
+
+    def _get_logger(self):
+        with self._lock:
+            if self._logger is None:
+                from ipylogging import get_logger  # pylint: disable=import-outside-toplevel
+                self._logger = get_logger(show_time=False, show_level=False)
+
+        return self._logger
+
+    def __getattr__(self, name):
+        return getattr(self._get_logger(), name)
+
+logger = LazyLogger()
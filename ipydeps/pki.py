@@ -0,0 +1,91 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from pathlib import Path
+from tempfile import mkdtemp
+from threading import Lock
+from typing import Optional, Tuple
+
+import atexit
+import os
+import shutil
+
+from .logger import logger
+from .utils import combine_key_and_cert
+
+COMBINED_CERT_NAME = 'client.pem'
+
+class PKISession:
+    '''
+    Decrypts the PKI key once per process and keeps the combined
+    key/cert file (in a private directory, readable only by its owner)
+    and the SSL context around for every pip run and overrides fetch.
+    The file is removed when the process exits or close() is called.
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self._dir: Optional[Path] = None
+        self._combined_path: Optional[Path] = None
+        self._ca_path: Optional[str] = None
+        self._ssl_context = None
+        self._cleanup_registered = False
+
+    def cert_paths(self) -> Tuple[Path, str]:
+        '''
+        Returns the paths of the combined key/cert file
+        and the CA bundle, creating the former if needed.
+        '''
+        with self._lock:
+            if self._combined_path is None or not self._combined_path.exists():
+                self._combined_path = self._write_combined_cert()
+
+                from pypki3 import loader as pki_loader  # pylint: disable=import-outside-toplevel
+                self._ca_path = pki_loader.ca_path()
+
+            return self._combined_path, self._ca_path
+
+    def ssl_context(self):
+        with self._lock:
+            if self._ssl_context is None:
+                from pypki3 import ssl_context  # pylint: disable=import-outside-toplevel
+                self._ssl_context = ssl_context()
+
+            return self._ssl_context
+
+    def _write_combined_cert(self) -> Path:
+        from pypki3 import NamedTemporaryKeyCertPaths  # pylint: disable=import-outside-toplevel
+
+        if self._dir is None or not self._dir.is_dir():
+            self._dir = Path(mkdtemp(prefix='ipydeps-pki-'))  # mode 0700
+
+        if not self._cleanup_registered:
+            atexit.register(self.close)
+            self._cleanup_registered = True
+
+        combined_path = self._dir / COMBINED_CERT_NAME
+
+        # create the file with owner-only permissions before any key material is written
+        os.close(os.open(str(combined_path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600))
+        os.chmod(str(combined_path), 0o600)
+
+        with NamedTemporaryKeyCertPaths() as key_cert_paths:
+            combine_key_and_cert(combined_path, Path(key_cert_paths[0]), Path(key_cert_paths[1]))
+
+        logger.debug('Created PKI session certificate %s', combined_path)
+        return combined_path
+
+    def close(self) -> None:
+        '''
+        Removes the combined key/cert file and forgets the SSL
+        context, so the next PKI request starts a new session.
+        '''
+        with self._lock:
+            if self._dir is not None:
+                shutil.rmtree(str(self._dir), ignore_errors=True)
+
+            self._dir = None
+            self._combined_path = None
+            self._ca_path = None
+            self._ssl_context = None
+
+pki_session = PKISession()
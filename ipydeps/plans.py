@@ -0,0 +1,37 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from collections import namedtuple
+from typing import Dict
+
+InstallPlan = namedtuple(
+    'InstallPlan',
+    [
+        'requested',
+        'stdlib',
+        'already_installed',
+        'importable',
+        'overrides',
+        'pip',
+    ],
+)
+InstallPlan.__new__.__defaults__ = ((), (), (), (), None, ())
+
+def plan_to_dict(plan: InstallPlan) -> Dict:
+    return {
+        'requested': list(plan.requested),
+        'stdlib': list(plan.stdlib),
+        'already_installed': list(plan.already_installed),
+        'importable': list(plan.importable),
+        'overrides': dict(plan.overrides or {}),
+        'pip': list(plan.pip),
+    }
+
+def plan_from_dict(d: Dict) -> InstallPlan:
+    return InstallPlan(
+        requested=list(d.get('requested', [])),
+        stdlib=list(d.get('stdlib', [])),
+        already_installed=list(d.get('already_installed', [])),
+        importable=list(d.get('importable', [])),
+        overrides=dict(d.get('overrides', {})),
+        pip=list(d.get('pip', [])),
+    )
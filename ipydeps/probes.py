@@ -0,0 +1,102 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from hashlib import sha256
+from importlib.util import find_spec
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Dict, List, Optional, Sequence
+
+import json
+import os
+import sys
+
+from .cache import atomic_write_text
+from .config import state_dir
+from .logger import logger
+
+OVERRIDE_RUNS_FILE = 'override-runs.json'
+
+def probe_values(probe: Dict, key: str) -> List[str]:
+    value = probe.get(key, [])
+    return [value] if isinstance(value, str) else [str(v) for v in value]
+
+def import_findable(name: str) -> bool:
+    try:
+        return find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+def probe_satisfied(probe: Dict) -> bool:
+    '''
+    A probe like {"import": "numpy", "path": "/usr/lib64/libfoo.so"}
+    is satisfied when every import name can be found (without importing
+    it) and every path exists.  Both take a string or a list.
+    '''
+    imports = probe_values(probe, 'import')
+    paths = probe_values(probe, 'path')
+
+    if not imports and not paths:
+        return False
+
+    if not all(import_findable(name) for name in imports):
+        return False
+
+    return all(Path(os.path.expandvars(p)).expanduser().exists() for p in paths)
+
+def override_run_key(args: Sequence[str]) -> str:
+    '''
+    A command's run only counts for the same interpreter and environment.
+    '''
+    key = json.dumps({
+        'command': list(args),
+        'python': sys.executable,
+        'version': sys.version,
+        'prefix': sys.prefix,
+    }, sort_keys=True)
+    return sha256(key.encode('utf8')).hexdigest()
+
+class OverrideRuns:
+    '''
+    A record of override commands that succeeded, kept in a JSON file
+    so later kernels can skip them.  Shared by the threads running
+    overrides, and merged with what other kernels wrote on each update.
+    '''
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = Lock()
+        self._runs: Optional[Dict[str, Dict]] = None
+
+    def _read(self) -> Dict[str, Dict]:
+        try:
+            runs = json.loads(self.path.read_text(encoding='utf8'))
+        except (OSError, ValueError):
+            return {}
+
+        return runs if isinstance(runs, dict) else {}
+
+    def succeeded(self, args: Sequence[str]) -> bool:
+        with self._lock:
+            if self._runs is None:
+                self._runs = self._read()
+
+            return override_run_key(args) in self._runs
+
+    def record(self, args: Sequence[str]) -> None:
+        with self._lock:
+            runs = self._read()
+            runs[override_run_key(args)] = {'command': list(args), 'prefix': sys.prefix, 'time': time()}
+            self._runs = runs
+
+            try:
+                atomic_write_text(self.path, json.dumps(runs, indent=1, sort_keys=True))
+            except OSError as e:
+                logger.debug('Could not record the override run in %s: %s', self.path, e)
+
+def override_runs(configs_path: Path) -> Optional[OverrideRuns]:
+    try:
+        return OverrideRuns(state_dir(configs_path, 'state') / OVERRIDE_RUNS_FILE)
+    except OSError as e:
+        logger.debug('Not recording override runs: %s', e)
+        return None
@@ -0,0 +1,132 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import json
+
+from .logger import logger
+
+class InstallReport:
+    '''
+    Structured record of a single install: how long each phase
+    of the pipeline took, every subprocess that ran, and which
+    packages were handled at each step.
+    '''
+
+    def __init__(self, requested: Sequence[str]):
+        self.requested = sorted(requested)
+        self.stdlib: List[str] = []
+        self.already_installed: List[str] = []
+        self.importable: List[str] = []
+        self.overrides: List[str] = []
+        self.pip: List[str] = []
+        self.new_packages: List[str] = []
+        self.snapshot: Optional[str] = None
+        self.phases: Dict[str, float] = {}
+        self.subprocesses: List[Dict] = []
+        self.started = time()
+        self.seconds: Optional[float] = None
+        self._lock = Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time()
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time() - start
+
+    def record_subprocess(self, args: Sequence[str], returncode: int, seconds: float) -> None:
+        with self._lock:
+            self.subprocesses.append({
+                'args': [str(a) for a in args],
+                'returncode': returncode,
+                'seconds': seconds,
+            })
+
+    def finish(self) -> None:
+        self.seconds = time() - self.started
+
+    def to_dict(self) -> Dict:
+        return {
+            'requested': self.requested,
+            'stdlib': self.stdlib,
+            'already_installed': self.already_installed,
+            'importable': self.importable,
+            'overrides': self.overrides,
+            'pip': self.pip,
+            'new_packages': self.new_packages,
+            'snapshot': self.snapshot,
+            'phases': dict(self.phases),
+            'subprocesses': list(self.subprocesses),
+            'started': self.started,
+            'seconds': self.seconds,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    def __repr__(self):
+        seconds = 0.0 if self.seconds is None else self.seconds
+        return f'<InstallReport {len(self.requested)} requested, {len(self.pip)} via pip, {len(self.overrides)} via overrides, {seconds:.2f}s>'
+
+report_callbacks: List[Callable[[InstallReport], None]] = []
+# the report of the install running in this thread (or task), if any
+active_report: ContextVar[Optional[InstallReport]] = ContextVar('ipydeps_active_report', default=None)
+
+def add_report_callback(callback: Callable[[InstallReport], None]) -> None:
+    '''
+    Registers a function that receives the InstallReport
+    of every install once it finishes.
+    '''
+    report_callbacks.append(callback)
+
+def remove_report_callback(callback: Callable[[InstallReport], None]) -> None:
+    report_callbacks.remove(callback)
+
+def record_subprocess(args: Sequence[str], returncode: int, seconds: float) -> None:
+    '''
+    Adds a subprocess run to the report of the install in progress, if any.
+    '''
+    report = active_report.get()
+
+    if report is not None:
+        report.record_subprocess(args, returncode, seconds)
+
+@contextmanager
+def reporting(report: Optional[InstallReport]):
+    '''
+    Makes report the one record_subprocess() adds to, in this thread
+    (or task) only.  Finishing the report is left to the caller.
+    '''
+    token = active_report.set(report)
+
+    try:
+        yield report
+    finally:
+        active_report.reset(token)
+
+def emit_report(report: InstallReport, report_log: Optional[str]=None) -> None:
+    '''
+    Appends the report as a JSON line to report_log (when
+    configured) and hands it to the registered callbacks.
+    '''
+    if report_log:
+        try:
+            with Path(report_log).expanduser().open('a', encoding='utf8') as f:
+                f.write(report.to_json() + '\n')
+        except OSError as e:
+            logger.debug('Could not write install report to %s: %s', report_log, e)
+
+    for callback in list(report_callbacks):
+        try:
+            callback(report)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.debug('Install report callback %r failed: %s', callback, e)
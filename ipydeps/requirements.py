@@ -0,0 +1,294 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+import re
+
+from .logger import logger
+from .utils import normalize_name
+
+# every pattern is anchored at the scan position and can't backtrack
+# more than a character, so scanning is linear in the size of the input
+name_pattern = re.compile(r'[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?')
+space_pattern = re.compile(r'\s*')
+token_pattern = re.compile(r'\S+')
+extras_pattern = re.compile(r'\[\s*([A-Za-z0-9._,\s-]*?)\s*\]')
+specifier_pattern = re.compile(r'\s*(===|~=|==|!=|<=|>=|<|>)\s*(v?[0-9][A-Za-z0-9.*+!_-]*)')
+comment_pattern = re.compile(r'(^|\s)#.*$')
+marker_token_pattern = re.compile(r'''\s*(?:('[^']*'|"[^"]*")|(===|~=|==|!=|<=|>=|<|>|\(|\))|([A-Za-z_][A-Za-z0-9_.]*))''')
+
+MARKER_WORDS = frozenset([
+    'and',
+    'or',
+    'in',
+    'not',
+    'extra',
+    'implementation_name',
+    'implementation_version',
+    'os_name',
+    'platform_machine',
+    'platform_python_implementation',
+    'platform_release',
+    'platform_system',
+    'platform_version',
+    'python_full_version',
+    'python_version',
+    'sys_platform',
+    'os.name',
+    'sys.platform',
+    'platform.machine',
+    'platform.python_implementation',
+    'platform.version',
+    'python_implementation',
+])
+
+REQUIREMENT_OPTIONS = ('-r', '--requirement')
+
+# pip options that can appear in requirements files, and take a value
+OPTIONS_WITH_VALUE = frozenset(REQUIREMENT_OPTIONS + (
+    '-c',
+    '--constraint',
+    '-e',
+    '--editable',
+    '-f',
+    '--find-links',
+    '-i',
+    '--index-url',
+    '--extra-index-url',
+    '--trusted-host',
+    '--hash',
+))
+
+def valid_marker(marker: str) -> bool:
+    '''
+    Only lets through markers made of marker variables, quoted strings,
+    comparisons and parentheses.  packaging checks the grammar itself
+    when the marker is evaluated.
+    '''
+    pos = 0
+    strings = 0
+
+    while pos < len(marker):
+        match = marker_token_pattern.match(marker, pos)
+
+        if match is None or match.end() == pos:
+            return marker[pos:].strip() == '' and strings > 0
+
+        if match.group(1) is not None:
+            strings += 1
+        elif match.group(3) is not None and match.group(3) not in MARKER_WORDS:
+            return False
+
+        pos = match.end()
+
+    return strings > 0
+
+def scan_requirement(line: str, pos: int) -> Tuple[Optional[str], int]:
+    '''
+    Reads one PEP 508 requirement (name, extras, version specifiers
+    and a marker, without URLs) starting at pos.  Returns the normalized
+    requirement, or None if there isn't a valid one there, and the
+    position to carry on scanning from.
+    '''
+    invalid = (None, token_pattern.match(line, pos).end())
+    match = name_pattern.match(line, pos)
+
+    if match is None:
+        return invalid
+
+    requirement = normalize_name(match.group())
+    pos = space_pattern.match(line, match.end()).end()
+
+    if line.startswith('[', pos):
+        match = extras_pattern.match(line, pos)
+
+        if match is None:
+            return invalid
+
+        extras = [e.strip() for e in match.group(1).split(',')] if match.group(1) else []
+
+        if not all(name_pattern.fullmatch(e) for e in extras):
+            return invalid
+
+        if extras:
+            requirement += '[' + ','.join(sorted({normalize_name(e) for e in extras})) + ']'
+
+        pos = space_pattern.match(line, match.end()).end()
+
+    if line.startswith('@', pos):
+        # a direct URL requirement, which would otherwise install from the index by name
+        url = token_pattern.match(line, space_pattern.match(line, pos + 1).end())
+        end = url.end() if url is not None else len(line)
+
+        if line.startswith(';', space_pattern.match(line, end).end()):
+            end = len(line)  # and its marker
+
+        return None, end
+
+    parenthesized = line.startswith('(', pos)
+    spec_start = pos + 1 if parenthesized else pos
+    specifiers: List[str] = []
+
+    while True:
+        match = specifier_pattern.match(line, spec_start)
+
+        if match is None:
+            break
+
+        specifiers.append(match.group(1) + match.group(2))
+        after = space_pattern.match(line, match.end()).end()
+        spec_start = after
+
+        if not line.startswith(',', after):
+            break
+
+        if specifier_pattern.match(line, after + 1) is None:
+            if line[after + 1:].strip() == '':
+                return invalid  # a trailing comma
+
+            break  # a comma before the next requirement
+
+        spec_start = after + 1
+
+    if parenthesized:
+        if not specifiers or not line.startswith(')', spec_start):
+            return invalid
+
+        spec_start = space_pattern.match(line, spec_start + 1).end()
+
+    if specifiers:
+        requirement += ','.join(specifiers)
+        pos = spec_start
+
+    if line.startswith(';', pos):
+        marker = line[pos + 1:].strip()
+
+        if not valid_marker(marker):
+            return None, len(line)  # the marker runs to the end of the line
+
+        return f'{requirement}; {marker}', len(line)
+
+    if line.startswith(',', pos):
+        return requirement, pos + 1  # a comma between requirements, like numpy,pandas
+
+    if pos < len(line) and not line[pos - 1].isspace():
+        return invalid  # junk straight after the requirement, like exec()
+
+    return requirement, pos
+
+def logical_lines(lines: Iterable[str]) -> Iterator[str]:
+    '''
+    Joins backslash continued lines and strips comments.
+    '''
+    pending = ''
+
+    for line in lines:
+        if line.endswith('\\'):
+            pending += line[:-1]
+            continue
+
+        line = comment_pattern.sub('', pending + line)
+        pending = ''
+
+        if line and not line.isspace():
+            yield line
+
+    if pending:
+        yield comment_pattern.sub('', pending)
+
+class RequirementsParser:
+    '''
+    Collects the requirements from lines in requirements file
+    format, following -r includes and skipping other pip options.
+    '''
+
+    def __init__(self):
+        self.requirements: Set[str] = set()
+        self.seen: Set[Path] = set()
+        self.ignored_options: Set[str] = set()
+
+    def parse_lines(self, lines: Iterable[str], base: Path) -> None:
+        for line in logical_lines(lines):
+            self.scan_line(line, base)
+
+    def parse_file(self, path: Path) -> None:
+        path = path.resolve()
+
+        if path in self.seen:
+            return
+
+        self.seen.add(path)
+
+        try:
+            text = path.read_text(encoding='utf8')
+        except (OSError, ValueError) as e:
+            logger.error('Could not read requirements file %s: %s', path, e)
+            return
+
+        self.parse_lines(text.splitlines(), path.parent)
+
+    def scan_line(self, line: str, base: Path) -> None:
+        pos = space_pattern.match(line).end()
+
+        while pos < len(line):
+            if line.startswith('-', pos):
+                end = self.scan_option(line, pos, base)
+            else:
+                requirement, end = scan_requirement(line, pos)
+
+                if requirement is None:
+                    logger.warning('Ignoring %s, it is not a valid requirement', line[pos:end].strip())
+                else:
+                    self.requirements.add(requirement)
+
+            pos = space_pattern.match(line, end).end()
+
+    def scan_option(self, line: str, pos: int, base: Path) -> int:
+        '''
+        Reads the pip option at pos, and its value if it takes one.
+        Only -r is acted on.  Returns the position after the option.
+        '''
+        token = token_pattern.match(line, pos)
+        end = token.end()
+        option, has_value, value = token.group().partition('=')
+
+        if not has_value and not option.startswith('--') and len(option) > 2:
+            option, value, has_value = option[:2], option[2:], '='  # like -rrequirements.txt
+
+        if not has_value and option in OPTIONS_WITH_VALUE:
+            value_token = token_pattern.match(line, space_pattern.match(line, end).end())
+
+            if value_token is not None:
+                value, end = value_token.group(), value_token.end()
+
+        if option in REQUIREMENT_OPTIONS:
+            if value:
+                self.parse_file(base / Path(value).expanduser())
+        elif option not in self.ignored_options:
+            logger.warning('Ignoring pip option %s', option)
+            self.ignored_options.add(option)
+
+        return end
+
+def parse_requirements(x: Union[str, Iterable[str]], base: Optional[Path]=None) -> Set[str]:
+    '''
+    Parses requirements, given as a string in requirements file format
+    or as a list of such strings, into a set of normalized requirement
+    strings.  Names are normalized with PEP 503 rules, -r includes are
+    followed (relative to base, or the current directory), other pip
+    options are ignored, and anything that isn't a valid requirement is
+    skipped with a warning, so strings that might contain code or extra
+    pip arguments never get through.
+    '''
+    if base is None:
+        base = Path()
+
+    if isinstance(x, str):
+        lines: Iterable[str] = x.splitlines()
+    else:
+        lines = (line for item in x for line in str(item).splitlines())
+
+    parser = RequirementsParser()
+    parser.parse_lines(lines, base)
+    return parser.requirements
@@ -0,0 +1,270 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from collections import namedtuple
+from hashlib import sha256
+from os import environ
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import ast
+import json
+import sys
+
+from .cache import atomic_write_text
+from .config import config_dir, load_config
+from .ipydeps import InstallOptions, get_pkg_names, install_packages, make_plan
+from .logger import logger
+from .plans import InstallPlan, plan_from_dict, plan_to_dict
+from .report import InstallReport
+
+PLAN_SUFFIX = '.ipydeps-plan.json'
+PLAN_FORMAT = 1
+
+PipCall = namedtuple(
+    'PipCall',
+    [
+        'packages',
+        'options',
+        'cell',
+        'line',
+    ],
+)
+
+def notebook_code_cells(path: Path) -> Iterator[Tuple[int, str]]:
+    '''
+    Yields (cell number, source) for the code cells of a notebook.
+    Outputs are dropped while the JSON is decoded, so large images
+    and tables don't stay in memory while the cells are scanned.
+    '''
+    def drop_outputs(pairs):
+        return {k: v for k, v in pairs if k not in ('outputs', 'attachments')}
+
+    with path.open('r', encoding='utf8') as f:
+        notebook = json.load(f, object_pairs_hook=drop_outputs)
+
+    for number, cell in enumerate(notebook.get('cells', [])):
+        if cell.get('cell_type') != 'code':
+            continue
+
+        source = cell.get('source', '')
+
+        if isinstance(source, list):
+            source = ''.join(source)
+
+        yield number, source
+
+def strip_magics(source: str) -> Optional[str]:
+    '''
+    Blanks out IPython magics and shell escapes so the rest of the
+    cell parses as Python.  Cell magics make the whole cell opaque.
+    '''
+    if source.lstrip().startswith('%%'):
+        return None
+
+    lines = []
+
+    for line in source.splitlines():
+        if line.lstrip().startswith(('%', '!')):
+            indent = line[:len(line) - len(line.lstrip())]
+            lines.append(indent + 'pass')
+        else:
+            lines.append(line)
+
+    return '\n'.join(lines)
+
+def ipydeps_aliases(trees: Sequence[ast.AST]) -> Tuple[Set[str], Set[str]]:
+    '''
+    Returns the names the ipydeps module and its pip
+    function are bound to anywhere in the notebook.
+    '''
+    modules = {'ipydeps'}
+    functions = set()
+
+    for tree in trees:
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.name == 'ipydeps':
+                        modules.add(alias.asname or alias.name)
+            elif isinstance(node, ast.ImportFrom) and node.module == 'ipydeps':
+                for alias in node.names:
+                    if alias.name == 'pip':
+                        functions.add(alias.asname or alias.name)
+
+    return modules, functions
+
+def is_pip_call(node: ast.Call, modules: Set[str], functions: Set[str]) -> bool:
+    func = node.func
+
+    if isinstance(func, ast.Attribute):
+        return func.attr == 'pip' and isinstance(func.value, ast.Name) and func.value.id in modules
+
+    return isinstance(func, ast.Name) and func.id in functions
+
+def literal_argument(node: ast.AST, what: str, cell: int) -> Tuple[bool, object]:
+    try:
+        return True, ast.literal_eval(node)
+    except (TypeError, ValueError, SyntaxError):
+        logger.warning('Cell %d: %s is not a literal, skipping it', cell, what)
+        return False, None
+
+def pip_call_from_node(node: ast.Call, cell: int) -> Optional[PipCall]:
+    packages_node = node.args[0] if node.args else None
+    options = InstallOptions(verbose=False, use_pki=False, use_overrides=True, config=None, installer=None)
+
+    for keyword in node.keywords:
+        if keyword.arg == 'requested_packages':
+            packages_node = keyword.value
+        elif keyword.arg in InstallOptions._fields:
+            ok, value = literal_argument(keyword.value, keyword.arg, cell)
+
+            if ok:
+                options = options._replace(**{keyword.arg: value})
+
+    if packages_node is None:
+        return None
+
+    ok, packages = literal_argument(packages_node, 'ipydeps.pip() argument', cell)
+
+    if not ok or not isinstance(packages, (str, list, tuple, set)):
+        return None
+
+    return PipCall(
+        packages=sorted(get_pkg_names(packages)),
+        options=options,
+        cell=cell,
+        line=node.lineno,
+    )
+
+def find_pip_calls(path: Path) -> List[PipCall]:
+    '''
+    Finds every ipydeps.pip() call in a notebook's code cells,
+    in the order they appear.
+    '''
+    trees = []
+
+    for number, source in notebook_code_cells(Path(path)):
+        source = strip_magics(source)
+
+        if source is None:
+            continue
+
+        try:
+            trees.append((number, ast.parse(source)))
+        except SyntaxError as e:
+            logger.warning('Cell %d could not be parsed, skipping it: %s', number, e)
+
+    modules, functions = ipydeps_aliases([tree for _, tree in trees])
+    calls = []
+
+    for number, tree in trees:
+        nodes = [n for n in ast.walk(tree) if isinstance(n, ast.Call) and is_pip_call(n, modules, functions)]
+
+        for node in sorted(nodes, key=lambda n: (n.lineno, n.col_offset)):
+            call = pip_call_from_node(node, number)
+
+            if call is not None:
+                calls.append(call)
+
+    return calls
+
+def scan_notebook(path: Path) -> Dict[InstallOptions, List[str]]:
+    '''
+    Returns the deduplicated packages a notebook asks ipydeps to install,
+    grouped by the install options they were requested with.
+    '''
+    grouped: Dict[InstallOptions, Set[str]] = {}
+
+    for call in find_pip_calls(path):
+        grouped.setdefault(call.options, set()).update(call.packages)
+
+    return {options: sorted(packages) for options, packages in grouped.items()}
+
+def plan_path(notebook_path: Path) -> Path:
+    notebook_path = Path(notebook_path)
+    return notebook_path.with_name(notebook_path.stem + PLAN_SUFFIX)
+
+def scan_fingerprint(scanned: Dict[InstallOptions, List[str]]) -> str:
+    '''
+    Identifies the notebook's requests on this interpreter, so a cached
+    plan survives edits to anything but the ipydeps.pip() calls.
+    '''
+    data = {
+        'python': sys.version_info[:3],
+        'prefix': sys.prefix,
+        'requests': sorted(json.dumps([list(options), packages]) for options, packages in scanned.items()),
+    }
+    return sha256(json.dumps(data, sort_keys=True).encode('utf8')).hexdigest()
+
+def read_notebook_plan(path: Path, fingerprint: str) -> Optional[List[Tuple[InstallOptions, InstallPlan]]]:
+    try:
+        data = json.loads(path.read_text(encoding='utf8'))
+    except (OSError, ValueError):
+        return None
+
+    if data.get('format') != PLAN_FORMAT or data.get('fingerprint') != fingerprint:
+        return None
+
+    try:
+        return [(InstallOptions(**b['options']), plan_from_dict(b['plan'])) for b in data['batches']]
+    except (KeyError, TypeError) as e:
+        logger.debug('Ignoring malformed install plan %s: %s', path, e)
+        return None
+
+def write_notebook_plan(path: Path, fingerprint: str, plans: List[Tuple[InstallOptions, InstallPlan]]) -> None:
+    data = {
+        'format': PLAN_FORMAT,
+        'fingerprint': fingerprint,
+        'batches': [{'options': options._asdict(), 'plan': plan_to_dict(plan)} for options, plan in plans],
+    }
+
+    try:
+        atomic_write_text(path, json.dumps(data, indent=2, sort_keys=True) + '\n')
+    except OSError as e:
+        logger.warning('Could not write install plan %s: %s', path, e)
+
+def make_notebook_plans(scanned: Dict[InstallOptions, List[str]], fetch_overrides: bool=True) -> List[Tuple[InstallOptions, InstallPlan]]:
+    ipydeps_config = load_config(config_dir(environ))
+    return [(options, make_plan(packages, ipydeps_config, options.use_overrides, fetch_overrides=fetch_overrides)) for options, packages in scanned.items()]
+
+def plan_notebook(notebook_path: Path, write: bool=True, fetch_overrides: bool=True) -> List[Tuple[InstallOptions, InstallPlan]]:
+    '''
+    Scans a notebook and returns one install plan per set of install
+    options.  The plans are cached next to the notebook and reused
+    until its ipydeps.pip() calls or the interpreter change.
+    '''
+    notebook_path = Path(notebook_path)
+    scanned = scan_notebook(notebook_path)
+    fingerprint = scan_fingerprint(scanned)
+    cached_path = plan_path(notebook_path)
+    plans = read_notebook_plan(cached_path, fingerprint)
+
+    if plans is not None:
+        logger.debug('Using cached install plan %s', cached_path)
+        return plans
+
+    plans = make_notebook_plans(scanned, fetch_overrides)
+
+    if write:
+        write_notebook_plan(cached_path, fingerprint, plans)
+
+    return plans
+
+def install_notebook(notebook_path: Path, write: bool=True) -> List[InstallReport]:
+    '''
+    Installs everything a notebook asks ipydeps for in one pass
+    per set of install options, before any of its cells run.  The
+    plans are always made again first, since a cached plan may have
+    been made with other packages installed or other overrides.
+    '''
+    notebook_path = Path(notebook_path)
+    scanned = scan_notebook(notebook_path)
+    plans = make_notebook_plans(scanned)
+
+    if write:
+        write_notebook_plan(plan_path(notebook_path), scan_fingerprint(scanned), plans)
+
+    return [
+        install_packages(plan.requested, install_plan=plan, **options._asdict())
+        for options, plan in plans
+    ]
@@ -0,0 +1,248 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from hashlib import sha256
+from io import BytesIO
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import csv
+import json
+import os
+import platform
+import site
+import sys
+import sysconfig
+import tarfile
+
+from .config import Config, private_dir
+from .installed import Distribution
+from .logger import logger
+from .utils import normalize_name
+
+SNAPSHOT_SUFFIX = '.tar.gz'
+MANIFEST_NAME = 'ipydeps-snapshot.json'
+
+def site_dirs() -> Dict[str, Path]:
+    '''
+    The directories installs can land in, by a name that
+    means the same thing on every kernel using the cache.
+    '''
+    paths = sysconfig.get_paths()
+    dirs = {
+        'purelib': Path(paths['purelib']),
+        'platlib': Path(paths['platlib']),
+        'scripts': Path(paths['scripts']),
+    }
+
+    if site.ENABLE_USER_SITE:
+        dirs['usersite'] = Path(site.getusersitepackages())
+        dirs['userscripts'] = Path(sysconfig.get_path('scripts', f'{os.name}_user'))
+
+    return dirs
+
+def snapshot_key(
+    packages: Iterable[str],
+    python_version: str,
+    overrides: Optional[Dict],
+    installed: Iterable[Distribution]=(),
+) -> str:
+    '''
+    A snapshot only holds what was new to the kernel that saved it, so
+    the distributions installed beforehand are part of the key.  Other
+    kernels would otherwise restore it without its dependencies, or on
+    top of different builds of them.  Console scripts point at the
+    interpreter that installed them, so its path is part of it too.
+    '''
+    data = {
+        'packages': sorted(packages),
+        'installed': sorted({(d.name, d.version) for d in installed}),
+        'python': python_version,
+        'executable': sys.executable,
+        'platform': [sys.platform, platform.machine(), sysconfig.get_platform()],
+        'overrides': overrides,
+    }
+    return sha256(json.dumps(data, sort_keys=True).encode('utf8')).hexdigest()
+
+def snapshot_path(config: Config, key: str) -> Optional[Path]:
+    '''
+    Restored files end up on sys.path, so snapshots are only used from
+    a directory no other user can write to.
+    '''
+    if not config.snapshot_dir:
+        return None
+
+    snapshot_dir = Path(config.snapshot_dir).expanduser()
+
+    try:
+        snapshot_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+
+        if not private_dir(snapshot_dir):
+            logger.warning('Not using snapshots in %s, other users can write to it', snapshot_dir)
+            return None
+    except OSError as e:
+        logger.warning('Not using snapshots in %s: %s', snapshot_dir, e)
+        return None
+
+    return snapshot_dir / (key + SNAPSHOT_SUFFIX)
+
+def safe_relative_path(name: str) -> Optional[PurePosixPath]:
+    path = PurePosixPath(name)
+
+    if path.is_absolute() or '..' in path.parts or len(path.parts) == 0:
+        return None
+
+    return path
+
+def dir_relative_path(path: Path, dirs: Dict[str, Path]) -> Optional[Tuple[str, PurePosixPath]]:
+    '''
+    Finds the known dir holding path, preferring the deepest one,
+    and returns its name with the path relative to it.
+    '''
+    for name, directory in sorted(dirs.items(), key=lambda item: -len(item[1].parts)):
+        try:
+            relative = path.relative_to(directory)
+        except ValueError:
+            continue
+
+        return name, PurePosixPath(*relative.parts)
+
+    return None
+
+def record_files(dist: Distribution, dirs: Dict[str, Path]) -> Optional[List[Tuple[str, PurePosixPath]]]:
+    '''
+    The files a distribution installed, as (dir name, relative path)
+    pairs.  Console scripts (../../bin) are found in the scripts dir,
+    and bytecode is left out.  Returns None if the RECORD can't be read
+    or lists a file outside the known dirs, like a header.
+    '''
+    try:
+        lines = (dist.path / 'RECORD').read_text(encoding='utf8').splitlines()
+    except OSError:
+        return None
+
+    files = []
+
+    for row in csv.reader(lines):
+        if len(row) == 0:
+            continue
+
+        path = Path(os.path.normpath(dist.path.parent / row[0]))
+
+        if '__pycache__' in path.parts:
+            continue
+
+        found = dir_relative_path(path, dirs)
+
+        if found is None or len(found[1].parts) == 0:
+            logger.debug('Not snapshotting, %s installed %s outside the known dirs', dist.name, row[0])
+            return None
+
+        files.append(found)
+
+    return files
+
+def dist_site_name(dist: Distribution, dirs: Dict[str, Path]) -> Optional[str]:
+    for name, path in dirs.items():
+        if dist.path.parent == path:
+            return name
+
+    return None
+
+def save_snapshot(path: Path, dists: Iterable[Distribution], replaced: Iterable[Distribution]=()) -> bool:
+    '''
+    Bundles the files of newly installed distributions into a
+    snapshot archive.  Distributions without a RECORD, or with files
+    outside the known dirs, can't be captured and skip the snapshot.
+    So do upgrades of the replaced (previously installed) distributions,
+    since restoring the new version wouldn't remove the old one.
+    '''
+    dists = list(dists)
+    dirs = site_dirs()
+    replaced_names = {normalize_name(d.name) for d in replaced}
+    members = []
+
+    for dist in dists:
+        if normalize_name(dist.name) in replaced_names:
+            logger.debug('Not snapshotting, %s replaced an installed version', dist.name)
+            return False
+
+        files = record_files(dist, dirs)
+
+        if dist_site_name(dist, dirs) is None or not files:
+            logger.debug('Not snapshotting, %s was not installed into a site dir with a RECORD', dist.name)
+            return False
+
+        members += files
+
+    if not members:
+        return False
+
+    manifest = json.dumps({'distributions': sorted(d.name for d in dists)}).encode('utf8')
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        with tarfile.open(str(tmp_path), 'w:gz') as tar:
+            for dir_name, f in members:
+                source = dirs[dir_name] / Path(*f.parts)
+
+                if source.is_file():
+                    tar.add(str(source), arcname=f'{dir_name}/{f}', recursive=False)
+
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size = len(manifest)
+            tar.addfile(info, BytesIO(manifest))
+
+        os.replace(str(tmp_path), str(path))
+    except (OSError, tarfile.TarError) as e:
+        logger.warning('Could not save snapshot %s: %s', path, e)
+
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+        return False
+
+    logger.debug('Saved snapshot %s', path)
+    return True
+
+def restore_snapshot(path: Path) -> bool:
+    '''
+    Unpacks a snapshot into this interpreter's site and scripts dirs.
+    Only regular files with relative paths inside a known dir are
+    extracted.
+    '''
+    if not path.is_file():
+        return False
+
+    dirs = site_dirs()
+
+    try:
+        with tarfile.open(str(path), 'r:gz') as tar:
+            # metadata goes last, so a partial restore never looks installed
+            members = sorted(tar.getmembers(), key=lambda m: '.dist-info/' in m.name)
+
+            for member in members:
+                if member.name == MANIFEST_NAME or member.isdir():
+                    continue
+
+                relative = safe_relative_path(member.name)
+
+                if not member.isfile() or relative is None or len(relative.parts) < 2 or relative.parts[0] not in dirs:
+                    logger.warning('Skipping unexpected member %s in snapshot %s', member.name, path)
+                    continue
+
+                target = dirs[relative.parts[0]].joinpath(*relative.parts[1:])
+                target.parent.mkdir(parents=True, exist_ok=True)
+                source = tar.extractfile(member)
+
+                with target.open('wb') as f:
+                    f.write(source.read())
+
+                os.chmod(str(target), (member.mode & 0o755) | 0o644)
+    except (OSError, tarfile.TarError) as e:
+        logger.warning('Could not restore snapshot %s: %s', path, e)
+        return False
+
+    logger.debug('Restored snapshot %s', path)
+    return True
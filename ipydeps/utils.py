@@ -1,11 +1,16 @@
 # vim: expandtab tabstop=4 shiftwidth=4
 
+from functools import lru_cache
 from pathlib import Path
-from typing import Set
+from typing import Dict, FrozenSet, Optional, Set
 
+import json
 import pkgutil
+import re
 import sys
 
+separator_runs_pattern = re.compile(r'[-_.]+')
+
 def combine_key_and_cert(combined_path: Path, key_path: Path, cert_path: Path) -> None:
     with combined_path.open('wb') as outfile:
         outfile.write(key_path.read_bytes())
@@ -15,25 +20,47 @@ def in_virtualenv():
     # https://stackoverflow.com/questions/1871549/determine-if-python-is-running-inside-virtualenv
     return sys.prefix != sys.base_prefix
 
+def normalize_name(name: str) -> str:
+    '''
+    PEP 503 normalization, so Foo.Bar, foo_bar and
+    foo-bar all name the same package.
+    '''
+    return separator_runs_pattern.sub('-', name).lower()
+
 def normalize_package_names(packages: Set) -> Set:
-    # normalize underscores to dashes to line
-    # up with pip freeze output
-    packages = {p.replace('_', '-') for p in packages}
-    packages = {p.lower() for p in packages}
-    return packages
-
-def get_stdlib_packages(version=sys.version_info.major, minor=sys.version_info.minor) -> Set:
-    stdlib_list = ''
-
-    if version == 3:
-        if minor >= 10 and hasattr(sys, "stdlib_module_names"):
-            stdlib_list = sys.stdlib_module_names  # pylint: disable=no-member
-            return normalize_package_names(set(stdlib_list))
-        stdlib_list = pkgutil.get_data(__name__, 'data/libs3.txt')
-    elif version == 2:
-        stdlib_list = pkgutil.get_data(__name__, 'data/libs2.txt')
-
-    stdlib_list = str(stdlib_list, encoding='utf8')
-    stdlib_list = (x.strip() for x in stdlib_list.split('\n'))
-    stdlib_list = (x for x in stdlib_list if len(x) > 0)
-    return set(stdlib_list)
+    return {normalize_name(p) for p in packages}
+
+@lru_cache(maxsize=None)
+def stdlib_artifact() -> Dict[str, FrozenSet[str]]:
+    '''
+    Loads the precomputed standard library names for every supported
+    Python version (generated by update_stdlib_list.py) once per process.
+    '''
+    data = json.loads(pkgutil.get_data(__name__, 'data/stdlib.json'))
+    return {version: frozenset(names) for version, names in data.items()}
+
+def closest_stdlib_version(stdlib: Dict[str, FrozenSet[str]], version: int, minor: int) -> Optional[str]:
+    '''
+    Picks the newest known version at or before major.minor,
+    or the oldest known one for that major version.
+    '''
+    minors = sorted(int(v.split('.')[1]) for v in stdlib if v.split('.')[0] == str(version))
+
+    if len(minors) == 0:
+        return None
+
+    older = [m for m in minors if m <= minor]
+    return f'{version}.{older[-1] if older else minors[0]}'
+
+@lru_cache(maxsize=None)
+def get_stdlib_packages(version=sys.version_info.major, minor=sys.version_info.minor) -> FrozenSet[str]:
+    if (version, minor) == sys.version_info[:2] and hasattr(sys, 'stdlib_module_names'):
+        return frozenset(normalize_package_names(set(sys.stdlib_module_names)))  # pylint: disable=no-member
+
+    stdlib = stdlib_artifact()
+    key = closest_stdlib_version(stdlib, version, minor)
+
+    if key is None:
+        return frozenset()
+
+    return stdlib[key]
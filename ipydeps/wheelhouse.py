@@ -0,0 +1,135 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from .config import Config
+from .utils import normalize_package_names
+
+PINS_FILE = 'pins.txt'
+ARCHIVE_SUFFIXES = ('.whl', '.tar.gz', '.tar.bz2', '.zip')
+
+def wheelhouse_path(config: Config, configs_path: Path) -> Path:
+    '''
+    The wheelhouse defaults to a directory next to the pip
+    configs in the ipydeps config dir.
+    '''
+    if config.wheelhouse:
+        return Path(config.wheelhouse).expanduser()
+
+    return configs_path / 'wheelhouse'
+
+def wheelhouse_available(wheelhouse: Optional[Path]) -> bool:
+    if wheelhouse is None or not wheelhouse.is_dir():
+        return False
+
+    return any(p.name.endswith(ARCHIVE_SUFFIXES) for p in wheelhouse.iterdir())
+
+def archive_names(wheelhouse: Path) -> Set[str]:
+    '''
+    The normalized names of the packages the wheelhouse has archives for.
+    '''
+    names = set()
+
+    for p in wheelhouse.iterdir():
+        parsed = parse_archive_name(p.name)
+
+        if parsed is not None:
+            names.add(parsed[0])
+
+    return normalize_package_names(names)
+
+def wheelhouse_covers(wheelhouse: Path, names: Iterable[str]) -> bool:
+    '''
+    Whether the wheelhouse has an archive for every one of the
+    (normalized) package names, so an offline install can work.
+    '''
+    return set(names) <= archive_names(wheelhouse)
+
+def parse_archive_name(filename: str) -> Optional[Tuple[str, str]]:
+    '''
+    Returns the (name, version) of a wheel or sdist filename.
+    '''
+    if filename.endswith('.whl'):
+        parts = filename[:-4].split('-')
+
+        if len(parts) < 5:
+            return None
+
+        return parts[0], parts[1]
+
+    for suffix in ARCHIVE_SUFFIXES[1:]:
+        if filename.endswith(suffix):
+            stem = filename[:-len(suffix)]
+
+            if '-' not in stem:
+                return None
+
+            name, version = stem.rsplit('-', 1)
+            return name, version
+
+    return None
+
+def saved_archives(pip_output: str) -> List[str]:
+    '''
+    Finds the files pip download saved or reused from its output.
+    '''
+    archives = []
+
+    for line in pip_output.splitlines():
+        line = line.strip()
+
+        for prefix in ('Saved ', 'File was already downloaded '):
+            if line.startswith(prefix):
+                archives.append(Path(line[len(prefix):].strip()).name)
+
+    return archives
+
+def read_pins(path: Path) -> Dict[str, str]:
+    pins = {}
+
+    try:
+        lines = path.read_text(encoding='utf8').splitlines()
+    except OSError:
+        return pins
+
+    for line in lines:
+        if '==' in line:
+            name, version = line.split('==', 1)
+            pins[name.strip()] = version.strip()
+
+    return pins
+
+def update_pins(wheelhouse: Path, archives: Sequence[str]) -> Dict[str, str]:
+    '''
+    Merges the versions of the given archives into the
+    wheelhouse's pins file and returns the new pins.
+    '''
+    path = wheelhouse / PINS_FILE
+    pins = read_pins(path)
+
+    for archive in archives:
+        parsed = parse_archive_name(archive)
+
+        if parsed is not None:
+            name = normalize_package_names({parsed[0]}).pop()
+            pins[name] = parsed[1]
+
+    path.write_text(''.join(f'{name}=={pins[name]}\n' for name in sorted(pins)), encoding='utf8')
+    return pins
+
+def wheelhouse_args(wheelhouse: Path, offline: bool) -> List[str]:
+    '''
+    pip arguments for installing from the wheelhouse, either
+    exclusively (offline) or in addition to the configured index.
+    '''
+    args = [f'--find-links={wheelhouse}']
+
+    if offline:
+        args.append('--no-index')
+        pins_path = wheelhouse / PINS_FILE
+
+        if pins_path.exists():
+            args.append(f'--constraint={pins_path}')
+
+    return args
@@ -0,0 +1,287 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from collections import deque
+from importlib import import_module
+from math import ceil
+from os import environ
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import atexit
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import traceback
+
+from .logger import logger
+
+WORKER_EXITED = 'The ipydeps worker exited before the command finished'
+
+# imported once by the worker, so each command starts with pip loaded
+WORKER_MODULES = (
+    'pip._internal.cli.main',
+    'pip._internal.commands.download',
+    'pip._internal.commands.install',
+    'pip._internal.commands.list',
+)
+
+def write_message(out, message: Dict) -> None:
+    out.write(json.dumps(message) + '\n')
+    out.flush()
+
+class MessageWriter(io.TextIOBase):
+    '''
+    Stands in for sys.stdout or sys.stderr in a command, sending
+    each line it writes to the client as a message.
+    '''
+    encoding = 'utf-8'
+
+    def __init__(self, out, request_id: int, stream: str):
+        super().__init__()
+        self.out = out
+        self.request_id = request_id
+        self.stream = stream
+        self.pending = ''
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        lines = (self.pending + text).split('\n')
+        self.pending = lines.pop()
+
+        for line in lines:
+            write_message(self.out, {'id': self.request_id, 'stream': self.stream, 'line': line.rstrip('\r')})
+
+        return len(text)
+
+    def flush(self) -> None:
+        self.out.flush()
+
+    def close(self) -> None:
+        if self.pending:
+            self.write('\n')
+
+        super().close()
+
+def module_stamp(name: str) -> Optional[int]:
+    try:
+        return os.stat(import_module(name).__file__).st_mtime_ns
+    except (OSError, TypeError):
+        return None
+
+def exit_code(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+
+    return os.WEXITSTATUS(status)
+
+def run_command(request: Dict, out) -> int:
+    '''
+    Runs one pip command in a forked child of the worker, so every
+    command starts from the same freshly imported pip and nothing it
+    changes (environment, logging, metadata caches) outlives it.
+    '''
+    out.flush()
+    pid = os.fork()
+
+    if pid == 0:
+        run_child(request, out)
+
+    return exit_code(os.waitpid(pid, 0)[1])
+
+def run_child(request: Dict, out) -> None:
+    '''
+    The forked child's side of run_command.  It never returns.
+    '''
+    returncode = 1
+
+    try:
+        os.environ.clear()
+        os.environ.update(request.get('env') or {})
+
+        if request.get('timeout'):
+            # the default action of SIGALRM ends the child
+            signal.alarm(max(1, ceil(request['timeout'])))
+
+        sys.stdout = MessageWriter(out, request['id'], 'stdout')
+        sys.stderr = MessageWriter(out, request['id'], 'stderr')
+
+        from pip._internal.cli.main import main as pip_main  # pylint: disable=import-outside-toplevel
+        returncode = pip_main(request['args'])
+    except SystemExit as e:
+        returncode = e.code if isinstance(e.code, int) else int(e.code is not None)
+    except BaseException:  # pylint: disable=broad-except
+        traceback.print_exc()
+    finally:
+        for writer in (sys.stdout, sys.stderr):
+            if isinstance(writer, MessageWriter):
+                writer.close()
+
+        out.flush()
+        os._exit(returncode)  # pylint: disable=protected-access
+
+def serve() -> int:
+    '''
+    The worker process: reads one JSON request per line and answers
+    with the command's output lines and then its return code.  It exits
+    when its stdin closes, or after a command changes pip itself.
+    '''
+    # keep the protocol on private descriptors, so stray writes to
+    # fd 1 (from extensions or commands pip runs) can't corrupt it
+    requests = os.fdopen(os.dup(0), 'r', encoding='utf8')
+    out = os.fdopen(os.dup(1), 'w', encoding='utf8')
+    os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+    os.dup2(2, 1)
+
+    for name in WORKER_MODULES:
+        import_module(name)
+
+    pip_stamp = module_stamp('pip')
+
+    for line in requests:
+        request = json.loads(line)
+        returncode = run_command(request, out)
+        timed_out = returncode == -signal.SIGALRM
+        write_message(out, {'id': request['id'], 'returncode': returncode, 'timed_out': timed_out})
+
+        if module_stamp('pip') != pip_stamp:
+            # the loaded pip is out of date, the client will start a new worker
+            return 0
+
+    return 0
+
+class ResidentWorker:
+    '''
+    Keeps a pip process (python -m ipydeps.worker) running for the
+    kernel, so pip commands skip interpreter startup and the pip import.
+    The worker is started on first use, and again if it has exited.
+    '''
+
+    def __init__(self, tail_lines: int, python: str=sys.executable):
+        self.tail_lines = tail_lines
+        self.python = python
+        self._lock = Lock()
+        self._proc: Optional[subprocess.Popen] = None
+        self._next_id = 0
+        self._cleanup_registered = False
+
+    def _start(self) -> subprocess.Popen:
+        if not self._cleanup_registered:
+            atexit.register(self.close)
+            self._cleanup_registered = True
+
+        env = dict(environ)
+
+        # so the worker finds ipydeps even when it's only on the kernel's sys.path
+        package_parent = str(Path(__file__).resolve().parent.parent)
+        env['PYTHONPATH'] = os.pathsep.join([p for p in [env.get('PYTHONPATH'), package_parent] if p])
+
+        logger.debug('Starting ipydeps worker for %s', self.python)
+        return subprocess.Popen(  # pylint: disable=consider-using-with
+            [self.python, '-m', 'ipydeps.worker'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=env,
+        )
+
+    def _send(self, request: Dict) -> subprocess.Popen:
+        if self._proc is None or self._proc.poll() is not None:
+            self._proc = self._start()
+
+        self._proc.stdin.write((json.dumps(request) + '\n').encode('utf8'))
+        self._proc.stdin.flush()
+        return self._proc
+
+    def _exited(self) -> None:
+        if self._proc is not None:
+            self._proc.kill()
+            self._proc.wait()
+            self._proc = None
+
+    def run(
+        self,
+        args: List[str],
+        env: Optional[Dict[str, str]]=None,
+        timeout: Optional[float]=None,
+        on_line: Optional[Callable[[str], None]]=None,
+    ) -> Tuple[int, Optional[str]]:
+        '''
+        Runs pip with the given arguments in the worker, with the same
+        streaming, stderr tail and return values as run_get_stderr.
+        '''
+        with self._lock:
+            for attempt in range(2):
+                self._next_id += 1
+                request = {'id': self._next_id, 'args': list(args), 'env': dict(env if env is not None else environ), 'timeout': timeout}
+
+                try:
+                    proc = self._send(request)
+                except OSError as e:
+                    logger.debug('Could not send a command to the ipydeps worker: %s', e)
+                    self._exited()
+                    continue
+
+                result, started = self._read_result(proc, request, on_line)
+
+                if result is not None:
+                    return result
+
+                self._exited()
+
+                # a command the worker never started is safe to send again
+                if started or attempt > 0:
+                    return 1, WORKER_EXITED
+
+            return 1, WORKER_EXITED
+
+    def _read_result(self, proc: subprocess.Popen, request: Dict, on_line) -> Tuple[Optional[Tuple[int, Optional[str]]], bool]:
+        err_tail: Deque[str] = deque(maxlen=self.tail_lines)
+        started = False
+
+        for raw in iter(proc.stdout.readline, b''):
+            message = json.loads(raw.decode('utf8', errors='replace'))
+
+            if message.get('id') != request['id']:
+                continue
+
+            started = True
+
+            if 'returncode' in message:
+                returncode = message['returncode']
+
+                if message.get('timed_out'):
+                    err_tail.append(f'Timed out after {request["timeout"]}s: pip {" ".join(request["args"])}')
+                    returncode = returncode or 1
+
+                return (returncode, None if returncode == 0 else '\n'.join(err_tail)), started
+
+            if message.get('stream') == 'stderr':
+                err_tail.append(message['line'])
+
+            if on_line is not None:
+                on_line(message['line'])
+
+        return None, started
+
+    def close(self) -> None:
+        with self._lock:
+            if self._proc is None:
+                return
+
+            try:
+                self._proc.stdin.close()
+                self._proc.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self._proc.kill()
+                self._proc.wait()
+
+            self._proc = None
+
+
+if __name__ == '__main__':
+    sys.exit(serve())
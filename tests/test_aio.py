@@ -0,0 +1,143 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+import asyncio
+import os
+import sys
+import time
+
+import ipydeps
+from ipydeps.aio import arun_get_stderr, arun_override_command, arun_overrides
+from ipydeps.ipydeps import OverrideCommand, exclusive_command_lock
+from ipydeps.report import InstallReport
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+def test_arun_get_stderr_streams_lines():
+    lines = []
+    report = InstallReport([])
+    code = 'import sys; print("out"); print("err", file=sys.stderr); sys.exit(3)'
+    returncode, err = run(arun_get_stderr(python(code), on_line=lines.append, report=report))
+
+    assert returncode == 3
+    assert err == 'err'
+    assert sorted(lines) == ['err', 'out']
+    assert report.subprocesses[0]['returncode'] == 3
+
+def test_arun_get_stderr_timeout():
+    returncode, err = run(arun_get_stderr(python('import time; time.sleep(10)'), timeout=0.2))
+    assert returncode != 0
+    assert 'Timed out' in err
+
+def test_arun_get_stderr_timeout_kills_children(tmp_path):
+    marker = tmp_path / 'marker'
+    child = f'import time; time.sleep(0.5); open({str(marker)!r}, "w").close()'
+    parent = f'import subprocess, sys, time; subprocess.Popen([sys.executable, "-c", {child!r}]); time.sleep(10)'
+
+    returncode, _ = run(arun_get_stderr(python(parent), timeout=0.2))
+    time.sleep(1)
+
+    assert returncode != 0
+    assert not marker.exists()
+
+def test_arun_get_stderr_cancel_kills_command(tmp_path):
+    pid_file = tmp_path / 'pid'
+    code = f'import os, time; open({str(pid_file)!r}, "w").write(str(os.getpid())); time.sleep(30)'
+
+    async def cancel_while_running():
+        task = asyncio.ensure_future(arun_get_stderr(python(code)))
+
+        while not pid_file.exists() or not pid_file.read_text():
+            await asyncio.sleep(0.05)
+
+        task.cancel()
+
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+
+        return False
+
+    start = time.time()
+    assert run(cancel_while_running())
+    assert time.time() - start < 10
+
+    # the command was killed and reaped, so its pid is gone
+    try:
+        os.kill(int(pid_file.read_text()), 0)
+    except ProcessLookupError:
+        pass
+    else:
+        raise AssertionError('the command survived the cancelled task')
+
+def test_arun_get_stderr_missing_command():
+    returncode, _ = run(arun_get_stderr(['surely-not-a-real-command-ipydeps']))
+    assert returncode == 127
+
+def test_subprocess_does_not_block_the_loop():
+    ticks = []
+
+    async def ticker():
+        while True:
+            ticks.append(1)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        task = asyncio.ensure_future(ticker())
+        await arun_get_stderr(python('import time; time.sleep(0.5)'))
+        task.cancel()
+
+    run(main())
+    assert len(ticks) > 10
+
+def test_cancelled_wait_for_exclusive_lock_releases_it():
+    async def main():
+        command = OverrideCommand(args=python('pass'), exclusive=True)
+        task = asyncio.ensure_future(arun_override_command(command, None, InstallReport([])))
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+        # the waiting thread gets the lock after the task was cancelled
+        exclusive_command_lock.release()
+
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+        await asyncio.sleep(0.2)
+
+    exclusive_command_lock.acquire()
+    run(main())
+
+    assert exclusive_command_lock.acquire(timeout=2)
+    exclusive_command_lock.release()
+
+def test_arun_overrides(tmp_path):
+    path = tmp_path / 'out.txt'
+    append = 'import sys; open(sys.argv[1], "a").write(sys.argv[2])'
+    overrides = {
+        'foo': [python(append) + [str(path), 'a'], python(append) + [str(path), 'b']],
+        'bar': [{'command': python('import sys; sys.exit(1)'), 'exclusive': True}],
+    }
+    report = InstallReport([])
+    results = run(arun_overrides(overrides, report=report))
+
+    assert path.read_text() == 'ab'
+    assert [r.returncode for r in results['foo'].results] == [0, 0]
+    assert results['bar'].results[0].returncode == 1
+    assert len(report.subprocesses) == 3
+
+def test_apip_stdlib_only():
+    report = run(ipydeps.apip(['json', 'os'], report=True))
+    assert report.stdlib == ['json', 'os']
+    assert report.subprocesses == []
@@ -0,0 +1,54 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+import sys
+
+from ipydeps.backends import PipBackend
+from ipydeps.backends import UvBackend
+from ipydeps.backends import get_backend
+from ipydeps.backends import pip_config_uv_args
+
+def test_pip_backend_prepare(tmp_path):
+    cmd, env = PipBackend().prepare(['install', 'foo'], {}, tmp_path / 'pip.conf', 'combined.pem', 'ca.pem')
+    assert cmd == [sys.executable, '-m', 'pip', 'install', '--client-cert=combined.pem', '--cert=ca.pem', 'foo']
+    assert env['PIP_CONFIG_FILE'] == str(tmp_path / 'pip.conf')
+
+def test_uv_backend_prepare(tmp_path):
+    pip_config = tmp_path / 'pip.conf'
+    pip_config.write_text('''[global]
+index-url = https://mirror/simple
+extra-index-url =
+    https://extra1/simple
+    https://extra2/simple
+trusted-host = mirror
+''')
+    cmd, env = UvBackend('/usr/bin/uv').prepare(['install', '-v', 'foo'], {}, pip_config, 'combined.pem', 'ca.pem')
+    assert cmd == [
+        '/usr/bin/uv', 'pip', 'install', '--python', sys.executable,
+        '--index-url=https://mirror/simple',
+        '--extra-index-url=https://extra1/simple',
+        '--extra-index-url=https://extra2/simple',
+        '--allow-insecure-host=mirror',
+        '-v', 'foo',
+    ]
+    assert env['SSL_CLIENT_CERT'] == 'combined.pem'
+    assert env['SSL_CERT_FILE'] == 'ca.pem'
+    assert 'PIP_CONFIG_FILE' not in env
+
+def test_uv_list_skips_index_args(tmp_path):
+    pip_config = tmp_path / 'pip.conf'
+    pip_config.write_text('[global]\nindex-url = https://mirror/simple\n')
+    cmd, _ = UvBackend('/usr/bin/uv').prepare(['list', '--format=freeze'], {}, pip_config)
+    assert cmd == ['/usr/bin/uv', 'pip', 'list', '--python', sys.executable, '--format=freeze']
+
+def test_pip_config_uv_args_without_config():
+    assert pip_config_uv_args(None) == []
+
+def test_get_backend_defaults_to_pip(monkeypatch):
+    monkeypatch.setattr(UvBackend, 'available', lambda self: False)
+    assert get_backend().name == 'pip'
+    assert get_backend('uv').name == 'pip'
+    assert get_backend('nonsense').name == 'pip'
+
+def test_get_backend_uv(monkeypatch):
+    monkeypatch.setattr(UvBackend, 'available', lambda self: True)
+    assert get_backend('uv').name == 'uv'
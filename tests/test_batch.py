@@ -0,0 +1,76 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from threading import Thread
+
+import pytest
+
+import ipydeps
+import ipydeps.ipydeps
+
+@pytest.fixture
+def installs(monkeypatch):
+    calls = []
+    monkeypatch.setattr(ipydeps.ipydeps, 'install_packages', lambda packages, **options: calls.append((packages, options)))
+    yield calls
+    ipydeps.ipydeps.deferred_installs.clear()
+
+def test_deferred_requests_are_merged(installs):
+    ipydeps.pip('Foo_Bar', defer=True)
+    ipydeps.pip(['baz', 'foo-bar'], defer=True)
+    assert len(installs) == 0
+
+    ipydeps.flush()
+    assert len(installs) == 1
+    assert installs[0][0] == ['baz', 'foo-bar']
+
+def test_flush_groups_by_options(installs):
+    ipydeps.pip('foo', defer=True)
+    ipydeps.pip('bar', use_pki=True, defer=True)
+    ipydeps.pip('baz', defer=True)
+    ipydeps.flush()
+
+    assert len(installs) == 2
+    assert installs[0][0] == ['baz', 'foo']
+    assert installs[1][0] == ['bar']
+    assert installs[1][1]['use_pki']
+
+def test_flush_with_nothing_deferred(installs):
+    ipydeps.flush()
+    assert len(installs) == 0
+
+def test_batch_context_manager(installs):
+    with ipydeps.batch():
+        ipydeps.pip('foo')
+
+        with ipydeps.batch():
+            ipydeps.pip('bar')
+
+        assert len(installs) == 0
+
+    assert installs[0][0] == ['bar', 'foo']
+
+def test_batch_that_raises_installs_nothing(installs):
+    with pytest.raises(KeyboardInterrupt):
+        with ipydeps.batch():
+            ipydeps.pip('foo')
+            raise KeyboardInterrupt
+
+    assert len(installs) == 0
+
+    ipydeps.flush()
+    assert installs[0][0] == ['foo']
+
+def test_batch_only_defers_its_own_thread(installs):
+    with ipydeps.batch():
+        thread = Thread(target=ipydeps.pip, args=('bar',))
+        thread.start()
+        thread.join()
+        assert installs == [('bar', installs[0][1])]
+
+        ipydeps.pip('foo')
+
+    assert installs[1][0] == ['foo']
+
+def test_pip_without_defer_installs_immediately(installs):
+    ipydeps.pip('foo')
+    assert installs[0][0] == 'foo'
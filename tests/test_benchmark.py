@@ -0,0 +1,237 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+'''
+End-to-end benchmarks for ipydeps.pip().  Each scenario installs into
+a throwaway venv from a local PEP 503 index of generated wheels, with
+a file:// dependencies_link for overrides, so no network is needed.
+They're marked benchmark and only run with pytest -m benchmark.
+Per-phase timings are printed with pytest -s, and written as JSON to
+$IPYDEPS_BENCHMARK_OUTPUT when it is set.
+
+The default run only checks how many subprocesses the cheap paths
+start, in this interpreter, since wall time depends on the machine.
+'''
+
+from functools import partial
+from hashlib import sha256
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Thread
+
+import base64
+import json
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+import ipydeps
+from ipydeps.backends import PipBackend
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+REPORT_MARKER = 'IPYDEPS-BENCHMARK-REPORT '
+SUBPROCESS_PHASES = ('run_pip', 'run_overrides')
+
+# wall time budget (seconds) for everything but the pip and override subprocesses
+HOT_PATH_BUDGET = 1.0
+
+DRIVER = f'''
+import json, sys
+import ipydeps
+report = ipydeps.pip(json.loads(sys.argv[1]), config='bench.conf', report=True)
+print({REPORT_MARKER!r} + report.to_json())
+'''
+
+OVERRIDE_PACKAGES = [f'bench-override-{i}' for i in range(8)]
+BULK_PACKAGES = [f'bench-bulk-{i:03d}' for i in range(120)]
+
+results = {}
+
+def record_hash(data):
+    return 'sha256=' + base64.urlsafe_b64encode(sha256(data).digest()).rstrip(b'=').decode('ascii')
+
+def make_wheel(directory, name, version='1.0', requires=()):
+    module = name.replace('-', '_')
+    dist_info = f'{module}-{version}.dist-info'
+    files = {
+        f'{module}/__init__.py': f'NAME = {name!r}\n',
+        f'{dist_info}/METADATA': ''.join(
+            [f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n'] + [f'Requires-Dist: {r}\n' for r in requires]
+        ),
+        f'{dist_info}/WHEEL': 'Wheel-Version: 1.0\nGenerator: ipydeps-benchmark\nRoot-Is-Purelib: true\nTag: py3-none-any\n',
+    }
+    record = ''.join(f'{path},{record_hash(text.encode())},{len(text.encode())}\n' for path, text in files.items())
+    files[f'{dist_info}/RECORD'] = record + f'{dist_info}/RECORD,,\n'
+    path = directory / f'{module}-{version}-py3-none-any.whl'
+
+    with zipfile.ZipFile(str(path), 'w') as whl:
+        for filename, text in files.items():
+            whl.writestr(filename, text)
+
+    return path
+
+def make_index(root, wheels):
+    '''
+    Lays out a PEP 503 simple index for the wheels under root/simple.
+    '''
+    simple = root / 'simple'
+    simple.mkdir()
+    names = sorted(wheels)
+
+    for name in names:
+        (simple / name).mkdir()
+        whl = wheels[name]
+        digest = sha256(whl.read_bytes()).hexdigest()
+        link = f'<a href="../../packages/{whl.name}#sha256={digest}">{whl.name}</a>'
+        (simple / name / 'index.html').write_text(f'<!DOCTYPE html><html><body>{link}</body></html>\n')
+
+    links = ''.join(f'<a href="{n}/">{n}</a>\n' for n in names)
+    (simple / 'index.html').write_text(f'<!DOCTYPE html><html><body>\n{links}</body></html>\n')
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+@pytest.fixture(scope='module')
+def bench(tmp_path_factory):
+    root = tmp_path_factory.mktemp('benchmark')
+    packages = root / 'packages'
+    packages.mkdir()
+
+    wheels = {'bench-cold-dep': make_wheel(packages, 'bench-cold-dep')}
+    wheels['bench-cold-a'] = make_wheel(packages, 'bench-cold-a', requires=['bench-cold-dep'])
+    wheels['bench-cold-b'] = make_wheel(packages, 'bench-cold-b')
+
+    for name in OVERRIDE_PACKAGES + BULK_PACKAGES:
+        wheels[name] = make_wheel(packages, name)
+
+    make_index(root, wheels)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=str(root)))
+    Thread(target=server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True).start()
+
+    venv = root / 'venv'
+    subprocess.run([sys.executable, '-m', 'venv', '--system-site-packages', '--without-pip', str(venv)], check=True)
+    python = venv / ('Scripts/python.exe' if os.name == 'nt' else 'bin/python')
+
+    override_command = [str(python), '-m', 'pip', 'install', '--no-deps', '--no-index', f'--find-links={packages}']
+    overrides = {'python-3': {name: [{'command': override_command + [name], 'exclusive': False}] for name in OVERRIDE_PACKAGES}}
+    (root / 'overrides.json').write_text(json.dumps(overrides))
+
+    config = root / 'home' / '.config' / 'ipydeps'
+    config.mkdir(parents=True)
+    (config / 'ipydeps.conf').write_text(f'[ipydeps]\ndependencies_link={(root / "overrides.json").as_uri()}\n')
+    (config / 'bench.conf').write_text(f'[global]\nindex-url = http://127.0.0.1:{server.server_address[1]}/simple/\n')
+
+    env = {k: v for k, v in os.environ.items() if not k.startswith(('PIP_', 'PYTHON'))}
+    env.update({
+        'HOME': str(root / 'home'),
+        'IPYDEPS_CONFIG_DIR': str(config),
+        'PYTHONPATH': str(REPO_ROOT),
+        'PIP_DISABLE_PIP_VERSION_CHECK': '1',
+        'PIP_NO_CACHE_DIR': '1',
+    })
+
+    def run(requested):
+        proc = subprocess.run(
+            [str(python), '-c', DRIVER, json.dumps(requested)],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            check=False,
+        )
+        lines = [line for line in proc.stdout.splitlines() if line.startswith(REPORT_MARKER)]
+        assert proc.returncode == 0 and len(lines) == 1, proc.stdout
+        return json.loads(lines[0][len(REPORT_MARKER):])
+
+    yield run
+
+    server.shutdown()
+    server.server_close()
+    print_results()
+
+def hot_path_seconds(report):
+    return sum(seconds for phase, seconds in report['phases'].items() if phase not in SUBPROCESS_PHASES)
+
+def measure(bench, scenario, requested):
+    report = bench(requested)
+    results[scenario] = {
+        'seconds': report['seconds'],
+        'hot_path_seconds': hot_path_seconds(report),
+        'phases': report['phases'],
+        'subprocesses': len(report['subprocesses']),
+    }
+    assert all(s['returncode'] == 0 for s in report['subprocesses']), report['subprocesses']
+    assert hot_path_seconds(report) < HOT_PATH_BUDGET, report['phases']
+    return report
+
+def print_results():
+    print()
+
+    for scenario, result in results.items():
+        phases = ', '.join(f'{p}={s:.3f}' for p, s in sorted(result['phases'].items()))
+        print(f'{scenario:20s} {result["seconds"]:7.3f}s  hot path {result["hot_path_seconds"]:.3f}s  {result["subprocesses"]} subprocesses  [{phases}]')
+
+    output = os.environ.get('IPYDEPS_BENCHMARK_OUTPUT')
+
+    if output:
+        Path(output).write_text(json.dumps(results, indent=2, sort_keys=True))
+
+@pytest.fixture
+def fake_pip(tmp_path, monkeypatch):
+    monkeypatch.setenv('IPYDEPS_CONFIG_DIR', str(tmp_path))
+    monkeypatch.setattr(PipBackend, 'run_args', [sys.executable, '-c', 'pass'])
+
+def test_stdlib_only_subprocesses(fake_pip):  # pylint: disable=redefined-outer-name,unused-argument
+    report = ipydeps.pip(['json', 'os', 're', 'sqlite3', 'collections'], report=True)
+    assert report.stdlib == ['collections', 'json', 'os', 're', 'sqlite3']
+    assert report.subprocesses == []
+
+def test_already_installed_subprocesses(fake_pip):  # pylint: disable=redefined-outer-name,unused-argument
+    report = ipydeps.pip(['pytest', 'packaging', 'pluggy'], report=True)
+    assert report.already_installed == ['packaging', 'pluggy', 'pytest']
+    assert report.subprocesses == []
+
+def test_cold_pip_subprocesses(fake_pip):  # pylint: disable=redefined-outer-name,unused-argument
+    report = ipydeps.pip(['bench-cold-a', 'bench-cold-b'], report=True)
+    assert report.pip == ['bench-cold-a', 'bench-cold-b']
+    assert len(report.subprocesses) == 1
+
+@pytest.mark.benchmark
+def test_stdlib_only(bench):
+    report = measure(bench, 'stdlib_only', ['json', 'os', 're', 'sqlite3', 'collections'])
+    assert report['stdlib'] == ['collections', 'json', 'os', 're', 'sqlite3']
+    assert report['subprocesses'] == []
+
+@pytest.mark.benchmark
+def test_already_installed(bench):
+    report = measure(bench, 'already_installed', ['pytest', 'packaging', 'pluggy'])
+    assert report['already_installed'] == ['packaging', 'pluggy', 'pytest']
+    assert report['subprocesses'] == []
+
+@pytest.mark.benchmark
+def test_cold_pip(bench):
+    report = measure(bench, 'cold_pip', ['bench-cold-a', 'bench-cold-b'])
+    assert report['pip'] == ['bench-cold-a', 'bench-cold-b']
+    assert report['new_packages'] == ['bench-cold-a', 'bench-cold-b', 'bench-cold-dep']
+    assert len(report['subprocesses']) == 1
+
+@pytest.mark.benchmark
+def test_override_heavy(bench):
+    report = measure(bench, 'override_heavy', OVERRIDE_PACKAGES)
+    assert report['overrides'] == sorted(OVERRIDE_PACKAGES)
+    assert report['pip'] == []
+    assert len(report['subprocesses']) == len(OVERRIDE_PACKAGES)
+
+@pytest.mark.benchmark
+def test_large_request(bench):
+    report = measure(bench, 'large_cold', BULK_PACKAGES)
+    assert report['pip'] == BULK_PACKAGES
+    assert len(report['subprocesses']) == 1
+
+    report = measure(bench, 'large_installed', BULK_PACKAGES)
+    assert report['already_installed'] == BULK_PACKAGES
+    assert report['subprocesses'] == []
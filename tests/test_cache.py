@@ -0,0 +1,105 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+
+import json
+
+import pytest
+
+from ipydeps.cache import CachedResponse
+from ipydeps.cache import read_cached_response
+from ipydeps.cache import write_cached_response
+from ipydeps.config import Config
+from ipydeps.ipydeps import dependencies_memo
+from ipydeps.ipydeps import py_name_major
+from ipydeps.ipydeps import read_dependencies_json
+
+class OverridesHandler(BaseHTTPRequestHandler):
+    body = b''
+    status = 200
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+
+        if self.status != 200:
+            self.send_response(self.status)
+            self.end_headers()
+            self.wfile.write(b'server error')
+        elif self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.end_headers()
+            self.wfile.write(self.body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+@pytest.fixture
+def server():
+    OverridesHandler.body = json.dumps({py_name_major(): {'Foo': [['echo', 'foo']]}}).encode('utf8')
+    OverridesHandler.status = 200
+    OverridesHandler.requests = []
+    httpd = HTTPServer(('127.0.0.1', 0), OverridesHandler)
+    thread = Thread(target=httpd.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}/overrides.json'
+    httpd.shutdown()
+    httpd.server_close()
+
+def make_config(link, max_age):
+    dependencies_memo.pop(link, None)
+    return Config(
+        dependencies_link=link,
+        dependencies_link_requires_pki=False,
+        dependencies_link_max_age=max_age,
+    )
+
+def test_cached_response_roundtrip(tmp_path):
+    response = CachedResponse(body='{}', etag='"x"', last_modified=None, fetched=12.5)
+    write_cached_response(tmp_path, 'http://example/deps.json', response)
+    assert read_cached_response(tmp_path, 'http://example/deps.json') == response
+    assert read_cached_response(tmp_path, 'http://example/other.json') is None
+
+def test_memoized_within_max_age(server, tmp_path):
+    config = make_config(server, 300)
+    first = read_dependencies_json(config, cache_dir=tmp_path)
+    second = read_dependencies_json(config, cache_dir=tmp_path)
+    assert first == second
+    assert 'Foo' in first[py_name_major()]
+    assert dependencies_memo[server][2] == {'foo': [['echo', 'foo']]}
+    assert len(OverridesHandler.requests) == 1
+
+def test_disk_cache_survives_new_process(server, tmp_path):
+    read_dependencies_json(make_config(server, 300), cache_dir=tmp_path)
+    dep_json = read_dependencies_json(make_config(server, 300), cache_dir=tmp_path)
+    assert 'Foo' in dep_json[py_name_major()]
+    assert len(OverridesHandler.requests) == 1
+
+def test_conditional_get_after_max_age(server, tmp_path):
+    read_dependencies_json(make_config(server, 0), cache_dir=tmp_path)
+    dep_json = read_dependencies_json(make_config(server, 0), cache_dir=tmp_path)
+    assert 'Foo' in dep_json[py_name_major()]
+    assert len(OverridesHandler.requests) == 2
+    assert OverridesHandler.requests[1].get('If-None-Match') == '"v1"'
+
+def test_falls_back_to_last_good_copy(server, tmp_path):
+    read_dependencies_json(make_config(server, 0), cache_dir=tmp_path)
+    OverridesHandler.status = 500
+    dep_json = read_dependencies_json(make_config(server, 0), cache_dir=tmp_path)
+    assert 'Foo' in dep_json[py_name_major()]
+
+def test_bad_json_falls_back_to_last_good_copy(server, tmp_path):
+    read_dependencies_json(make_config(server, 0), cache_dir=tmp_path)
+    OverridesHandler.body = b'{not json'
+    write_cached_response(tmp_path, server, read_cached_response(tmp_path, server)._replace(etag=None))
+    dep_json = read_dependencies_json(make_config(server, 0), cache_dir=tmp_path)
+    assert 'Foo' in dep_json[py_name_major()]
+
+def test_no_cache_and_unreachable(tmp_path):
+    config = make_config('http://127.0.0.1:9/overrides.json', 0)
+    assert read_dependencies_json(config, cache_dir=tmp_path) == {}
@@ -0,0 +1,44 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from pathlib import Path
+
+import os
+
+import pytest
+
+from ipydeps.config import DEFAULT_OVERRIDE_WORKERS, config_dir, load_config, state_dir
+
+def test_load_config_from_config_dir(tmp_path):
+    (tmp_path / 'ipydeps.conf').write_text(
+        '[ipydeps]\n'
+        'dependencies_link="file:///some/local/path.json"\n'
+        'dependencies_link_requires_pki=true\n'
+        'command_timeout=30\n'
+    )
+    config = load_config(tmp_path)
+
+    assert config.dependencies_link == 'file:///some/local/path.json'
+    assert config.dependencies_link_requires_pki
+    assert config.command_timeout == 30.0
+    assert config.override_workers == DEFAULT_OVERRIDE_WORKERS
+
+def test_load_config_without_file(tmp_path):
+    config = load_config(tmp_path)
+    assert config.dependencies_link is None
+    assert config.snapshot_dir is None
+
+def test_config_dir_from_environment(tmp_path):
+    assert config_dir({'IPYDEPS_CONFIG_DIR': str(tmp_path)}) == tmp_path
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='needs POSIX file ownership')
+def test_state_dir_is_private(tmp_path, monkeypatch):
+    monkeypatch.setattr(Path, 'home', classmethod(lambda cls: tmp_path / 'home'))
+
+    configs = tmp_path / 'configs'
+    assert state_dir(configs, 'locks') == configs / 'locks'
+
+    # a directory other users can write to is never trusted
+    shared = tmp_path / 'shared'
+    (shared / 'locks').mkdir(parents=True)
+    (shared / 'locks').chmod(0o777)
+    assert state_dir(shared, 'locks') == tmp_path / 'home' / '.cache' / 'ipydeps' / 'locks'
@@ -0,0 +1,57 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from pathlib import Path
+
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# budget for the cumulative time python -X importtime reports for import ipydeps
+IMPORT_TIME_BUDGET_US = 50000
+
+# modules import ipydeps must leave for the first pip() call
+DEFERRED_MODULES = [
+    'IPython',
+    'configparser',
+    'ipylogging',
+    'packaging',
+    'subprocess',
+    'urllib.request',
+]
+
+def run_python(code, *options):
+    env = dict(os.environ, PYTHONPATH=str(REPO_ROOT))
+    return subprocess.run(
+        [sys.executable] + list(options) + ['-c', code],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+def cumulative_import_time(stderr, module):
+    for line in stderr.splitlines():
+        parts = [p.strip() for p in line.split('|')]
+
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+
+    raise AssertionError(f'{module} not found in importtime output')
+
+def test_import_time_budget():
+    run_python('import ipydeps')  # make sure bytecode is cached
+    proc = run_python('import ipydeps', '-X', 'importtime')
+    assert cumulative_import_time(proc.stderr, 'ipydeps') < IMPORT_TIME_BUDGET_US
+
+def test_import_defers_heavy_modules():
+    proc = run_python('import sys, json, ipydeps; print(json.dumps(sorted(sys.modules)))')
+    modules = set(json.loads(proc.stdout))
+    assert [m for m in DEFERRED_MODULES if m in modules] == []
+
+def test_lazy_attributes():
+    proc = run_python('import ipydeps; print(ipydeps.pip.__module__, "pip" in dir(ipydeps))')
+    assert proc.stdout.split() == ['ipydeps.ipydeps', 'True']
@@ -0,0 +1,109 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+import os
+
+from ipydeps.installed import InstalledIndex
+from ipydeps.installed import modules_from_record
+from ipydeps.installed import read_metadata_headers
+from ipydeps.installed import top_level_modules
+
+def make_dist_info(site, name, version, dirname=None):
+    dirname = dirname or f'{name}-{version}.dist-info'
+    dist_info = site / dirname
+    dist_info.mkdir()
+    (dist_info / 'METADATA').write_text(f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n\nName: not-a-header\n')
+    return dist_info
+
+def bump_mtime(path):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+
+def test_read_metadata_headers(tmp_path):
+    dist_info = make_dist_info(tmp_path, 'Foo', '1.0')
+    assert read_metadata_headers(dist_info / 'METADATA') == ('Foo', '1.0')
+
+def test_index_names_are_normalized(tmp_path):
+    make_dist_info(tmp_path, 'PyYAML', '6.0')
+    make_dist_info(tmp_path, 'scikit_learn', '1.3.0')
+    (tmp_path / 'legacy-0.1.egg-info').write_text('Metadata-Version: 1.0\nName: Legacy\nVersion: 0.1\n')
+    (tmp_path / 'broken.dist-info').mkdir()
+
+    index = InstalledIndex([str(tmp_path)])
+    assert index.names() == {'pyyaml', 'scikit-learn', 'legacy'}
+
+def test_index_rescans_changed_entries(tmp_path):
+    make_dist_info(tmp_path, 'foo', '1.0')
+    index = InstalledIndex([str(tmp_path)])
+
+    assert index.refresh() == {str(tmp_path)}
+    assert index.refresh() == set()
+
+    make_dist_info(tmp_path, 'bar', '2.0')
+    bump_mtime(tmp_path)
+
+    assert index.refresh() == {str(tmp_path)}
+    assert index.names() == {'foo', 'bar'}
+
+def test_index_skips_missing_entries(tmp_path):
+    index = InstalledIndex([str(tmp_path / 'missing')])
+    assert len(index.names()) == 0
+
+def test_top_level_modules_from_top_level_txt(tmp_path):
+    dist_info = make_dist_info(tmp_path, 'beautifulsoup4', '4.12.0')
+    (dist_info / 'top_level.txt').write_text('bs4\n')
+    dist = InstalledIndex([str(tmp_path)]).distributions()[0]
+    assert top_level_modules(dist) == {'bs4'}
+
+def test_modules_from_record():
+    lines = [
+        'sklearn/__init__.py,sha256=abc,10',
+        'sklearn/base.py,sha256=abc,10',
+        'six.py,sha256=abc,10',
+        '_speedups.cpython-311-x86_64-linux-gnu.so,sha256=abc,10',
+        'scikit_learn-1.3.0.dist-info/RECORD,,',
+        '__pycache__/six.cpython-311.pyc,,',
+        '../../../bin/tool,sha256=abc,10',
+        'foo.pth,sha256=abc,10',
+    ]
+    assert modules_from_record(lines) == {'sklearn', 'six', '_speedups'}
+
+def test_import_name_index(tmp_path):
+    bs4 = make_dist_info(tmp_path, 'beautifulsoup4', '4.12.0')
+    (bs4 / 'top_level.txt').write_text('bs4\n')
+    sklearn = make_dist_info(tmp_path, 'scikit_learn', '1.3.0')
+    (sklearn / 'RECORD').write_text('sklearn/__init__.py,,\nscikit_learn-1.3.0.dist-info/RECORD,,\n')
+    pil = make_dist_info(tmp_path, 'Pillow', '10.0.0')
+    (pil / 'top_level.txt').write_text('PIL\n')
+
+    index = InstalledIndex([str(tmp_path)])
+    assert index.modules_by_distribution() == {
+        'beautifulsoup4': {'bs4'},
+        'scikit-learn': {'sklearn'},
+        'pillow': {'PIL'},
+    }
+    assert index.distributions_by_module() == {
+        'bs4': {'beautifulsoup4'},
+        'sklearn': {'scikit-learn'},
+        'pil': {'pillow'},
+    }
+
+def test_import_name_index_updates(tmp_path):
+    index = InstalledIndex([str(tmp_path)])
+    assert index.distributions_by_module() == {}
+
+    six = make_dist_info(tmp_path, 'six', '1.16.0')
+    (six / 'top_level.txt').write_text('six\n')
+    bump_mtime(tmp_path)
+    assert index.distributions_by_module() == {'six': {'six'}}
+
+def test_versions_first_entry_wins(tmp_path):
+    first = tmp_path / 'first'
+    second = tmp_path / 'second'
+    first.mkdir()
+    second.mkdir()
+    make_dist_info(first, 'Foo_Bar', '2.0')
+    make_dist_info(second, 'foo-bar', '1.0')
+    make_dist_info(second, 'baz', '3.0')
+
+    index = InstalledIndex([str(first), str(second)])
+    assert index.versions() == {'foo-bar': '2.0', 'baz': '3.0'}
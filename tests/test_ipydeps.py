@@ -1,18 +1,28 @@
 # vim: expandtab tabstop=4 shiftwidth=4
 
+from importlib.util import find_spec
+
 import json
+import sys
+import time
 
 import pytest
 
 from ipydeps.config import Config
 from ipydeps.ipydeps import find_overrides
-from ipydeps.ipydeps import get_freeze_package_name
 from ipydeps.ipydeps import get_pkg_names
-from ipydeps.ipydeps import process_pip_freeze_output
+from ipydeps.ipydeps import installed_index
+from ipydeps.ipydeps import invalidate_cache
+from ipydeps.ipydeps import map_import_names
+from ipydeps.ipydeps import requirement_name
+from ipydeps.ipydeps import run_get_stderr
+from ipydeps.ipydeps import STDERR_TAIL_LINES
 from ipydeps.ipydeps import py_name_major
 from ipydeps.ipydeps import py_name_minor
 from ipydeps.ipydeps import py_name_micro
+from ipydeps.ipydeps import subtract_importable
 from ipydeps.ipydeps import subtract_installed
+from ipydeps.ipydeps import subtract_satisfied
 from ipydeps.utils import normalize_package_names
 
 def test_get_pkg_names():
@@ -80,19 +90,6 @@ def test_version_specifier_combo_special_release():
     assert 'foobar>=1.0.0.post1.dev2' in packages
     assert 'baz<=2.1.5rc100.dev43+test' in packages
 
-def test_freeze_name_parsing():
-    name = get_freeze_package_name('six==1.10.0')
-    assert name == 'six'
-
-def test_freeze_editable_name_filtering():
-    pkgs = b'''arrow==0.12.1
--e git+git@gitserver.com:kafonek/package_name@githash#egg-package
-asn1crypto==0.23.0'''
-    pkgs = process_pip_freeze_output(pkgs)
-    assert len(pkgs) == 2
-    assert 'arrow' in pkgs
-    assert 'asn1crypto' in pkgs
-
 def test_normalize_package_names():
     packages = get_pkg_names(['foo==10.1', 'bar', 'baz<5.5.5', 'foo-bar', 'foo_baz'])
     packages = normalize_package_names(packages)
@@ -170,3 +167,114 @@ def test_all_overrides(tmp_path):
 
     assert len(overrides['foo']) == 2
     assert len(overrides['bar']) == 1
+
+def test_invalidate_cache_finds_new_modules(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    assert find_spec('newmod_for_ipydeps') is None  # caches the empty directory listing
+    dists_before = set(installed_index.distributions())
+
+    dist_info = tmp_path / 'newmod_for_ipydeps-1.0.dist-info'
+    dist_info.mkdir()
+    (dist_info / 'METADATA').write_text('Name: newmod-for-ipydeps\nVersion: 1.0\n')
+    (dist_info / 'top_level.txt').write_text('newmod_for_ipydeps\n')
+    (tmp_path / 'newmod_for_ipydeps.py').write_text('VALUE = 1\n')
+
+    start = time.time()
+    invalidate_cache(dists_before)
+    assert time.time() - start < 1
+
+    import newmod_for_ipydeps  # pylint: disable=import-error,import-outside-toplevel
+    assert newmod_for_ipydeps.VALUE == 1
+    sys.modules.pop('newmod_for_ipydeps')
+
+def test_run_get_stderr_streams_lines():
+    lines = []
+    code = 'import sys, time; print("first", flush=True); time.sleep(0.3); print("oops", file=sys.stderr); print("second")'
+    returncode, err = run_get_stderr([sys.executable, '-c', code], on_line=lambda line: lines.append((line, time.time())))
+
+    assert returncode == 0
+    assert err is None
+    assert sorted(line for line, _ in lines) == ['first', 'oops', 'second']
+
+    first = next(t for line, t in lines if line == 'first')
+    second = next(t for line, t in lines if line == 'second')
+    assert second - first > 0.2
+
+def test_run_get_stderr_keeps_stderr_tail():
+    code = 'import sys\nfor i in range(5000): print(i, file=sys.stderr)\nsys.exit(1)'
+    returncode, err = run_get_stderr([sys.executable, '-c', code])
+
+    assert returncode == 1
+    err_lines = err.split('\n')
+    assert len(err_lines) == STDERR_TAIL_LINES
+    assert err_lines[-1] == '4999'
+
+def test_run_get_stderr_timeout():
+    start = time.time()
+    returncode, err = run_get_stderr([sys.executable, '-c', 'import time; time.sleep(10)'], timeout=0.5)
+
+    assert time.time() - start < 5
+    assert returncode != 0
+    assert 'Timed out' in err
+
+def test_run_get_stderr_timeout_kills_children(tmp_path):
+    marker = tmp_path / 'marker'
+    child = f'import time; time.sleep(0.5); open({str(marker)!r}, "w").close()'
+    parent = f'import subprocess, sys, time; subprocess.Popen([sys.executable, "-c", {child!r}]); time.sleep(10)'
+
+    returncode, err = run_get_stderr([sys.executable, '-c', parent], timeout=0.2)
+    time.sleep(1)
+
+    assert returncode != 0
+    assert 'Timed out' in err
+    assert not marker.exists()
+
+def test_run_get_stderr_missing_command():
+    returncode, err = run_get_stderr(['ipydeps-no-such-command'])
+    assert returncode == 127
+    assert err
+
+def test_subtract_importable():
+    distributions_by_module = {
+        'sklearn': {'scikit-learn'},
+        'cv2': {'opencv-python-headless'},
+        'py': {'pytest'},
+        'pytest': {'pytest'},
+    }
+    installed_versions = {'scikit-learn': '1.2.0', 'opencv-python-headless': '4.8.0', 'pytest': '7.0.0'}
+
+    packages = subtract_importable(distributions_by_module, installed_versions, {'sklearn', 'sklearn>=1.0', 'cv2>=4', 'foo'})
+    assert packages == {'foo'}
+
+    # py.py ships with pytest, but py is a different distribution
+    assert subtract_importable(distributions_by_module, installed_versions, {'py', 'py>=1.0'}) == {'py', 'py>=1.0'}
+    assert subtract_importable(distributions_by_module, installed_versions, {'sklearn>=2'}) == {'sklearn>=2'}
+
+def test_map_import_names():
+    assert map_import_names({}, {'sklearn', 'bs4', 'foo'}) == {'scikit-learn', 'beautifulsoup4', 'foo'}
+    assert map_import_names({}, {'sklearn[alldeps]>=2; python_version >= "3"'}) == {'scikit-learn[alldeps]>=2; python_version >= "3"'}
+
+    # whatever is installed beats the table
+    distributions_by_module = {'cv2': {'opencv-python-headless'}, 'py': {'pytest'}, 'pytest': {'pytest'}}
+    assert map_import_names(distributions_by_module, {'cv2>=5', 'py'}) == {'opencv-python-headless>=5', 'py'}
+
+def test_requirement_name():
+    assert requirement_name('NumPy>=1.20') == 'numpy'
+    assert requirement_name('foo_bar[extra]==1.0') == 'foo-bar'
+    assert requirement_name('not valid!') == 'not valid!'
+
+def test_subtract_satisfied():
+    installed = {'numpy': '1.26.0', 'pandas': '2.1.0rc0', 'weird': 'not-a-version'}
+    requested = {
+        'numpy>=1.20',
+        'numpy<1.0',
+        'numpy',
+        'pandas>=2.0',
+        'scipy',
+        'weird',
+        'weird>=1.0',
+        'scipy; python_version < "3.0"',
+        'numpy[extra]',
+        'numpy[extra]; python_version < "3.0"',
+    }
+    assert subtract_satisfied(installed, requested) == {'numpy<1.0', 'numpy[extra]', 'scipy', 'weird>=1.0'}
@@ -0,0 +1,67 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from pathlib import Path
+
+import os
+import subprocess
+import sys
+import time
+
+from ipydeps.ipydeps import acquire_install_lock, record_install_result, release_install_lock
+from ipydeps.locks import install_key, install_lock, read_install_result, write_install_result
+from ipydeps.report import InstallReport
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+HOLD_LOCK = '''
+import sys, time
+from pathlib import Path
+from ipydeps.locks import install_lock, write_install_result
+lock = install_lock(Path(sys.argv[1]), sys.argv[2]).acquire()
+print('locked', flush=True)
+time.sleep(0.5)
+write_install_result(lock, {'succeeded': True, 'pip': ['foo']})
+lock.release()
+'''
+
+def test_install_key():
+    assert install_key(['b', 'a'], '/env') == install_key(['a', 'b'], '/env')
+    assert install_key(['a'], '/env') != install_key(['a'], '/other-env')
+    assert install_key(['a'], '/env') != install_key(['a', 'b'], '/env')
+
+def test_lock_waits_for_other_process(tmp_path):
+    key = install_key(['foo'])
+    env = dict(os.environ, PYTHONPATH=str(REPO_ROOT))
+    holder = subprocess.Popen([sys.executable, '-c', HOLD_LOCK, str(tmp_path), key], stdout=subprocess.PIPE, env=env)
+
+    try:
+        assert holder.stdout.readline().strip() == b'locked'
+        start = time.time()
+
+        with install_lock(tmp_path, key) as lock:
+            assert lock.waited
+            assert time.time() - start > 0.2
+            assert read_install_result(lock)['pip'] == ['foo']
+    finally:
+        holder.wait(10)
+        holder.stdout.close()
+
+def test_uncontended_lock(tmp_path):
+    with install_lock(tmp_path, install_key(['foo'])) as lock:
+        assert not lock.waited
+        assert read_install_result(lock) is None
+        write_install_result(lock, {'succeeded': False})
+        assert read_install_result(lock)['pid'] == os.getpid()
+
+def test_acquire_install_lock(tmp_path):
+    assert acquire_install_lock(tmp_path, set(), set()) == (None, set())
+
+    lock, packages = acquire_install_lock(tmp_path, {'surely-not-installed-pkg'}, set())
+
+    try:
+        assert packages == {'surely-not-installed-pkg'}
+        assert lock.path.parent == tmp_path / 'locks'
+        record_install_result(lock, InstallReport([]), True)
+        assert read_install_result(lock)['succeeded']
+    finally:
+        release_install_lock(lock)
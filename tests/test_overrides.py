@@ -0,0 +1,135 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+import sys
+import time
+
+from ipydeps.ipydeps import compile_overrides
+from ipydeps.ipydeps import is_exclusive_command
+from ipydeps.ipydeps import parse_override_command
+from ipydeps.ipydeps import py_name_major, py_name_micro, py_name_minor
+from ipydeps.ipydeps import overrides_capturable, run_overrides, satisfied_by_overrides
+from ipydeps.probes import OverrideRuns, probe_satisfied
+
+def sleep_and_append(path, text, seconds=0.0):
+    code = f'import time; time.sleep({seconds}); open({str(path)!r}, "a").write({text!r})'
+    return [sys.executable, '-c', code]
+
+def test_exclusive_commands():
+    assert is_exclusive_command(['yum', 'install', 'python3-numpy'])
+    assert is_exclusive_command(['sudo', '/usr/bin/dnf', 'install', 'python3-numpy'])
+    assert is_exclusive_command([sys.executable, '-m', 'pip', 'install', 'numpy'])
+    assert not is_exclusive_command(['echo', 'pip'])
+    assert not is_exclusive_command([])
+
+def test_parse_override_command():
+    assert parse_override_command(['yum', 'install', 'foo']).exclusive
+    assert not parse_override_command({'command': ['yum', 'install', 'foo'], 'exclusive': False}).exclusive
+    assert parse_override_command({'command': ['echo', 'foo'], 'exclusive': True}).exclusive
+
+def test_packages_run_concurrently(tmp_path):
+    overrides = {name: [sleep_and_append(tmp_path / name, name, 0.5)] for name in ('foo', 'bar', 'baz')}
+
+    start = time.time()
+    results = run_overrides(overrides, max_workers=3)
+    assert time.time() - start < 1.4
+
+    assert set(results) == {'foo', 'bar', 'baz'}
+    assert all(r.results[0].returncode == 0 for r in results.values())
+
+def test_package_commands_keep_order(tmp_path):
+    path = tmp_path / 'order'
+    overrides = {
+        'foo': [
+            sleep_and_append(path, '1', 0.2),
+            sleep_and_append(path, '2'),
+            [],
+            sleep_and_append(path, '3'),
+        ],
+    }
+    results = run_overrides(overrides, max_workers=2)
+    assert path.read_text() == '123'
+    assert len(results['foo'].results) == 3
+
+def test_exclusive_commands_do_not_overlap(tmp_path):
+    path = tmp_path / 'log'
+    overrides = {
+        name: [{'command': sleep_and_append(path, f'{name} ', 0.2), 'exclusive': True}]
+        for name in ('foo', 'bar')
+    }
+
+    start = time.time()
+    run_overrides(overrides, max_workers=2)
+    assert time.time() - start >= 0.4
+
+def test_failed_command_reported():
+    results = run_overrides({'foo': [[sys.executable, '-c', 'import sys; sys.exit(3)']]})
+    assert results['foo'].results[0].returncode == 3
+
+def test_compile_overrides_precedence():
+    dep_json = {
+        py_name_major(): {'Foo_Bar': [['major']], 'baz': [['major']]},
+        py_name_minor(): {'foo-bar': [['minor']]},
+        py_name_micro(): {'BAZ': [['micro']]},
+        'python-0': {'other': [['ignored']]},
+    }
+    assert compile_overrides(dep_json) == {'foo-bar': [['minor']], 'baz': [['micro']]}
+
+def test_compile_overrides_ignores_bad_sections():
+    assert compile_overrides({py_name_major(): ['not', 'a', 'mapping']}) == {}
+
+def test_probes(tmp_path):
+    assert probe_satisfied({'import': 'json', 'path': str(tmp_path)})
+    assert probe_satisfied({'import': ['json', 'os.path']})
+    assert not probe_satisfied({'import': 'no_such_module_ipydeps'})
+    assert not probe_satisfied({'path': [str(tmp_path), str(tmp_path / 'missing')]})
+    assert not probe_satisfied({})
+
+def test_satisfied_probe_skips_commands(tmp_path):
+    path = tmp_path / 'ran'
+    overrides = {
+        'foo': {'probe': {'import': 'json'}, 'commands': [sleep_and_append(path, 'foo')]},
+        'bar': {'probe': {'path': str(path)}, 'commands': [sleep_and_append(path, 'bar')]},
+    }
+    results = run_overrides(overrides)
+
+    assert results['foo'].results == [] and results['foo'].skipped == [sleep_and_append(path, 'foo')]
+    assert results['foo'].satisfied
+    assert path.read_text() == 'bar'
+    assert results['bar'].satisfied  # the probe is checked again after running
+    assert not overrides_capturable(results)
+
+def test_successful_runs_are_remembered(tmp_path):
+    path = tmp_path / 'ran'
+    runs_path = tmp_path / 'runs.json'
+    overrides = {
+        'foo': [
+            sleep_and_append(path, 'once '),
+            [sys.executable, '-c', 'import sys; sys.exit(1)'],
+        ],
+    }
+
+    first = run_overrides(overrides, runs=OverrideRuns(runs_path))
+    second = run_overrides(overrides, runs=OverrideRuns(runs_path))
+
+    assert path.read_text() == 'once '
+    assert [r.returncode for r in first['foo'].results] == [0, 1]
+    assert [r.args for r in second['foo'].results] == [overrides['foo'][1]]
+    assert second['foo'].skipped == [overrides['foo'][0]]
+
+def test_pip_commands_are_not_remembered(tmp_path):
+    runs = OverrideRuns(tmp_path / 'runs.json')
+    command = [sys.executable, '-m', 'pip', '--version']
+
+    run_overrides({'foo': [command]}, runs=runs)
+    results = run_overrides({'foo': [command]}, runs=runs)
+
+    assert results['foo'].results[0].returncode == 0
+    assert results['foo'].skipped == []
+    assert not runs.succeeded(command)
+
+def test_probes_only_satisfy_bare_names():
+    results = run_overrides({'pytest': {'probe': {'import': 'pytest'}, 'commands': []}})
+    assert results['pytest'].satisfied
+
+    requirements = {'pytest', 'pytest>=999', 'pytest[testing]', 'six'}
+    assert satisfied_by_overrides(results, requirements) == {'pytest>=999', 'pytest[testing]', 'six'}
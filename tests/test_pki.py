@@ -0,0 +1,65 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import stat
+import sys
+
+import pytest
+
+from ipydeps.pki import PKISession
+
+@pytest.fixture
+def pypki3(tmp_path, monkeypatch):
+    calls = {'decrypt': 0, 'ssl_context': 0}
+    key = tmp_path / 'key.pem'
+    cert = tmp_path / 'cert.pem'
+    key.write_bytes(b'KEY\n')
+    cert.write_bytes(b'CERT\n')
+
+    @contextmanager
+    def key_cert_paths():
+        calls['decrypt'] += 1
+        yield key, cert
+
+    def ssl_context():
+        calls['ssl_context'] += 1
+        return object()
+
+    module = SimpleNamespace(
+        NamedTemporaryKeyCertPaths=key_cert_paths,
+        ssl_context=ssl_context,
+        loader=SimpleNamespace(ca_path=lambda: '/path/to/ca.pem'),
+    )
+    monkeypatch.setitem(sys.modules, 'pypki3', module)
+    return calls
+
+def test_cert_paths_are_reused(pypki3):
+    session = PKISession()
+    combined, ca_path = session.cert_paths()
+
+    assert combined.read_bytes() == b'KEY\nCERT\n'
+    assert ca_path == '/path/to/ca.pem'
+    assert stat.S_IMODE(combined.stat().st_mode) == 0o600
+    assert stat.S_IMODE(combined.parent.stat().st_mode) == 0o700
+
+    assert session.cert_paths() == (combined, ca_path)
+    assert pypki3['decrypt'] == 1
+    session.close()
+
+def test_close_removes_the_cert(pypki3):
+    session = PKISession()
+    combined, _ = session.cert_paths()
+    session.close()
+    assert not combined.parent.exists()
+
+    # a new session starts on the next request
+    assert session.cert_paths()[0].exists()
+    assert pypki3['decrypt'] == 2
+    session.close()
+
+def test_ssl_context_is_cached(pypki3):
+    session = PKISession()
+    assert session.ssl_context() is session.ssl_context()
+    assert pypki3['ssl_context'] == 1
@@ -0,0 +1,64 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+import ipydeps
+
+from ipydeps.cache import CachedResponse
+from ipydeps.cache import write_cached_response
+from ipydeps.ipydeps import dependencies_memo
+from ipydeps.ipydeps import py_name_major
+from ipydeps.plans import plan_from_dict
+from ipydeps.plans import plan_to_dict
+
+LINK = 'http://127.0.0.1:9/overrides.json'
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    (tmp_path / 'ipydeps.conf').write_text(f'[ipydeps]\ndependencies_link={LINK}\ndependencies_link_max_age=0\n')
+    monkeypatch.setenv('IPYDEPS_CONFIG_DIR', str(tmp_path))
+    dependencies_memo.pop(LINK, None)
+    yield tmp_path
+    dependencies_memo.pop(LINK, None)
+
+@pytest.fixture
+def no_side_effects(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('plan() must not fetch or run anything')
+
+    monkeypatch.setattr('ipydeps.ipydeps.fetch_dependencies_link', fail)
+    monkeypatch.setattr(subprocess, 'Popen', fail)
+
+def test_plan_from_cached_overrides(config_dir, no_side_effects):  # pylint: disable=redefined-outer-name,unused-argument
+    body = json.dumps({py_name_major(): {'Some-Override': [['echo', 'hi']]}})
+    write_cached_response(config_dir / 'cache', LINK, CachedResponse(body=body, etag=None, last_modified=None, fetched=0))
+
+    plan = ipydeps.plan(['json', 'pytest', 'some_override', 'not-installed-anywhere>=1.0'])
+
+    assert plan.stdlib == ['json']
+    assert plan.already_installed == ['pytest']
+    assert plan.overrides == {'some-override': [['echo', 'hi']]}
+    assert plan.pip == ['not-installed-anywhere>=1.0', 'some-override']
+    assert plan_from_dict(json.loads(json.dumps(plan_to_dict(plan)))) == plan
+
+def test_plan_without_cached_overrides(config_dir, no_side_effects):  # pylint: disable=redefined-outer-name,unused-argument
+    plan = ipydeps.plan(['not-installed-anywhere'])
+    assert plan.overrides == {}
+    assert plan.pip == ['not-installed-anywhere']
+
+def test_plan_cli(config_dir):  # pylint: disable=redefined-outer-name,unused-argument
+    proc = subprocess.run(
+        [sys.executable, '-m', 'ipydeps', '--plan', 'json', 'pytest', 'not-installed-anywhere'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    plan = json.loads(proc.stdout)
+    assert plan['stdlib'] == ['json']
+    assert plan['already_installed'] == ['pytest']
+    assert plan['pip'] == ['not-installed-anywhere']
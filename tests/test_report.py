@@ -0,0 +1,88 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from threading import Thread
+
+import json
+import sys
+
+import ipydeps
+from ipydeps.report import InstallReport
+from ipydeps.report import emit_report
+from ipydeps.report import reporting
+from ipydeps.ipydeps import run_get_stderr
+from ipydeps.ipydeps import run_overrides
+
+def test_report_for_satisfied_request():
+    reports = []
+    ipydeps.add_report_callback(reports.append)
+
+    try:
+        report = ipydeps.pip(['json', 'pip'], report=True)
+    finally:
+        ipydeps.remove_report_callback(reports.append)
+
+    assert reports == [report]
+    assert report.stdlib == ['json']
+    assert report.already_installed == ['pip']
+    assert report.pip == []
+    assert report.subprocesses == []
+    assert 'currently_installed' in report.phases
+    assert report.seconds is not None
+
+def test_pip_returns_nothing_by_default():
+    assert ipydeps.pip('pip') is None
+
+def test_subprocesses_recorded():
+    report = InstallReport(['foo'])
+
+    with reporting(report):
+        run_get_stderr([sys.executable, '-c', 'import sys; sys.exit(2)'])
+
+    assert len(report.subprocesses) == 1
+    assert report.subprocesses[0]['returncode'] == 2
+
+def test_reporting_leaves_the_report_unfinished():
+    report = InstallReport(['foo'])
+
+    with reporting(report):
+        pass
+
+    assert report.seconds is None
+
+def test_other_threads_not_recorded():
+    report = InstallReport(['foo'])
+    thread = Thread(target=run_get_stderr, args=([sys.executable, '-c', 'pass'],))
+
+    with reporting(report):
+        thread.start()
+        thread.join()
+
+    assert report.subprocesses == []
+
+def test_override_threads_recorded():
+    report = InstallReport(['foo', 'bar'])
+    overrides = {
+        'foo': [[sys.executable, '-c', 'pass']],
+        'bar': [[sys.executable, '-c', 'pass']],
+    }
+
+    with reporting(report):
+        run_overrides(overrides, max_workers=2)
+
+    assert len(report.subprocesses) == 2
+
+def test_report_log_json_lines(tmp_path):
+    path = tmp_path / 'reports.jsonl'
+    report = InstallReport(['foo'])
+
+    with report.phase('run_pip'):
+        pass
+
+    report.finish()
+    emit_report(report, str(path))
+    emit_report(report, str(path))
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[0])['requested'] == ['foo']
+    assert 'run_pip' in json.loads(lines[0])['phases']
@@ -0,0 +1,66 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from time import perf_counter
+
+from ipydeps.requirements import parse_requirements
+
+def generated_requirements(n):
+    kinds = [
+        'pkg-{i}[Extra_B, extra-a] >= 1.{i}, <3 ; python_version >= "3.6"',
+        'Pkg_{i}=={i}.0.post1',
+        'pkg.{i}',
+    ]
+    return [kinds[i % len(kinds)].format(i=i) for i in range(n)]
+
+def test_pep_503_normalization():
+    assert parse_requirements('Foo.Bar foo__baz Zope.Interface') == {'foo-bar', 'foo-baz', 'zope-interface'}
+
+def test_extras_specifiers_and_markers():
+    assert parse_requirements(generated_requirements(3)) == {
+        'pkg-0[extra-a,extra-b]>=1.0,<3; python_version >= "3.6"',
+        'pkg-1==1.0.post1',
+        'pkg-2',
+    }
+    assert parse_requirements('foo (>=1, !=1.5)') == {'foo>=1,!=1.5'}
+
+def test_commas_between_requirements():
+    assert parse_requirements('numpy,pandas') == {'numpy', 'pandas'}
+    assert parse_requirements('numpy>=1.20, <2, pandas,six') == {'numpy>=1.20,<2', 'pandas', 'six'}
+
+def test_direct_urls_are_dropped():
+    assert parse_requirements('pkg @ https://host/pkg.whl numpy') == {'numpy'}
+    assert parse_requirements(['pkg[extra] @ https://host/pkg.whl ; python_version >= "3"', 'six']) == {'six'}
+
+def test_invalid_requirements_are_dropped():
+    requested = ['numpy', 'exec()', 'foo; import os', 'bar>=1,', 'baz[', '--index-url=https://example.com']
+    assert parse_requirements(requested) == {'numpy'}
+
+def test_requirements_files(tmp_path):
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'requirements.txt').write_text(
+        '# pinned\n'
+        'numpy>=1.20  # comment\n'
+        '--index-url https://example.com/simple\n'
+        '-r sub/more.txt\n'
+        'pandas==2.0 \\\n'
+        '    --hash=sha256:abc\n'
+    )
+    (tmp_path / 'sub' / 'more.txt').write_text('six\n--requirement=../requirements.txt\n')
+
+    assert parse_requirements(f'-r {tmp_path / "requirements.txt"}') == {'numpy>=1.20', 'pandas==2.0', 'six'}
+    assert parse_requirements('-rrequirements.txt', base=tmp_path) == {'numpy>=1.20', 'pandas==2.0', 'six'}
+
+def test_parsing_scales_linearly():
+    def seconds(n):
+        requirements = generated_requirements(n)
+        return min(timed(requirements) for _ in range(3))
+
+    def timed(requirements):
+        start = perf_counter()
+        assert len(parse_requirements(requirements)) == len(requirements)
+        return perf_counter() - start
+
+    small, large = seconds(1000), seconds(10000)
+
+    # ten times the input should take about ten times as long
+    assert large < 25 * small, f'1k requirements took {small:.4f}s, 10k took {large:.4f}s'
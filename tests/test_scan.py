@@ -0,0 +1,90 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+import json
+
+import ipydeps.scan
+from ipydeps.plans import plan_to_dict
+from ipydeps.scan import find_pip_calls, install_notebook, plan_notebook, plan_path, scan_notebook, strip_magics
+
+def write_notebook(path, *cells):
+    notebook = {
+        'cells': [
+            {'cell_type': 'code', 'source': source, 'outputs': [{'data': {'image/png': 'x' * 1000}}]}
+            for source in cells
+        ] + [{'cell_type': 'markdown', 'source': "ipydeps.pip('not-code')"}],
+        'nbformat': 4,
+    }
+    path.write_text(json.dumps(notebook), encoding='utf8')
+    return path
+
+def test_strip_magics():
+    assert strip_magics('%matplotlib inline\nx = 1') == 'pass\nx = 1'
+    assert strip_magics('if x:\n    !ls\n') == 'if x:\n    pass'
+    assert strip_magics('%%bash\necho hi') is None
+
+def test_find_pip_calls(tmp_path):
+    path = write_notebook(
+        tmp_path / 'nb.ipynb',
+        ['import ipydeps\n', "ipydeps.pip(['numpy', 'Foo_Bar'])\n"],
+        "%matplotlib inline\nimport ipydeps as d\nd.pip('requests', use_pki=True)",
+        "from ipydeps import pip as install\ninstall(requested_packages='six')",
+        "packages = ['dynamic']\nipydeps.pip(packages)",
+        "this is not python",
+    )
+    calls = find_pip_calls(path)
+
+    assert [c.packages for c in calls] == [['foo-bar', 'numpy'], ['requests'], ['six']]
+    assert calls[1].options.use_pki
+    assert [c.cell for c in calls] == [0, 1, 2]
+
+def test_scan_notebook_dedupes_and_groups(tmp_path):
+    path = write_notebook(
+        tmp_path / 'nb.ipynb',
+        "import ipydeps\nipydeps.pip(['numpy', 'six'])",
+        "ipydeps.pip('numpy')\nipydeps.pip('requests', config='other.conf')",
+    )
+    scanned = scan_notebook(path)
+
+    assert sorted(scanned.values()) == [['numpy', 'six'], ['requests']]
+
+def test_plan_notebook_is_cached(tmp_path, monkeypatch):
+    path = write_notebook(
+        tmp_path / 'nb.ipynb',
+        "import ipydeps\nipydeps.pip(['json', 'pytest', 'surely-not-installed-pkg'], use_overrides=False)",
+    )
+    calls = []
+    make_plan = ipydeps.scan.make_plan
+    monkeypatch.setattr(ipydeps.scan, 'make_plan', lambda *args, **kwargs: calls.append(args) or make_plan(*args, **kwargs))
+
+    (options, plan), = plan_notebook(path)
+    assert not options.use_overrides
+    assert plan.stdlib == ['json']
+    assert plan.already_installed == ['pytest']
+    assert plan.pip == ['surely-not-installed-pkg']
+    assert plan_path(path).exists()
+
+    assert plan_notebook(path) == [(options, plan)]
+    assert len(calls) == 1
+
+    # editing the requests invalidates the cached plan
+    write_notebook(path, "import ipydeps\nipydeps.pip('six', use_overrides=False)")
+    plan_notebook(path)
+    assert len(calls) == 2
+
+def test_install_notebook_replans(tmp_path, monkeypatch):
+    path = write_notebook(tmp_path / 'nb.ipynb', "import ipydeps\nipydeps.pip('surely-not-installed-pkg', use_overrides=False)")
+    (options, plan), = plan_notebook(path)
+
+    # a plan saved where the package was already installed
+    stale = plan._replace(already_installed=plan.pip, pip=[])
+    data = json.loads(plan_path(path).read_text())
+    data['batches'][0]['plan'] = plan_to_dict(stale)
+    plan_path(path).write_text(json.dumps(data))
+    assert plan_notebook(path) == [(options, stale)]
+
+    installed = []
+    monkeypatch.setattr(ipydeps.scan, 'install_packages', lambda packages, install_plan, **kwargs: installed.append(install_plan))
+    install_notebook(path)
+
+    assert [p.pip for p in installed] == [['surely-not-installed-pkg']]
+    assert plan_notebook(path) == [(options, plan)]
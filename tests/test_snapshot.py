@@ -0,0 +1,127 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+from pathlib import Path
+
+import io
+import os
+import tarfile
+
+import pytest
+
+import ipydeps.snapshot
+from ipydeps.installed import Distribution
+from ipydeps.config import Config
+from ipydeps.snapshot import restore_snapshot, save_snapshot, snapshot_key, snapshot_path
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    dirs = {'purelib': tmp_path / 'lib' / 'site', 'platlib': tmp_path / 'lib' / 'site', 'scripts': tmp_path / 'bin'}
+    dirs['purelib'].mkdir(parents=True)
+    dirs['scripts'].mkdir()
+    monkeypatch.setattr(ipydeps.snapshot, 'site_dirs', lambda: dirs)
+    return dirs['purelib']
+
+def install_fake(site_dir, name, version='1.0'):
+    (site_dir / name).mkdir(exist_ok=True)
+    (site_dir / name / '__init__.py').write_text('VALUE = 1\n')
+    script = site_dir.parent.parent / 'bin' / name
+
+    if script.parent.is_dir():
+        script.write_text('#!/usr/bin/python\n')
+        script.chmod(0o755)
+
+    dist_info = site_dir / f'{name}-1.0.dist-info'
+    dist_info.mkdir()
+    (dist_info / 'METADATA').write_text(f'Name: {name}\nVersion: 1.0\n')
+    (dist_info / 'RECORD').write_text(
+        f'{name}/__init__.py,,\n'
+        f'{name}/__pycache__/__init__.cpython-311.pyc,,\n'
+        f'{name}-1.0.dist-info/METADATA,,\n'
+        f'{name}-1.0.dist-info/RECORD,,\n'
+        f'../../bin/{name},,\n'
+    )
+    return Distribution(name=name, version=version, path=dist_info)
+
+def test_snapshot_key():
+    key = snapshot_key(['b', 'a'], 'python-3.11.7', {})
+    assert key == snapshot_key(['a', 'b'], 'python-3.11.7', {})
+    assert key != snapshot_key(['a', 'b'], 'python-3.11.8', {})
+    assert key != snapshot_key(['a', 'b'], 'python-3.11.7', {'python-3': {'a': [['true']]}})
+
+    numpy = Distribution(name='numpy', version='1.26.0', path=Path('/site/numpy-1.26.0.dist-info'))
+    assert key != snapshot_key(['a', 'b'], 'python-3.11.7', {}, [numpy])
+    assert snapshot_key(['a'], 'python-3.11.7', {}, [numpy]) == snapshot_key(['a'], 'python-3.11.7', {}, [numpy._replace(path=Path('/other'))])
+    assert snapshot_key(['a'], 'python-3.11.7', {}, [numpy]) != snapshot_key(['a'], 'python-3.11.7', {}, [numpy._replace(version='2.0.0')])
+
+def test_save_and_restore(tmp_path, site):
+    dist = install_fake(site, 'foo')
+    snapshot = tmp_path / 'snapshots' / 'key.tar.gz'
+    assert save_snapshot(snapshot, [dist])
+
+    with tarfile.open(str(snapshot)) as tar:
+        names = set(tar.getnames())
+
+    assert 'purelib/foo/__init__.py' in names
+    assert 'scripts/foo' in names
+    assert not any('__pycache__' in n for n in names)
+
+    script = tmp_path / 'bin' / 'foo'
+    script.unlink()
+
+    for path in sorted(site.rglob('*'), reverse=True):
+        path.unlink() if path.is_file() else path.rmdir()
+
+    assert restore_snapshot(snapshot)
+    assert (site / 'foo' / '__init__.py').read_text() == 'VALUE = 1\n'
+    assert (site / 'foo-1.0.dist-info' / 'METADATA').exists()
+    assert os.access(str(script), os.X_OK)
+
+def test_save_skips_files_outside_known_dirs(tmp_path, site):
+    dist = install_fake(site, 'foo')
+
+    with (dist.path / 'RECORD').open('a') as f:
+        f.write('../../include/foo.h,,\n')
+
+    assert not save_snapshot(tmp_path / 'key.tar.gz', [dist])
+
+def test_save_skips_upgrades(tmp_path, site):
+    old = Distribution(name='Foo', version='0.9', path=site / 'foo-0.9.dist-info')
+    dist = install_fake(site, 'foo')
+    assert not save_snapshot(tmp_path / 'key.tar.gz', [dist], [old])
+    assert not (tmp_path / 'key.tar.gz').exists()
+
+def test_snapshot_path_must_be_private(tmp_path):
+    snapshot_dir = tmp_path / 'snapshots'
+    config = Config(None, False, snapshot_dir=str(snapshot_dir))
+    assert snapshot_path(config, 'key') == snapshot_dir / 'key.tar.gz'
+
+    snapshot_dir.chmod(0o777)
+    assert snapshot_path(config, 'key') is None
+
+def test_save_skips_dists_outside_site_dirs(tmp_path, site):
+    elsewhere = tmp_path / 'elsewhere'
+    elsewhere.mkdir()
+    dist = install_fake(elsewhere, 'foo')
+    assert not save_snapshot(tmp_path / 'key.tar.gz', [dist])
+    assert not (tmp_path / 'key.tar.gz').exists()
+
+def test_restore_rejects_unsafe_members(tmp_path, site):
+    snapshot = tmp_path / 'evil.tar.gz'
+
+    with tarfile.open(str(snapshot), 'w:gz') as tar:
+        for name in ('purelib/../../escaped.py', '/abs.py', 'other/x.py', 'purelib/ok.py'):
+            info = tarfile.TarInfo(name)
+            info.size = 1
+            tar.addfile(info, io.BytesIO(b'x'))
+
+        link = tarfile.TarInfo('purelib/link')
+        link.type = tarfile.SYMTYPE
+        link.linkname = '/etc/passwd'
+        tar.addfile(link)
+
+    assert restore_snapshot(snapshot)
+    assert sorted(p.name for p in site.iterdir()) == ['ok.py']
+    assert not (tmp_path / 'escaped.py').exists()
+
+def test_restore_missing_snapshot(tmp_path, site):
+    assert not restore_snapshot(tmp_path / 'missing.tar.gz')
@@ -4,18 +4,41 @@ import pytest
 import sys
 
 from ipydeps.ipydeps import subtract_stdlib
-from ipydeps.utils import get_stdlib_packages
+from ipydeps.utils import get_stdlib_packages, stdlib_artifact
 
 def test_stdlib_py2():
     packages = get_stdlib_packages(version=2)
-    assert len(packages) == 277
+    assert len(packages) == 318
+    assert 'urllib2' in packages
 
 def test_stdlib_py3():
     packages = get_stdlib_packages(version=3)
     if sys.version_info.minor >= 10:
         assert len(packages) >= 303
     else:
-        assert len(packages) == 203
+        assert packages == stdlib_artifact()[f'3.{sys.version_info.minor}']
+
+    assert len(get_stdlib_packages(3, 6)) == 222
+
+def test_stdlib_every_supported_minor():
+    for minor in range(6, 15):
+        packages = get_stdlib_packages(3, minor)
+        assert len(packages) >= 150
+        assert 'json' in packages
+
+    assert 'asynchat' in get_stdlib_packages(3, 9)
+    assert 'asynchat' not in get_stdlib_packages(3, 12)
+
+def test_stdlib_unknown_minor():
+    assert get_stdlib_packages(3, 99) == get_stdlib_packages(3, 14)
+    assert get_stdlib_packages(3, 0) == get_stdlib_packages(3, 6)
+    assert len(get_stdlib_packages(4, 0)) == 0
+
+def test_stdlib_memoized():
+    assert get_stdlib_packages(3, 8) is get_stdlib_packages(3, 8)
+
+def test_stdlib_names_normalized():
+    assert 'py-compile' in get_stdlib_packages(3, 8)
 
 def test_without_stdlib_packages():
     stdlib_packages = get_stdlib_packages()
@@ -0,0 +1,34 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+import json
+
+import ipydeps
+import ipydeps.ipydeps
+from ipydeps.config import Config
+from ipydeps.ipydeps import dependencies_memo
+from ipydeps.ipydeps import py_name_major
+
+def test_warmup_fills_caches(tmp_path, monkeypatch):
+    path = tmp_path / 'overrides.json'
+    path.write_text(json.dumps({py_name_major(): {'foo': [['echo', 'foo']]}}))
+    link = 'file://' + path.as_posix()
+    config = Config(dependencies_link=link, dependencies_link_requires_pki=False)
+    monkeypatch.setattr(ipydeps.ipydeps, 'load_config', lambda path: config)
+
+    threads = ipydeps.warmup()
+
+    for thread in threads:
+        thread.join(10)
+        assert not thread.is_alive()
+
+    assert 'foo' in dependencies_memo[link][2]
+    assert 'pip' in ipydeps.ipydeps.installed_index.versions()
+
+def test_warmup_errors_are_contained(monkeypatch):
+    def broken(path):
+        raise RuntimeError('broken config')
+
+    monkeypatch.setattr(ipydeps.ipydeps, 'load_config', broken)
+
+    for thread in ipydeps.warmup():
+        thread.join(10)
@@ -0,0 +1,98 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+import json
+import sys
+
+from ipydeps.backends import PipBackend
+from ipydeps.config import Config
+from ipydeps.ipydeps import run_pip
+from ipydeps.wheelhouse import parse_archive_name
+from ipydeps.wheelhouse import saved_archives
+from ipydeps.wheelhouse import update_pins
+from ipydeps.wheelhouse import wheelhouse_available
+from ipydeps.wheelhouse import wheelhouse_covers
+from ipydeps.wheelhouse import wheelhouse_path
+
+FAKE_PIP = '''
+import json, sys
+with open(sys.argv[1], 'a') as f:
+    f.write(json.dumps(sys.argv[2:]) + '\\n')
+sys.exit(1 if '--no-index' in sys.argv and sys.argv[2] == 'fail-offline' else 0)
+'''
+
+def fake_pip(tmp_path, monkeypatch, mode):
+    script = tmp_path / 'fake_pip.py'
+    script.write_text(FAKE_PIP)
+    log = tmp_path / 'calls.jsonl'
+    monkeypatch.setattr(PipBackend, 'run_args', [sys.executable, str(script), str(log), mode])
+    return log
+
+def read_calls(log):
+    return [json.loads(line) for line in log.read_text().splitlines()]
+
+def make_wheelhouse(tmp_path):
+    wheelhouse = tmp_path / 'wheelhouse'
+    wheelhouse.mkdir()
+    (wheelhouse / 'foo-1.0-py3-none-any.whl').write_bytes(b'')
+    return wheelhouse
+
+def test_parse_archive_name():
+    assert parse_archive_name('demo_pkg-0.1-py3-none-any.whl') == ('demo_pkg', '0.1')
+    assert parse_archive_name('numpy-1.26.0-cp311-cp311-manylinux_2_17_x86_64.whl') == ('numpy', '1.26.0')
+    assert parse_archive_name('python-dateutil-2.8.2.tar.gz') == ('python-dateutil', '2.8.2')
+    assert parse_archive_name('README.txt') is None
+
+def test_saved_archives():
+    output = '''Looking in links: links
+Saved ./dest/demo_pkg-0.1-py3-none-any.whl
+  File was already downloaded /tmp/dest/Other_Pkg-2.0.tar.gz
+Successfully downloaded demo-pkg other-pkg'''
+    assert saved_archives(output) == ['demo_pkg-0.1-py3-none-any.whl', 'Other_Pkg-2.0.tar.gz']
+
+def test_update_pins(tmp_path):
+    update_pins(tmp_path, ['demo_pkg-0.1-py3-none-any.whl'])
+    pins = update_pins(tmp_path, ['demo_pkg-0.2-py3-none-any.whl', 'Other_Pkg-2.0.tar.gz'])
+    assert pins == {'demo-pkg': '0.2', 'other-pkg': '2.0'}
+    assert (tmp_path / 'pins.txt').read_text() == 'demo-pkg==0.2\nother-pkg==2.0\n'
+
+def test_wheelhouse_path(tmp_path):
+    assert wheelhouse_path(Config(None, False), tmp_path) == tmp_path / 'wheelhouse'
+    assert wheelhouse_path(Config(None, False, wheelhouse='/srv/wheels'), tmp_path).as_posix() == '/srv/wheels'
+
+def test_wheelhouse_available(tmp_path):
+    assert not wheelhouse_available(None)
+    assert not wheelhouse_available(tmp_path / 'missing')
+    assert not wheelhouse_available(tmp_path)
+    assert wheelhouse_available(make_wheelhouse(tmp_path))
+
+def test_wheelhouse_covers(tmp_path):
+    wheelhouse = make_wheelhouse(tmp_path)
+    (wheelhouse / 'Other_Pkg-2.0.tar.gz').write_bytes(b'')
+    assert wheelhouse_covers(wheelhouse, ['foo', 'other-pkg'])
+    assert not wheelhouse_covers(wheelhouse, ['foo', 'bar'])
+
+def test_run_pip_without_wheelhouse(tmp_path, monkeypatch):
+    log = fake_pip(tmp_path, monkeypatch, 'ok')
+    assert run_pip(['foo'], False, False, None, tmp_path / 'missing') == (0, None)
+    assert read_calls(log) == [['ok', 'install', 'foo']]
+
+def test_run_pip_offline_first(tmp_path, monkeypatch):
+    log = fake_pip(tmp_path, monkeypatch, 'ok')
+    wheelhouse = make_wheelhouse(tmp_path)
+    assert run_pip(['foo'], False, False, None, wheelhouse) == (0, None)
+    assert read_calls(log) == [['ok', 'install', f'--find-links={wheelhouse}', '--no-index', 'foo']]
+
+def test_run_pip_falls_back_to_index(tmp_path, monkeypatch):
+    log = fake_pip(tmp_path, monkeypatch, 'fail-offline')
+    wheelhouse = make_wheelhouse(tmp_path)
+    assert run_pip(['foo'], False, False, None, wheelhouse) == (0, None)
+
+    calls = read_calls(log)
+    assert len(calls) == 2
+    assert calls[1] == ['fail-offline', 'install', f'--find-links={wheelhouse}', 'foo']
+
+def test_run_pip_skips_offline_for_missing_archives(tmp_path, monkeypatch):
+    log = fake_pip(tmp_path, monkeypatch, 'ok')
+    wheelhouse = make_wheelhouse(tmp_path)
+    assert run_pip(['foo>=1.0', 'bar'], False, False, None, wheelhouse) == (0, None)
+    assert read_calls(log) == [['ok', 'install', f'--find-links={wheelhouse}', 'foo>=1.0', 'bar']]
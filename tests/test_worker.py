@@ -0,0 +1,48 @@
+# vim: expandtab tabstop=4 shiftwidth=4
+
+import os
+
+import pytest
+
+from ipydeps.backends import get_backend
+from ipydeps.ipydeps import run_pip_command
+from ipydeps.worker import ResidentWorker
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork'), reason='the resident worker needs os.fork')
+
+@pytest.fixture
+def worker():
+    resident = ResidentWorker(tail_lines=20)
+    yield resident
+    resident.close()
+
+def test_runs_pip_commands(worker):  # pylint: disable=redefined-outer-name
+    lines = []
+    assert worker.run(['--version'], on_line=lines.append) == (0, None)
+    assert lines[0].startswith('pip ')
+
+    returncode, err = worker.run(['no-such-command'])
+    assert returncode != 0
+    assert 'no-such-command' in err
+
+def test_commands_get_their_environment(worker, tmp_path):  # pylint: disable=redefined-outer-name
+    pip_config = tmp_path / 'pip.conf'
+    pip_config.write_text('[global]\ntimeout = 7\n')
+    env = dict(os.environ, PIP_CONFIG_FILE=str(pip_config))
+    lines = []
+
+    assert worker.run(['config', 'list'], env=env, on_line=lines.append) == (0, None)
+    assert "global.timeout='7'" in lines
+
+def test_restarts_after_exit(worker):  # pylint: disable=redefined-outer-name
+    assert worker.run(['--version'])[0] == 0
+    worker._proc.kill()  # pylint: disable=protected-access
+    assert worker.run(['--version'])[0] == 0
+
+def test_pip_commands_in_worker():
+    backend = get_backend('pip', resident=True)
+    assert backend.resident
+
+    lines = []
+    assert run_pip_command(['list', '--format=freeze'], False, None, backend, on_line=lines.append) == (0, None)
+    assert any(line.startswith('pytest==') for line in lines)
@@ -1,23 +1,40 @@
 # vim: expandtab tabstop=4 shiftwidth=4
 
+import json
+
 from stdlib_list import stdlib_list
 
+from ipydeps.utils import normalize_package_names
+
+# every Python version ipydeps supports, keyed by major.minor
+VERSIONS = {
+    '2.7': '2.7',
+    '3.6': '3.6',
+    '3.7': '3.7',
+    '3.8': '3.8',
+    '3.9': '3.9',
+    '3.10': '3.10',
+    '3.11': '3.11',
+    '3.12': '3.12',
+    '3.13': '3.13',
+    '3.14': '3.14',
+}
+
 def good_lib(lib):
     if '.' in lib or '__' in lib or lib.startswith('_'):
         return False
     return True
 
 def main():
-    libs2 = sorted(list(set([ lib.lower() for lib in stdlib_list("2.7") if good_lib(lib) ])))
-    libs3 = sorted(list(set([ lib.lower() for lib in stdlib_list("3.6") if good_lib(lib) ])))
+    libs = {}
 
-    with open('ipydeps/data/libs2.txt', 'w') as f:
-        for lib in libs2:
-            f.write(lib + '\n')
+    for key, version in VERSIONS.items():
+        names = normalize_package_names({lib for lib in stdlib_list(version) if good_lib(lib)})
+        libs[key] = sorted(names)
 
-    with open('ipydeps/data/libs3.txt', 'w') as f:
-        for lib in libs3:
-            f.write(lib + '\n')
+    with open('ipydeps/data/stdlib.json', 'w') as f:
+        json.dump(libs, f, indent=0, sort_keys=True)
+        f.write('\n')
 
 if __name__ == "__main__":
     main()